@@ -1,6 +1,7 @@
 import os
-import requests
+import uuid
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import mplfinance as mpf
@@ -8,34 +9,28 @@ from io import BytesIO
 import base64
 from dotenv import load_dotenv
 import logging
+from tinkoff_client import client, TinkoffAPIError
+from cache import SingleFlightCache
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
 
-# Конфигурация
-TINKOFF_TOKEN = os.getenv('TINKOFF_SANDBOX_TOKEN')
-BASE_URL = 'https://sandbox-invest-public-api.tinkoff.ru/rest'
+# Кэш цен и портфеля: одновременные запросы ждут один вызов API
+PRICES_CACHE_TTL = float(os.getenv('PRICES_CACHE_TTL', 2))
+PORTFOLIO_CACHE_TTL = float(os.getenv('PORTFOLIO_CACHE_TTL', 5))
+prices_cache = SingleFlightCache(PRICES_CACHE_TTL)
+portfolio_cache = SingleFlightCache(PORTFOLIO_CACHE_TTL)
 
 def get_sandbox_accounts():
     """Получить список счетов в песочнице"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.UsersService/GetAccounts",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={}
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = client.call_sync("UsersService/GetAccounts", {})
         accounts = data.get('accounts', [])
         logging.info(f"Found {len(accounts)} sandbox accounts")
         return [account['id'] for account in accounts]
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_sandbox_accounts: {str(e)}, Response: {e.response.text}")
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_sandbox_accounts: {str(e)}, Response: {e.text}")
         return []
     except Exception as e:
         logging.error(f"Error in get_sandbox_accounts: {str(e)}")
@@ -51,22 +46,12 @@ def open_sandbox_account():
             return accounts[0]
         
         # Создаём новый счёт
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.SandboxService/OpenSandboxAccount",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={}
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = client.call_sync("SandboxService/OpenSandboxAccount", {})
         account_id = data['accountId']
         logging.info(f"Created new sandbox account: {account_id}")
         return account_id
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in open_sandbox_account: {str(e)}, Response: {e.response.text}")
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in open_sandbox_account: {str(e)}, Response: {e.text}")
         return None
     except Exception as e:
         logging.error(f"Error in open_sandbox_account: {str(e)}")
@@ -75,173 +60,255 @@ def open_sandbox_account():
 def sandbox_pay_in(account_id, amount):
     """Пополнить счёт песочницы рублями"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.SandboxService/SandboxPayIn",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "accountId": account_id,
-                "amount": {
-                    "units": str(amount),
-                    "nano": 0,
-                    "currency": "rub"
-                }
+        return client.call_sync("SandboxService/SandboxPayIn", {
+            "accountId": account_id,
+            "amount": {
+                "units": str(amount),
+                "nano": 0,
+                "currency": "rub"
             }
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in sandbox_pay_in: {str(e)}, Response: {e.response.text}")
+        })
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in sandbox_pay_in: {str(e)}, Response: {e.text}")
         return None
     except Exception as e:
         logging.error(f"Error in sandbox_pay_in: {str(e)}")
         return None
 
+def _fetch_portfolio(account_id):
+    data = client.call_sync("OperationsService/GetPortfolio", {
+        "accountId": account_id
+    })
+    positions = []
+    for item in data.get('positions', []):
+        positions.append({
+            'figi': item['figi'],
+            'quantity': float(item['quantity']['units']) + float(item['quantity']['nano']) / 1e9
+        })
+    return {
+        'totalAmount': float(data.get('totalAmountPortfolio', {}).get('units', 0)),
+        'positions': positions
+    }
+
 def get_portfolio(account_id):
-    """Получить портфель"""
+    """Получить портфель (через кэш, результат не изменять)"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OperationsService/GetPortfolio",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "accountId": account_id
-            }
-        )
-        response.raise_for_status()
-        data = response.json()
-        positions = []
-        for item in data.get('positions', []):
-            positions.append({
-                'figi': item['figi'],
-                'quantity': float(item['quantity']['units']) + float(item['quantity']['nano']) / 1e9
-            })
-        return {
-            'totalAmount': float(data.get('totalAmountPortfolio', {}).get('units', 0)),
-            'positions': positions
-        }
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_portfolio: {str(e)}, Response: {e.response.text}")
+        return portfolio_cache.get(account_id, lambda: _fetch_portfolio(account_id))
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_portfolio: {str(e)}, Response: {e.text}")
         return {'totalAmount': 0, 'positions': []}
     except Exception as e:
         logging.error(f"Error in get_portfolio: {str(e)}")
         return {'totalAmount': 0, 'positions': []}
 
-def get_current_prices():
-    """Получить текущие цены валют"""
+def quotation_to_float(quotation):
+    """Quotation/MoneyValue API ({'units': '12', 'nano': 500000000}) в float"""
+    return float(quotation['units']) + float(quotation['nano']) / 1e9
+
+# Рублёвая денежная позиция в GetPortfolio
+RUB_FIGI = 'RUB000UTSTOM'
+
+def fetch_portfolio_state(account_id):
+    """Полный портфель: рубли отдельно, у позиций средняя и текущая цена, размер лота.
+
+    В отличие от get_portfolio не кэшируется и ошибки не перехватываются.
+    """
+    data = client.call_sync("OperationsService/GetPortfolio", {
+        "accountId": account_id
+    })
+    cash = 0.0
+    positions = []
+    for item in data.get('positions', []):
+        quantity = quotation_to_float(item['quantity'])
+        if item['figi'] == RUB_FIGI:
+            cash += quantity
+            continue
+        lots = quotation_to_float(item['quantityLots']) if item.get('quantityLots') else 0
+        positions.append({
+            'figi': item['figi'],
+            'quantity': quantity,
+            'lot': round(quantity / lots) if lots else None,
+            'average_price': quotation_to_float(item['averagePositionPrice']) if item.get('averagePositionPrice') else 0.0,
+            'current_price': quotation_to_float(item['currentPrice']) if item.get('currentPrice') else None
+        })
+    return {'cash': cash, 'positions': positions}
+
+def _fetch_current_prices(figis=None):
+    data = client.call_sync("MarketDataService/GetLastPrices", {"figi": list(figis)} if figis else {})
+    prices = {}
+    for price in data.get('lastPrices', []):
+        prices[price['figi']] = {
+            'price': float(price['price']['units']) + float(price['price']['nano']) / 1e9,
+            'time': price['time']
+        }
+    return prices
+
+def get_current_prices(figis=None):
+    """Получить текущие цены валют (через кэш, результат не изменять)"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetLastPrices",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={}
-        )
-        response.raise_for_status()
-        data = response.json()
-        prices = {}
-        for price in data.get('lastPrices', []):
-            prices[price['figi']] = {
-                'price': float(price['price']['units']) + float(price['price']['nano']) / 1e9,
-                'time': price['time']
-            }
-        return prices
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_current_prices: {str(e)}, Response: {e.response.text}")
+        key = tuple(sorted(figis)) if figis else 'last_prices'
+        return prices_cache.get(key, lambda: _fetch_current_prices(figis))
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_current_prices: {str(e)}, Response: {e.text}")
         return {}
     except Exception as e:
         logging.error(f"Error in get_current_prices: {str(e)}")
         return {}
 
-def get_available_instruments():
-    """Получить список доступных инструментов"""
+def get_available_instruments(instrument_type='Shares'):
+    """Получить список доступных инструментов (Shares, Currencies, Etfs, Bonds)"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.InstrumentsService/Shares",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={}
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = client.call_sync(f"InstrumentsService/{instrument_type}", {})
         instruments = []
         for instrument in data.get('instruments', []):
             instruments.append({
                 'figi': instrument['figi'],
                 'name': instrument['name'],
-                'ticker': instrument['ticker']
+                'ticker': instrument['ticker'],
+                'lot': int(instrument.get('lot', 1)),
+                'currency': instrument.get('currency')
             })
         return instruments
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_available_instruments: {str(e)}, Response: {e.response.text}")
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_available_instruments: {str(e)}, Response: {e.text}")
         return []
     except Exception as e:
         logging.error(f"Error in get_available_instruments: {str(e)}")
         return []
 
+# Длительность свечи и максимальный период одного запроса GetCandles для интервала
+CANDLE_INTERVALS = {
+    'MINUTE': timedelta(minutes=1),
+    'FIVE_MINUTE': timedelta(minutes=5),
+    'QUARTER_HOUR': timedelta(minutes=15),
+    'HOUR': timedelta(hours=1),
+    'DAY': timedelta(days=1)
+}
+MAX_CANDLE_WINDOW = {
+    'MINUTE': timedelta(days=1),
+    'FIVE_MINUTE': timedelta(days=1),
+    'QUARTER_HOUR': timedelta(days=1),
+    'HOUR': timedelta(days=7),
+    'DAY': timedelta(days=365)
+}
+
+def _parse_candle(candle):
+    return {
+        'date': candle['time'],
+        'open': float(candle['open']['units']) + float(candle['open']['nano']) / 1e9,
+        'high': float(candle['high']['units']) + float(candle['high']['nano']) / 1e9,
+        'low': float(candle['low']['units']) + float(candle['low']['nano']) / 1e9,
+        'close': float(candle['close']['units']) + float(candle['close']['nano']) / 1e9,
+        'volume': int(candle['volume'])
+    }
+
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+ISO_TIME_LENGTH = len('2024-01-09T07:00:00Z')
+
+def _parse_int_strings(values):
+    """Список строк int64 (units, volume в JSON API) в массив за один разбор на C"""
+    if not values:
+        return np.empty(0, dtype=np.int64)
+    return np.fromstring(' '.join(values), dtype=np.int64, sep=' ')
+
+def _parse_utc_times(values):
+    """Время 'YYYY-MM-DDTHH:MM:SSZ' в datetime64[s] (UTC) арифметикой над байтами"""
+    count = len(values)
+    joined = ''.join(values)
+    if len(joined) != count * ISO_TIME_LENGTH:
+        # Нестандартный формат (дробные секунды и т.п.) - общий разбор pandas
+        times = pd.to_datetime(values, utc=True, format='ISO8601').tz_localize(None)
+        return times.values.astype('datetime64[s]')
+
+    digits = np.frombuffer(joined.encode('ascii'), dtype=np.uint8).reshape(count, ISO_TIME_LENGTH).astype(np.int64) - ord('0')
+
+    def field(start, end):
+        return digits[:, start:end] @ (10 ** np.arange(end - start - 1, -1, -1))
+
+    months = (field(0, 4) - 1970) * 12 + field(5, 7) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (field(8, 10) - 1)
+    seconds = field(11, 13) * 3600 + field(14, 16) * 60 + field(17, 19)
+    return days.astype('datetime64[s]') + seconds
+
+def decode_candles(raw_candles):
+    """Разобрать свечи из ответа GetCandles в колонки NumPy.
+
+    Возвращает dict с массивами time (datetime64[s], UTC), open, high, low,
+    close (float64) и volume (int64).
+    """
+    quotations = [candle[field] for candle in raw_candles for field in PRICE_FIELDS]
+    units = _parse_int_strings([quotation['units'] for quotation in quotations])
+    nano = np.fromiter((quotation['nano'] for quotation in quotations), dtype=np.int64, count=len(quotations))
+    prices = (units + nano / 1e9).reshape(len(raw_candles), len(PRICE_FIELDS))
+    columns = {field: prices[:, i] for i, field in enumerate(PRICE_FIELDS)}
+    columns['time'] = _parse_utc_times([candle['time'] for candle in raw_candles])
+    columns['volume'] = _parse_int_strings([candle['volume'] for candle in raw_candles])
+    return columns
+
+def candles_frame(columns):
+    """Колонки decode_candles в DataFrame с индексом date для mplfinance"""
+    index = pd.DatetimeIndex(columns['time'], name='date').tz_localize('UTC')
+    return pd.DataFrame({field: columns[field] for field in PRICE_FIELDS + ('volume',)}, index=index)
+
+def candles_to_frame(candles):
+    """Привести свечи (список dict или DataFrame) к DataFrame с индексом date"""
+    if isinstance(candles, pd.DataFrame):
+        return candles
+    df = pd.DataFrame(candles)
+    df['date'] = pd.to_datetime(df['date'], utc=True, format='ISO8601')
+    return df.set_index('date')
+
+def _fetch_raw_candles(figi, interval, start_time, end_time):
+    """Свечи из GetCandles в исходном JSON-виде, период разбивается на допустимые окна"""
+    interval = interval.upper()
+    if interval not in CANDLE_INTERVALS:
+        raise ValueError(f"Invalid interval: {interval}. Must be one of {list(CANDLE_INTERVALS)}")
+
+    raw_candles = []
+    chunk_start = start_time
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + MAX_CANDLE_WINDOW[interval], end_time)
+        logging.info(f"Calling GetCandles with figi={figi}, interval={interval}, from={chunk_start}, to={chunk_end}")
+        data = client.call_sync("MarketDataService/GetCandles", {
+            "figi": figi,
+            "from": chunk_start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "to": chunk_end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "interval": f"CANDLE_INTERVAL_{interval}"
+        })
+        raw_candles.extend(data.get('candles', []))
+        chunk_start = chunk_end
+    return raw_candles
+
+def fetch_candles(figi, interval, start_time, end_time):
+    """Загрузить свечи за период, разбивая его на допустимые для API окна.
+
+    В отличие от get_candles ошибки не перехватываются.
+    """
+    return [_parse_candle(candle) for candle in _fetch_raw_candles(figi, interval, start_time, end_time)]
+
+def fetch_candle_columns(figi, interval, start_time, end_time):
+    """То же, что fetch_candles, но в колонках decode_candles"""
+    return decode_candles(_fetch_raw_candles(figi, interval, start_time, end_time))
+
 def get_candles(figi, interval='HOUR', days=7):
     """Получить свечи для инструмента"""
     try:
-        valid_intervals = ['MINUTE', 'FIVE_MINUTE', 'QUARTER_HOUR', 'HOUR', 'DAY']
-        if interval.upper() not in valid_intervals:
-            raise ValueError(f"Invalid interval: {interval}. Must be one of {valid_intervals}")
-
         end_time = datetime.utcnow()
         start_time = end_time - timedelta(days=days)
-        logging.info(f"Calling GetCandles with figi={figi}, interval={interval}, from={start_time}, to={end_time}")
-        
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetCandles",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "figi": figi,
-                "from": start_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "to": end_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "interval": f"CANDLE_INTERVAL_{interval.upper()}"
-            }
-        )
-        response.raise_for_status()
-        data = response.json()
-        candles = []
-        for candle in data.get('candles', []):
-            candles.append({
-                'date': candle['time'],
-                'open': float(candle['open']['units']) + float(candle['open']['nano']) / 1e9,
-                'high': float(candle['high']['units']) + float(candle['high']['nano']) / 1e9,
-                'low': float(candle['low']['units']) + float(candle['low']['nano']) / 1e9,
-                'close': float(candle['close']['units']) + float(candle['close']['nano']) / 1e9,
-                'volume': int(candle['volume'])
-            })
+        candles = fetch_candles(figi, interval, start_time, end_time)
         logging.info(f"Retrieved {len(candles)} candles for figi={figi}")
         return candles
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_candles: {str(e)}, Response: {e.response.text}")
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_candles: {str(e)}, Response: {e.text}")
         return []
     except Exception as e:
         logging.error(f"Error in get_candles: {str(e)}")
         return []
 
 def generate_chart_image(candles, title="Price Chart"):
-    """Создать изображение графика свечей"""
+    """Создать изображение графика свечей (список dict или DataFrame)"""
     try:
-        df = pd.DataFrame(candles)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.set_index('date')
+        df = candles_to_frame(candles)
         buffer = BytesIO()
         mpf.plot(df, type='candle', style='charles',
                  title=title,
@@ -253,53 +320,42 @@ def generate_chart_image(candles, title="Price Chart"):
         logging.error(f"Error in generate_chart_image: {str(e)}")
         return None
 
-def post_order(account_id, figi, operation, lots):
+def order_payload(account_id, figi, operation, lots, order_id):
+    """Тело PostOrder; order_id - ключ идемпотентности, повтор с ним не создаёт второе поручение"""
+    return {
+        "figi": figi,
+        "quantity": lots,
+        "direction": operation.upper(),
+        "accountId": account_id,
+        "orderType": "ORDER_TYPE_MARKET",
+        "orderId": order_id
+    }
+
+def post_order(account_id, figi, operation, lots, order_id=None):
     """Размещение торгового поручения в песочнице"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OrdersService/PostOrder",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "figi": figi,
-                "quantity": lots,
-                "direction": operation.upper(),
-                "accountId": account_id,
-                "orderType": "ORDER_TYPE_MARKET",
-                "orderId": str(datetime.now().timestamp())
-            }
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in post_order: {str(e)}, Response: {e.response.text}")
+        result = client.call_sync("OrdersService/PostOrder",
+                                  order_payload(account_id, figi, operation, lots, order_id or str(uuid.uuid4())))
+        return result
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in post_order: {str(e)}, Response: {e.text}")
         return None
     except Exception as e:
         logging.error(f"Error in post_order: {str(e)}")
         return None
+    finally:
+        # Даже при ошибке поручение могло дойти до брокера
+        portfolio_cache.invalidate(account_id)
 
 def get_order_state(account_id, order_id):
     """Получить состояние торгового поручения"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OrdersService/GetOrderState",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "accountId": account_id,
-                "orderId": order_id
-            }
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_order_state: {str(e)}, Response: {e.response.text}")
+        return client.call_sync("OrdersService/GetOrderState", {
+            "accountId": account_id,
+            "orderId": order_id
+        })
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_order_state: {str(e)}, Response: {e.text}")
         return None
     except Exception as e:
         logging.error(f"Error in get_order_state: {str(e)}")
@@ -308,50 +364,42 @@ def get_order_state(account_id, order_id):
 def cancel_order(account_id, order_id):
     """Отменить торговое поручение"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OrdersService/CancelOrder",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "accountId": account_id,
-                "orderId": order_id
-            }
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in cancel_order: {str(e)}, Response: {e.response.text}")
+        result = client.call_sync("OrdersService/CancelOrder", {
+            "accountId": account_id,
+            "orderId": order_id
+        })
+        return result
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in cancel_order: {str(e)}, Response: {e.text}")
         return None
     except Exception as e:
         logging.error(f"Error in cancel_order: {str(e)}")
         return None
+    finally:
+        # Даже при ошибке отмена могла дойти до брокера
+        portfolio_cache.invalidate(account_id)
 
 def get_orders(account_id):
     """Получить список активных торговых поручений"""
     try:
-        response = requests.post(
-            f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OrdersService/GetOrders",
-            headers={
-                "Authorization": f"Bearer {TINKOFF_TOKEN}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            json={
-                "accountId": account_id
-            }
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error in get_orders: {str(e)}, Response: {e.response.text}")
+        return client.call_sync("OrdersService/GetOrders", {
+            "accountId": account_id
+        })
+    except TinkoffAPIError as e:
+        logging.error(f"HTTP Error in get_orders: {str(e)}, Response: {e.text}")
         return []
     except Exception as e:
         logging.error(f"Error in get_orders: {str(e)}")
         return []
 
+def cache_stats():
+    """Счётчики кэша цен и портфеля и ограничителя запросов"""
+    return {
+        'prices': prices_cache.stats(),
+        'portfolio': portfolio_cache.stats(),
+        'rate_limit': client.limiter.stats() if client.limiter else None
+    }
+
 if __name__ == "__main__":
     instruments = get_available_instruments()
     for instrument in instruments:
@@ -0,0 +1,261 @@
+import os
+import shutil
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from db import CANDLE_DTYPE, epoch_seconds, load_candles, storage
+from api import fetch_candle_columns, PRICE_FIELDS
+
+ARCHIVE_DIR = os.getenv('CANDLE_ARCHIVE_DIR', 'archive')
+# Время последним: по его длине читатель понимает, сколько строк записано целиком
+COLUMN_ORDER = ('open', 'high', 'low', 'close', 'volume', 'time')
+PENDING_DIR = 'pending'
+FAR_FUTURE = np.iinfo(np.int64).max
+
+
+def empty_columns():
+    return {name: np.empty(0, dtype=CANDLE_DTYPE[name]) for name in CANDLE_DTYPE.names}
+
+
+def candle_columns(candles):
+    """Свечи api.get_candles (список dict), DataFrame или колонки decode_candles в колонки архива"""
+    if isinstance(candles, pd.DataFrame):
+        columns = {field: candles[field].to_numpy() for field in PRICE_FIELDS + ('volume',)}
+        columns['time'] = candles.index.tz_convert(None).to_numpy() if candles.index.tz else candles.index.to_numpy()
+    elif isinstance(candles, dict):
+        columns = candles
+    else:
+        columns = {field: np.fromiter((candle[field] for candle in candles), dtype=np.float64, count=len(candles))
+                   for field in PRICE_FIELDS + ('volume',)}
+        columns['time'] = np.fromiter((epoch_seconds(candle.get('date', candle.get('time'))) for candle in candles),
+                                      dtype=np.int64, count=len(candles))
+    times = np.asarray(columns['time'])
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = times.astype('datetime64[s]').astype(np.int64)
+    result = {name: np.asarray(columns[name]).astype(CANDLE_DTYPE[name], copy=False) for name in CANDLE_DTYPE.names}
+    result['time'] = times.astype(np.int64, copy=False)
+    return result
+
+
+def sorted_unique(columns):
+    """Упорядочить по времени; из строк с одинаковым временем остаётся последняя"""
+    times = columns['time']
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    keep = np.ones(len(times), dtype=bool)
+    keep[:-1] = times[1:] != times[:-1]
+    index = order[keep]
+    return {name: values[index] for name, values in columns.items()}
+
+
+class CandleArchive:
+    """Колоночный архив свечей на диске: по файлу на колонку для каждого (figi, interval).
+
+    Основные файлы упорядочены по времени и только дописываются; незакрытую
+    последнюю свечу можно перезаписать на месте. Свечи старше последней
+    (догрузка истории) складываются в pending и вливаются при compact().
+    Чтение отдаёт срезы np.memmap без копирования.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self._maps = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _series_dir(self, figi, interval, pending=False):
+        path = os.path.join(self.root, figi, interval.upper())
+        return os.path.join(path, PENDING_DIR) if pending else path
+
+    def _series_lock(self, figi, interval):
+        with self._lock:
+            return self._locks.setdefault((figi, interval.upper()), threading.RLock())
+
+    @staticmethod
+    def _count(path):
+        """Число полностью записанных строк"""
+        counts = []
+        for name in CANDLE_DTYPE.names:
+            try:
+                counts.append(os.path.getsize(os.path.join(path, name)) // CANDLE_DTYPE[name].itemsize)
+            except FileNotFoundError:
+                return 0
+        return min(counts)
+
+    def _columns(self, figi, interval):
+        """memmap всех колонок; пересоздаётся, только когда выросло число строк"""
+        key = (figi, interval.upper())
+        path = self._series_dir(figi, interval)
+        count = self._count(path)
+        cached = self._maps.get(key)
+        if cached is not None and cached[0] == count:
+            return cached[1]
+        if count == 0:
+            columns = empty_columns()
+        else:
+            columns = {name: np.memmap(os.path.join(path, name), dtype=CANDLE_DTYPE[name], mode='r', shape=(count,))
+                       for name in CANDLE_DTYPE.names}
+        self._maps[key] = (count, columns)
+        return columns
+
+    def read(self, figi, interval, start_time=None, end_time=None):
+        """Свечи за [start_time, end_time): срезы memmap, время как datetime64[s]"""
+        columns = self._columns(figi, interval)
+        times = columns['time']
+        start = 0 if start_time is None else np.searchsorted(times, epoch_seconds(start_time), 'left')
+        end = len(times) if end_time is None else np.searchsorted(times, epoch_seconds(end_time), 'left')
+        result = {name: values[start:end] for name, values in columns.items()}
+        result['time'] = result['time'].view('datetime64[s]')
+        return result
+
+    def last_time(self, figi, interval):
+        times = self._columns(figi, interval)['time']
+        return int(times[-1]) if len(times) else None
+
+    def __len__(self):
+        return sum(self._count(self._series_dir(figi, interval)) for figi, interval in self.series())
+
+    def series(self):
+        """Все (figi, interval) в архиве"""
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for figi in sorted(os.listdir(self.root)):
+            figi_dir = os.path.join(self.root, figi)
+            if os.path.isdir(figi_dir):
+                # HOUR.compact / HOUR.old - временные каталоги compact(), не ряды
+                found.extend((figi, interval) for interval in sorted(os.listdir(figi_dir))
+                             if '.' not in interval and os.path.isdir(os.path.join(figi_dir, interval)))
+        return found
+
+    def append(self, figi, interval, candles):
+        """Дописать свечи; возвращает число строк, ушедших в pending до compact()"""
+        columns = candle_columns(candles)
+        if not len(columns['time']):
+            return 0
+        columns = sorted_unique(columns)
+        times = columns['time']
+        with self._series_lock(figi, interval):
+            path = self._series_dir(figi, interval)
+            count = self._count(path)
+            last = self.last_time(figi, interval)
+            if last is None:
+                self._write(path, columns)
+                return 0
+            same = np.flatnonzero(times == last)
+            if len(same):
+                self._overwrite(path, count - 1, {name: values[same[-1]] for name, values in columns.items()})
+            newer = times > last
+            if newer.any():
+                self._write(path, {name: values[newer] for name, values in columns.items()})
+            older = times < last
+            if older.any():
+                self._write(self._series_dir(figi, interval, pending=True),
+                            {name: values[older] for name, values in columns.items()})
+            return int(older.sum())
+
+    @staticmethod
+    def _write(path, columns):
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMN_ORDER:
+            with open(os.path.join(path, name), 'ab') as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=CANDLE_DTYPE[name]).tobytes())
+
+    @staticmethod
+    def _overwrite(path, row, values):
+        for name in COLUMN_ORDER:
+            dtype = CANDLE_DTYPE[name]
+            with open(os.path.join(path, name), 'r+b') as f:
+                f.seek(row * dtype.itemsize)
+                f.write(np.array([values[name]], dtype=dtype).tobytes())
+
+    def compact(self, figi=None, interval=None):
+        """Влить pending в основные файлы (сортировка, дедупликация) и переписать их"""
+        compacted = 0
+        for series_figi, series_interval in self.series():
+            if (figi is not None and series_figi != figi) or (interval is not None and series_interval != interval.upper()):
+                continue
+            pending_dir = self._series_dir(series_figi, series_interval, pending=True)
+            if not os.path.isdir(pending_dir):
+                continue
+            with self._series_lock(series_figi, series_interval):
+                path = self._series_dir(series_figi, series_interval)
+                count, pending_count = self._count(path), self._count(pending_dir)
+                main = {name: np.fromfile(os.path.join(path, name), dtype=CANDLE_DTYPE[name], count=count)
+                        for name in CANDLE_DTYPE.names} if count else empty_columns()
+                pending = {name: np.fromfile(os.path.join(pending_dir, name), dtype=CANDLE_DTYPE[name], count=pending_count)
+                           for name in CANDLE_DTYPE.names} if pending_count else empty_columns()
+                merged = sorted_unique({name: np.concatenate([main[name], pending[name]]) for name in CANDLE_DTYPE.names})
+                # Новая копия рядом, затем подмена каталога: открытые memmap продолжают видеть старые файлы
+                new_path = f"{path}.compact"
+                old_path = f"{path}.old"
+                shutil.rmtree(new_path, ignore_errors=True)
+                # Остаток прерванного compact() помешал бы переименованию
+                shutil.rmtree(old_path, ignore_errors=True)
+                self._write(new_path, merged)
+                os.replace(path, old_path)
+                os.replace(new_path, path)
+                shutil.rmtree(old_path, ignore_errors=True)
+                self._maps.pop((series_figi, series_interval), None)
+                compacted += 1
+                logging.info(f"Compacted archive {series_figi}/{series_interval}: "
+                             f"{count} + {pending_count} -> {len(merged['time'])} candles")
+        return compacted
+
+
+def import_candles(figi, interval, candles, archive=None, compact=True):
+    """Добавить в архив ответ api.get_candles / fetch_candle_columns.
+
+    compact=False оставляет более старые свечи в pending: при пакетном импорте
+    compact() вызывается один раз в конце.
+    """
+    if archive is None:
+        archive = candle_archive
+    try:
+        if archive.append(figi, interval, candles) and compact:
+            archive.compact(figi, interval)
+        return True
+    except Exception as e:
+        logging.error(f"Error in import_candles: {str(e)}")
+        return False
+
+
+def import_history(figi, interval, start_time, end_time, archive=None):
+    """Загрузить историю из GetCandles прямо в архив"""
+    try:
+        columns = fetch_candle_columns(figi, interval, start_time, end_time)
+    except Exception as e:
+        logging.error(f"Error in import_history: {str(e)}")
+        return 0
+    if not import_candles(figi, interval, columns, archive):
+        return 0
+    return len(columns['time'])
+
+
+def import_from_db(archive=None, figi=None, interval=None):
+    """Перенести свечи из таблицы candles в архив; возвращает число строк"""
+    if archive is None:
+        archive = candle_archive
+    imported = 0
+    try:
+        storage.flush()
+        series = storage.reader().execute('SELECT DISTINCT figi, interval FROM candles').fetchall()
+    except Exception as e:
+        logging.error(f"Error in import_from_db: {str(e)}")
+        return 0
+    for series_figi, series_interval in series:
+        if (figi is not None and series_figi != figi) or (interval is not None and series_interval != interval.upper()):
+            continue
+        columns = load_candles(series_figi, series_interval, 0, FAR_FUTURE)
+        if import_candles(series_figi, series_interval, columns, archive, compact=False):
+            imported += len(columns['time'])
+    try:
+        archive.compact(figi, interval)
+    except Exception as e:
+        logging.error(f"Error compacting archive after import_from_db: {str(e)}")
+    return imported
+
+
+# Общий архив истории свечей
+candle_archive = CandleArchive()
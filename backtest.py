@@ -0,0 +1,198 @@
+import os
+import sys
+import logging
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from archive import candle_archive, candle_columns, FAR_FUTURE
+from db import load_candles
+from trade import SmaCrossStrategy, run_step
+
+INITIAL_CASH = float(os.getenv('BACKTEST_INITIAL_CASH', 100000))
+# Комиссия брокера с оборота сделки
+COMMISSION = float(os.getenv('BACKTEST_COMMISSION', 0.0005))
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', os.cpu_count() or 1))
+
+
+def load_history(figi, interval, start_time=None, end_time=None):
+    """Свечи из архива, а если его нет - из таблицы candles"""
+    candles = candle_archive.read(figi, interval, start_time, end_time)
+    if len(candles['time']):
+        return candles
+    return load_candles(figi, interval, 0 if start_time is None else start_time,
+                        FAR_FUTURE if end_time is None else end_time)
+
+
+class SimBroker:
+    """Имитация брокера для пошагового бэктеста.
+
+    Поручения, принятые после закрытия свечи, исполняются по открытию
+    следующей; позиция считается в лотах, комиссия - с оборота. Покупка
+    без достаточных денег отклоняется.
+    """
+
+    def __init__(self, figi, candles, cash=INITIAL_CASH, commission=COMMISSION, lot=1):
+        self.figi = figi
+        self.history = candles
+        self.cash = cash
+        self.commission = commission
+        self.lot = lot
+        self.lots = 0
+        self.bar = -1
+        self.pending = []
+        self.trades = 0
+        self.fees = 0.0
+        self.rejected = 0
+
+    def portfolio(self):
+        """Портфель в формате LiveBroker.portfolio"""
+        positions = []
+        if self.lots:
+            positions.append({'figi': self.figi, 'quantity': self.lots * self.lot, 'lots': self.lots})
+        return {'totalAmount': self.equity(), 'cash': self.cash, 'positions': positions}
+
+    def candles(self, strategy):
+        """Свечи до текущей включительно (срезы без копирования)"""
+        start = max(0, self.bar + 1 - strategy.lookback) if strategy.lookback else 0
+        return {name: values[start:self.bar + 1] for name, values in self.history.items()}
+
+    def post_order(self, figi, operation, lots):
+        if figi != self.figi:
+            logging.warning(f"SimBroker trades only {self.figi}, order for {figi} ignored")
+            self.rejected += 1
+            return None
+        self.pending.append((operation, lots))
+        return {'figi': figi, 'direction': operation, 'lots': lots}
+
+    def next_bar(self):
+        """Перейти к следующей свече и исполнить поручения по её открытию"""
+        self.bar += 1
+        price = float(self.history['open'][self.bar])
+        for operation, lots in self.pending:
+            if operation.lower() == 'sell':
+                lots = min(lots, self.lots)
+                sign = -1
+            else:
+                sign = 1
+            turnover = lots * self.lot * price
+            fee = turnover * self.commission
+            if sign > 0 and turnover + fee > self.cash:
+                self.rejected += 1
+                continue
+            if lots <= 0:
+                continue
+            self.cash -= sign * turnover + fee
+            self.lots += sign * lots
+            self.fees += fee
+            self.trades += 1
+        self.pending = []
+
+    def equity(self):
+        if self.bar < 0:
+            return self.cash
+        return self.cash + self.lots * self.lot * float(self.history['close'][self.bar])
+
+
+class BacktestResult:
+    """Кривая капитала и сводка по сделкам"""
+
+    def __init__(self, times, equity, trades, fees, initial_cash, params=None, rejected=0):
+        self.times = times
+        self.equity = equity
+        self.trades = trades
+        self.fees = fees
+        self.initial_cash = initial_cash
+        self.params = params or {}
+        self.rejected = rejected
+
+    def report(self):
+        final = float(self.equity[-1]) if len(self.equity) else self.initial_cash
+        peaks = np.maximum.accumulate(self.equity) if len(self.equity) else self.equity
+        drawdown = float(((peaks - self.equity) / peaks).max()) if len(self.equity) else 0.0
+        return {
+            'params': self.params,
+            'bars': len(self.equity),
+            'pnl': round(final - self.initial_cash, 2),
+            'return_pct': round((final / self.initial_cash - 1) * 100, 3),
+            'max_drawdown_pct': round(drawdown * 100, 3),
+            'trades': int(self.trades),
+            'commission': round(float(self.fees), 2),
+            'rejected': int(self.rejected)
+        }
+
+
+def run_event(strategy, candles, cash=INITIAL_CASH, commission=COMMISSION, lot=1):
+    """Пошаговый бэктест: тот же run_step, что и в trade_loop, с SimBroker вместо API"""
+    candles = candle_columns(candles)
+    broker = SimBroker(strategy.figi, candles, cash, commission, lot)
+    equity = np.empty(len(candles['time']))
+    for i in range(len(equity)):
+        broker.next_bar()
+        run_step(strategy, broker)
+        equity[i] = broker.equity()
+    return BacktestResult(candles['time'].astype('datetime64[s]'), equity, broker.trades, broker.fees, cash,
+                          rejected=broker.rejected)
+
+
+def run_vectorized(strategy, candles, cash=INITIAL_CASH, commission=COMMISSION, lot=1, params=None):
+    """Векторный бэктест по strategy.target_lots: те же правила исполнения, но без проверки денег"""
+    candles = candle_columns(candles)
+    target = np.asarray(strategy.target_lots(candles), dtype=np.int64)
+    # Решение на закрытии свечи исполняется по открытию следующей
+    lots = np.zeros(len(target), dtype=np.int64)
+    lots[1:] = target[:-1]
+    traded = np.diff(lots, prepend=0)
+    turnover = np.abs(traded) * lot * candles['open']
+    fees = turnover * commission
+    balance = cash - np.cumsum(traded * lot * candles['open'] + fees)
+    equity = balance + lots * lot * candles['close']
+    return BacktestResult(candles['time'].astype('datetime64[s]'), equity, np.count_nonzero(traded),
+                          fees.sum(), cash, params)
+
+
+_history_cache = {}
+
+
+def _sweep_job(job):
+    strategy_class, params, source, cash, commission, lot = job
+    if isinstance(source, tuple):
+        # Каждый процесс читает архив сам: memmap разделяет страницы, свечи не пересылаются
+        if source not in _history_cache:
+            _history_cache[source] = candle_columns(load_history(*source))
+        source = _history_cache[source]
+    result = run_vectorized(strategy_class(**params), source, cash, commission, lot, params)
+    return result.report(), result.equity
+
+
+def sweep(strategy_class, grid, figi, interval='HOUR', candles=None, start_time=None, end_time=None,
+          cash=INITIAL_CASH, commission=COMMISSION, lot=1, workers=BACKTEST_WORKERS):
+    """Перебор параметров стратегии векторным бэктестом на пуле процессов.
+
+    grid - {параметр: [значения]}; возвращает [(report, equity)] по убыванию PnL.
+    """
+    names = list(grid)
+    combinations = [dict(zip(names, values), figi=figi) for values in itertools.product(*(grid[name] for name in names))]
+    source = candles if candles is not None else (figi, interval, start_time, end_time)
+    jobs = [(strategy_class, params, source, cash, commission, lot) for params in combinations]
+    if workers <= 1:
+        results = [_sweep_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_sweep_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    return sorted(results, key=lambda result: result[0]['pnl'], reverse=True)
+
+
+def format_report(report):
+    params = ', '.join(f"{name}={value}" for name, value in report['params'].items() if name != 'figi')
+    return (f"{params:<20} PnL {report['pnl']:>12.2f}  {report['return_pct']:>8.3f}%  "
+            f"DD {report['max_drawdown_pct']:>7.3f}%  trades {report['trades']:>6}  fees {report['commission']:>10.2f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # python backtest.py FIGI [INTERVAL]: перебор SMA по свечам из архива или БД
+    figi = sys.argv[1] if len(sys.argv) > 1 else "BBG004S68CV8"
+    interval = sys.argv[2].upper() if len(sys.argv) > 2 else 'HOUR'
+    results = sweep(SmaCrossStrategy, {'fast': [5, 10, 20], 'slow': [30, 50, 100, 200]}, figi, interval)
+    for report, equity in results:
+        print(format_report(report))
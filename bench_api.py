@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+import logging
+import requests
+from aiohttp import web
+from tinkoff_client import TinkoffClient, SERVICE_PREFIX
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+HOST = '127.0.0.1'
+PORT = 8765
+CALLS = 500
+CONCURRENCY = 20
+
+LAST_PRICES = {
+    'lastPrices': [
+        {'figi': f'BBG00000{i:04d}', 'price': {'units': str(100 + i), 'nano': 500000000},
+         'time': '2024-01-01T10:00:00Z'}
+        for i in range(50)
+    ]
+}
+
+
+async def handle_last_prices(request):
+    await request.read()
+    return web.json_response(LAST_PRICES)
+
+
+def run_stub_server(ready):
+    """Локальная заглушка REST API Tinkoff"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = web.Application()
+    app.router.add_post(f'/rest/{SERVICE_PREFIX}MarketDataService/GetLastPrices', handle_last_prices)
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, HOST, PORT).start())
+    ready.set()
+    loop.run_forever()
+
+
+def bench_requests_post(base_url):
+    """Старый путь: новый requests.post без Session на каждый вызов"""
+    url = f"{base_url}/{SERVICE_PREFIX}MarketDataService/GetLastPrices"
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        response = requests.post(url, headers={
+            "Authorization": "Bearer test",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }, json={})
+        response.raise_for_status()
+        response.json()
+    return CALLS / (time.perf_counter() - start)
+
+
+def bench_call_sync(client):
+    """Синхронный фасад поверх общего пула соединений"""
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        client.call_sync("MarketDataService/GetLastPrices", {})
+    return CALLS / (time.perf_counter() - start)
+
+
+def bench_call_async(client):
+    """Конкурентные корутины через один пул соединений"""
+    async def worker(n):
+        for _ in range(n):
+            await client.call("MarketDataService/GetLastPrices", {})
+
+    async def run():
+        await asyncio.gather(*(worker(CALLS // CONCURRENCY) for _ in range(CONCURRENCY)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return CALLS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    ready = threading.Event()
+    threading.Thread(target=run_stub_server, args=(ready,), daemon=True).start()
+    ready.wait()
+    base_url = f"http://{HOST}:{PORT}/rest"
+    client = TinkoffClient(token='test', base_url=base_url)
+    client.call_sync("MarketDataService/GetLastPrices", {})
+
+    print(f"requests.post per call:  {bench_requests_post(base_url):8.1f} calls/sec")
+    print(f"TinkoffClient.call_sync: {bench_call_sync(client):8.1f} calls/sec")
+    print(f"TinkoffClient.call x{CONCURRENCY}:  {bench_call_async(client):8.1f} calls/sec")
+    client.close()
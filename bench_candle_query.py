@@ -0,0 +1,97 @@
+import os
+import time
+import random
+import sqlite3
+import tempfile
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from db import connect, migrate, INSERT_CANDLE, SELECT_CANDLES, CANDLE_DTYPE
+
+ROWS = int(os.getenv('BENCH_ROWS', 10000000))
+FIGIS = 20
+QUERIES = 200
+LEGACY_QUERIES = 5
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+LEGACY_TABLE = '''CREATE TABLE candles
+                  (figi TEXT, time TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER)'''
+LEGACY_SELECT = '''SELECT time, open, high, low, close, volume FROM candles
+                   WHERE figi = ? AND time >= ? AND time < ? ORDER BY time'''
+
+
+def figi_name(i):
+    return f"BBG{i:09d}"
+
+
+def generate(per_figi, epoch=True):
+    """Минутные свечи по FIGIS инструментам"""
+    start = int(START.timestamp())
+    for i in range(FIGIS):
+        for n in range(per_figi):
+            t = start + n * 60
+            price = 100 + (n % 1000) / 10
+            if not epoch:
+                t = datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                yield (figi_name(i), t, price, price + 1, price - 1, price + 0.5, n % 977)
+            else:
+                yield (figi_name(i), 'MINUTE', t, price, price + 1, price - 1, price + 0.5, n % 977)
+
+
+def fill(conn, sql, rows):
+    start = time.perf_counter()
+    with conn:
+        conn.executemany(sql, rows)
+    return time.perf_counter() - start
+
+
+def random_day(per_figi):
+    offset = random.randrange(per_figi - 1440) * 60
+    begin = START + timedelta(seconds=offset)
+    return figi_name(random.randrange(FIGIS)), begin, begin + timedelta(days=1)
+
+
+def query_times(func, ranges):
+    start = time.perf_counter()
+    total = 0
+    for figi, begin, end in ranges:
+        total += func(figi, begin, end)
+    return (time.perf_counter() - start) / len(ranges), total / len(ranges)
+
+
+if __name__ == "__main__":
+    per_figi = ROWS // FIGIS
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, 'new.db'))
+        migrate(conn)
+        insert_time = fill(conn, INSERT_CANDLE, generate(per_figi))
+        # Повторная запись тех же свечей не должна добавлять строк
+        fill(conn, INSERT_CANDLE, generate(1000))
+        assert conn.execute('SELECT COUNT(*) FROM candles').fetchone()[0] == per_figi * FIGIS
+
+        legacy = sqlite3.connect(os.path.join(tmp, 'legacy.db'))
+        legacy.execute(LEGACY_TABLE)
+        legacy_insert_time = fill(legacy, 'INSERT INTO candles VALUES (?, ?, ?, ?, ?, ?, ?)', generate(per_figi, epoch=False))
+
+        def new_query(figi, begin, end):
+            rows = np.fromiter(conn.execute(SELECT_CANDLES, (figi, 'MINUTE', int(begin.timestamp()), int(end.timestamp()))),
+                               dtype=CANDLE_DTYPE)
+            return len(rows)
+
+        def legacy_query(figi, begin, end):
+            rows = legacy.execute(LEGACY_SELECT, (figi, begin.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                                  end.strftime("%Y-%m-%dT%H:%M:%SZ"))).fetchall()
+            return len(rows)
+
+        ranges = [random_day(per_figi) for _ in range(QUERIES)]
+        new_time, new_rows = query_times(new_query, ranges)
+        legacy_time, legacy_rows = query_times(legacy_query, ranges[:LEGACY_QUERIES])
+        new_size = os.path.getsize(os.path.join(tmp, 'new.db'))
+        legacy_size = os.path.getsize(os.path.join(tmp, 'legacy.db'))
+        conn.close()
+        legacy.close()
+
+    print(f"{per_figi * FIGIS:,} candles, {FIGIS} figis, one-day range queries")
+    print(f"insert  TEXT time, no key:       {per_figi * FIGIS / legacy_insert_time:12,.0f} rows/s  {legacy_size / 2**20:8.0f} MB")
+    print(f"upsert  epoch time, primary key: {per_figi * FIGIS / insert_time:12,.0f} rows/s  {new_size / 2**20:8.0f} MB")
+    print(f"query   TEXT time, full scan:    {legacy_time * 1000:10.2f} ms/query ({legacy_rows:.0f} rows)")
+    print(f"query   primary key range:       {new_time * 1000:10.2f} ms/query ({new_rows:.0f} rows, {legacy_time / new_time:.0f}x)")
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from api import _parse_candle, candles_to_frame, decode_candles, candles_frame
+
+CANDLES = 100000
+REPEAT = 5
+
+
+def make_raw_candles(count):
+    """Синтетический ответ GetCandles с минутными свечами"""
+    start = datetime(2024, 1, 1)
+    raw_candles = []
+    for i in range(count):
+        base = 100 + (i % 500) / 10
+        raw_candles.append({
+            'time': (start + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'open': {'units': str(int(base)), 'nano': (i * 7919) % 1000000000},
+            'high': {'units': str(int(base) + 1), 'nano': 250000000},
+            'low': {'units': str(int(base) - 1), 'nano': 750000000},
+            'close': {'units': str(int(base)), 'nano': (i * 104729) % 1000000000},
+            'volume': str(1000 + i % 977),
+            'isComplete': True
+        })
+    return raw_candles
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def dict_path(raw_candles):
+    """Старый путь: dict на свечу, затем DataFrame"""
+    return candles_to_frame([_parse_candle(candle) for candle in raw_candles])
+
+
+def columnar_path(raw_candles):
+    """Колоночный разбор сразу в массивы NumPy"""
+    return candles_frame(decode_candles(raw_candles))
+
+
+if __name__ == "__main__":
+    raw_candles = make_raw_candles(CANDLES)
+    old_time, old_df = best_of(lambda: dict_path(raw_candles))
+    decode_time, _ = best_of(lambda: decode_candles(raw_candles))
+    new_time, new_df = best_of(lambda: columnar_path(raw_candles))
+
+    assert np.array_equal(old_df.index.values, new_df.index.values)
+    for column in ('open', 'high', 'low', 'close', 'volume'):
+        assert np.array_equal(old_df[column].values, new_df[column].values), column
+
+    print(f"{CANDLES} candles, best of {REPEAT}")
+    print(f"dict list + DataFrame:     {old_time * 1000:8.1f} ms")
+    print(f"decode_candles (arrays):   {decode_time * 1000:8.1f} ms")
+    print(f"decode_candles + frame:    {new_time * 1000:8.1f} ms  ({old_time / new_time:.1f}x)")
@@ -0,0 +1,54 @@
+import time
+import json
+import base64
+import numpy as np
+from datetime import datetime, timezone
+from chart_render import render_png
+from chart_feed import encode_candles, KIND_UPDATE
+from archive import candle_columns
+
+# Неделя часовых свечей, как у кнопки "1 Hour Chart"
+CANDLES = 24 * 7
+REPEAT = 5
+
+
+def make_candles(count, seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.round(100 + np.cumsum(rng.normal(0, 0.5, count)), 2)
+    open_ = np.round(close + rng.normal(0, 0.3, count), 2)
+    start = 1729152000
+    return [{
+        'date': datetime.fromtimestamp(start + i * 3600, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'open': float(open_[i]),
+        'high': float(max(open_[i], close[i]) + 0.1),
+        'low': float(min(open_[i], close[i]) - 0.1),
+        'close': float(close[i]),
+        'volume': int(rng.integers(1000, 10 ** 6))
+    } for i in range(count)]
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    import matplotlib
+    matplotlib.use('Agg')
+    candles = make_candles(CANDLES)
+    png_time, png = best_of(lambda: render_png(candles, '1h'))
+    data_url = f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+    columns = candle_columns(candles)
+    binary_time, binary = best_of(lambda: encode_candles(columns))
+    as_json = json.dumps(candles)
+    update = encode_candles({field: values[-2:] for field, values in columns.items()}, KIND_UPDATE)
+
+    print(f"{CANDLES} hourly candles, best of {REPEAT}")
+    print(f"PNG data URL (base64):   {len(data_url):8d} bytes  {png_time * 1000:8.2f} ms")
+    print(f"JSON candles:            {len(as_json):8d} bytes")
+    print(f"Binary snapshot:         {len(binary):8d} bytes  {binary_time * 1000:8.2f} ms  ({len(data_url) / len(binary):.0f}x smaller)")
+    print(f"Binary update (2 rows):  {len(update):8d} bytes")
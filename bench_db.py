@@ -0,0 +1,81 @@
+import os
+import time
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from db import Storage, INSERT_CANDLE, connect, migrate, candle_rows
+
+OLD_ROWS = 2000
+NEW_ROWS = 200000
+LEGACY_INSERT = 'INSERT INTO candles VALUES (?, ?, ?, ?, ?, ?, ?)'
+LEGACY_TABLE = '''CREATE TABLE IF NOT EXISTS candles
+                  (figi TEXT, time TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER)'''
+
+
+def make_candles(count):
+    start = datetime(2024, 1, 1)
+    return [{
+        'time': (start + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'open': 100 + i % 50, 'high': 101 + i % 50, 'low': 99 + i % 50, 'close': 100.5 + i % 50,
+        'volume': 1000 + i
+    } for i in range(count)]
+
+
+def create_legacy_table(path):
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_TABLE)
+    conn.commit()
+    conn.close()
+
+
+def create_schema(path):
+    conn = connect(path)
+    migrate(conn)
+    conn.close()
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM candles').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def old_path(path, figi, candles):
+    """Прежний save_candle: соединение, INSERT и commit на каждую строку"""
+    for candle in candles:
+        conn = sqlite3.connect(path)
+        c = conn.cursor()
+        c.execute(LEGACY_INSERT, (figi, candle['time'], candle['open'], candle['high'],
+                                  candle['low'], candle['close'], candle['volume']))
+        conn.commit()
+        conn.close()
+
+
+def new_path(path, figi, candles):
+    """Очередь и фоновая запись пачками по 1000 свечей (как приходят из GetCandles)"""
+    storage = Storage(path)
+    for i in range(0, len(candles), 1000):
+        storage.executemany(INSERT_CANDLE, candle_rows(figi, 'MINUTE', candles[i:i + 1000]))
+    storage.close()
+
+
+def measure(func, path, candles):
+    start = time.perf_counter()
+    func(path, 'BBG004S68CV8', candles)
+    elapsed = time.perf_counter() - start
+    assert count_rows(path) == len(candles)
+    return len(candles) / elapsed
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        old_db, new_db = os.path.join(tmp, 'old.db'), os.path.join(tmp, 'new.db')
+        create_legacy_table(old_db)
+        create_schema(new_db)
+        old_rate = measure(old_path, old_db, make_candles(OLD_ROWS))
+        new_rate = measure(new_path, new_db, make_candles(NEW_ROWS))
+
+    print(f"row per connection + commit: {old_rate:12,.0f} rows/s  ({OLD_ROWS} rows)")
+    print(f"queued WAL writer:           {new_rate:12,.0f} rows/s  ({NEW_ROWS} rows, {new_rate / old_rate:.0f}x)")
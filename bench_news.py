@@ -0,0 +1,85 @@
+import time
+from datetime import datetime
+from bs4 import BeautifulSoup
+from news import NewsReader
+
+ITEMS = 100
+REPEAT = 20
+
+# Типичный элемент ленты RBC (структура ответа /v10/ajax/get-news-feed)
+ITEM_TEMPLATE = (
+    '<div class="news-feed__item js-news-feed-item js-yandex-counter" data-id="{i}">'
+    '<a href="https://www.rbc.ru/economics/17/10/2024/{i:016x}" class="news-feed__item__link js-yandex-counter">'
+    '<span class="news-feed__item__title news-feed__item__title_icon">{title}</span>'
+    '<span class="news-feed__item__date"><span class="news-feed__item__date-text">Экономика, 12:{minute:02d}</span></span>'
+    '</a>'
+    '<div class="news-feed__item__img"><img src="https://s0.rbk.ru/v6_top_pics/resized/{i}.jpg" alt=""></div>'
+    '</div>'
+)
+TITLES = [
+    'ЦБ сохранил ключевую ставку на уровне 19%',
+    'Курс доллара &laquo;упал&raquo; ниже 95 руб.',
+    '  Индекс <b>Мосбиржи</b> вырос на 1,2%  ',
+    'Акции <i>Сбербанка</i> &amp; ВТБ: a &lt; b &gt; c',
+    'Нефть Brent <!-- comment --> подорожала',
+    '\n Минфин разместил ОФЗ\n <span class="icon"></span>'
+]
+
+
+def make_payload(count):
+    """Синтетический ответ ленты RBC: обычные элементы, сущности, вложенные теги и битые записи"""
+    items = []
+    for i in range(count):
+        html = ITEM_TEMPLATE.format(i=i, title=TITLES[i % len(TITLES)], minute=i % 60)
+        if i % 25 == 7:
+            html = html.replace('news-feed__item__date-text', 'news-feed__item__date-hidden')
+        elif i % 25 == 13:
+            html = html.replace(' href=', ' data-href=')
+        elif i % 25 == 19:
+            html = html.replace('<a ', '<div ').replace('</a>', '</div>')
+        items.append({'html': html, 'publish_date_t': 1729155600 + i * 60})
+    return {'items': items}
+
+
+def parse_rbc_bs4(source_name, data):
+    """Прежний разбор: BeautifulSoup и три find() на каждый элемент"""
+    news_items = []
+    for item in data.get('items', []):
+        try:
+            soup = BeautifulSoup(item.get('html', ''), 'html.parser')
+            title = soup.find('span', class_='news-feed__item__title')
+            url = soup.find('a')['href']
+            date_text = soup.find('span', class_='news-feed__item__date-text')
+            if not all([title, url, date_text]):
+                continue
+            news_items.append({
+                'title': title.get_text(strip=True),
+                'url': url,
+                'source': source_name,
+                'date': datetime.fromtimestamp(item['publish_date_t'])
+            })
+        except Exception:
+            continue
+    return news_items
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    payload = make_payload(ITEMS)
+    reader = NewsReader()
+    old_time, old_items = best_of(lambda: parse_rbc_bs4('RBC', payload))
+    new_time, new_items = best_of(lambda: reader._parse_rbc('RBC', payload))
+
+    assert old_items == new_items, "streaming extractor differs from BeautifulSoup"
+
+    print(f"{ITEMS} RBC items ({len(new_items)} parsed), best of {REPEAT}")
+    print(f"BeautifulSoup per item:    {old_time * 1000:8.2f} ms")
+    print(f"RBCItemExtractor:          {new_time * 1000:8.2f} ms  ({old_time / new_time:.1f}x)")
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
+import aiohttp
+import numpy as np
+import socketio
+
+PORT = int(os.getenv('BENCH_WEB_PORT', 3901))
+CLIENT_LEVELS = [int(n) for n in os.getenv('BENCH_CLIENTS', '50,200,500,1000').split(',')]
+REQUESTS_PER_CLIENT = 5
+BROADCAST_INTERVAL = 0.1
+BROADCAST_SECONDS = 3
+CONNECT_BATCH = 50
+# Уровень считается выдержанным, если все подключились и p99 рассылки ниже порога
+P99_LIMIT_MS = float(os.getenv('BENCH_P99_LIMIT_MS', 250))
+
+
+def run_server():
+    """Веб-сервер main.py в отдельном процессе с периодической рассылкой комнате prices"""
+    os.environ.setdefault('TELEGRAM_TOKEN', '1:bench')
+    os.environ.setdefault('TELEGRAM_CHAT_ID', '1')
+    import logging
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def serve():
+        await main.start_web('127.0.0.1', PORT)
+        while True:
+            await asyncio.sleep(BROADCAST_INTERVAL)
+            main.publish('prices', 'prices', {'prices': {}, 'sent': time.time()})
+
+    asyncio.run(serve())
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else float('nan')
+
+
+async def connect(url, state):
+    client = socketio.AsyncClient(reconnection=False)
+    pending = {}
+
+    @client.on('prices')
+    async def on_prices(data):
+        if 'sent' in data and state['measuring']:
+            state['broadcast'].append(time.time() - data['sent'])
+
+    @client.on('trading_status')
+    async def on_status(data):
+        state['responses'] += 1
+        future = pending.pop('status', None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    try:
+        await client.connect(url, transports=['websocket'])
+    except Exception:
+        state['failed'] += 1
+        await client.shutdown()
+        return None
+    client.pending = pending
+    return client
+
+
+async def request(client, state):
+    for _ in range(REQUESTS_PER_CLIENT):
+        future = asyncio.get_running_loop().create_future()
+        client.pending['status'] = future
+        started = time.perf_counter()
+        await client.emit('command', {'action': 'trading_status'})
+        try:
+            state['request'].append(await asyncio.wait_for(future, 5) - started)
+        except asyncio.TimeoutError:
+            state['timeouts'] += 1
+
+
+async def run_level(url, count):
+    state = {'broadcast': [], 'request': [], 'responses': 0, 'failed': 0, 'timeouts': 0, 'measuring': False}
+    clients = []
+    for start in range(0, count, CONNECT_BATCH):
+        batch = await asyncio.gather(*(connect(url, state) for _ in range(min(CONNECT_BATCH, count - start))))
+        clients.extend(client for client in batch if client is not None)
+    state['measuring'] = True
+    await asyncio.gather(*(request(client, state) for client in clients))
+    await asyncio.sleep(BROADCAST_SECONDS)
+    state['measuring'] = False
+    await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+    return state
+
+
+async def wait_server(url, timeout=60):
+    """Дождаться, пока процесс сервера импортирует main и начнёт слушать порт"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+            await asyncio.sleep(0.2)
+
+
+async def run(levels):
+    url = f'http://127.0.0.1:{PORT}'
+    supported = 0
+    await wait_server(url)
+    # Клиенты работают в одном процессе на той же машине, их накладные расходы входят в задержки
+    print(f"{'clients':>8} {'failed':>7} {'req p50':>9} {'req p99':>9} {'bcast p50':>10} {'bcast p99':>10} {'leaked':>7}")
+    for count in levels:
+        state = await run_level(url, count)
+        connected = count - state['failed']
+        # Ответ на команду должен прийти только отправителю
+        leaked = state['responses'] - (connected * REQUESTS_PER_CLIENT - state['timeouts'])
+        p99 = percentile(state['broadcast'], 99)
+        print(f"{count:>8} {state['failed']:>7} {percentile(state['request'], 50):>7.1f}ms {percentile(state['request'], 99):>7.1f}ms "
+              f"{percentile(state['broadcast'], 50):>8.1f}ms {p99:>8.1f}ms {leaked:>7}")
+        if not state['failed'] and not state['timeouts'] and p99 < P99_LIMIT_MS:
+            supported = count
+    print(f"Supported concurrent clients (p99 broadcast < {P99_LIMIT_MS:.0f} ms): {supported}")
+
+
+if __name__ == "__main__":
+    levels = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else CLIENT_LEVELS
+    server = multiprocessing.get_context('spawn').Process(target=run_server, daemon=True)
+    server.start()
+    try:
+        asyncio.run(run(levels))
+    finally:
+        server.terminate()
@@ -0,0 +1,86 @@
+import time
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlightCache:
+    """TTL-кэш, в котором одновременные запросы одного ключа ждут один вызов к API.
+
+    Потокобезопасен: вызывается из потоков Socket.IO и из executor'а бота.
+    Ошибки загрузки не кэшируются и передаются всем ожидающим.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Вернуть значение из кэша или загрузить его через loader() единожды"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+                generation = self._generation
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._forget(key, future)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._forget(key, future)
+            # Если во время загрузки был invalidate(), результат уже устарел
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def _forget(self, key, future):
+        # После invalidate() ключ может уже загружать новый лидер
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def invalidate(self, key=None):
+        """Сбросить один ключ или весь кэш.
+
+        Идущая загрузка тоже забывается: следующий get() начнёт новую, а не
+        присоединится к начатой до изменения данных.
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+                self._inflight.clear()
+            else:
+                self._entries.pop(key, None)
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'size': len(self._entries),
+                'ttl': self.ttl
+            }
@@ -0,0 +1,165 @@
+import logging
+import threading
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from api import fetch_candle_columns, decode_candles, CANDLE_INTERVALS
+from archive import sorted_unique
+from db import save_candles, load_candles
+from tinkoff_client import TinkoffAPIError
+
+# Разрыв в сохранённых свечах длиннее этого (дольше выходных и праздников) - непокрытый период
+CANDLE_SEED_MAX_GAP = timedelta(days=4)
+
+
+def column_time(value):
+    """Время из колонки time (datetime64) в datetime UTC"""
+    return datetime.fromtimestamp(int(np.datetime64(value, 's').astype(np.int64)), timezone.utc)
+
+
+class CandleSeries:
+    """Упорядоченные по времени свечи одного (figi, interval) в колонках decode_candles"""
+
+    def __init__(self):
+        self.columns = decode_candles([])
+        self.covered_from = None
+        self.covered_to = None
+        self.seeded = False
+        # Самый длинный запрошенный период: свечи старше него отбрасываются
+        self.window = timedelta(0)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def last_time(self):
+        return column_time(self.columns['time'][-1]) if len(self) else None
+
+    def upsert(self, columns):
+        """Добавить свечи; свеча с уже известным временем заменяет старую"""
+        if not len(columns['time']):
+            return
+        merged = {field: np.concatenate([self.columns[field], columns[field]]) for field in self.columns}
+        self.columns = sorted_unique(merged)
+
+    def trim(self, start_time):
+        """Отбросить свечи старше start_time"""
+        index = np.searchsorted(self.columns['time'], np.datetime64(int(start_time.timestamp()), 's'))
+        if index:
+            self.columns = {field: values[index:].copy() for field, values in self.columns.items()}
+        if self.covered_from is not None and self.covered_from < start_time:
+            self.covered_from = start_time
+
+    def since(self, start_time):
+        index = np.searchsorted(self.columns['time'], np.datetime64(int(start_time.timestamp()), 's'))
+        return {field: values[index:] for field, values in self.columns.items()}
+
+
+class CandleStore:
+    """Локальное хранилище свечей: из GetCandles догружается только недостающий период.
+
+    Свечи хранятся в колонках NumPy и разбираются из ответа API векторно
+    (decode_candles). Последняя сохранённая свеча может быть незакрытой,
+    поэтому докачка всегда начинается с её времени и перезаписывает её.
+    Загруженные свечи записываются в БД (persist=None отключает запись), при
+    первом обращении к ряду сохранённые свечи читаются из неё (loader=None
+    отключает чтение), так что после перезапуска догружается только хвост.
+    Ряд хранит не больше самого длинного запрошенного периода.
+    """
+
+    def __init__(self, fetcher=fetch_candle_columns, persist=save_candles, loader=load_candles):
+        self.fetcher = fetcher
+        self.persist = persist
+        self.loader = loader
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, figi, interval):
+        with self._lock:
+            key = (figi, interval)
+            if key not in self._series:
+                self._series[key] = CandleSeries()
+            return self._series[key]
+
+    def _missing_ranges(self, series, start_time, end_time):
+        if series.covered_from is None:
+            return [(start_time, end_time)]
+        ranges = []
+        if start_time < series.covered_from:
+            ranges.append((start_time, series.covered_from))
+        tail_start = series.last_time() or series.covered_to
+        ranges.append((max(tail_start, start_time), end_time))
+        return ranges
+
+    def _seed(self, figi, interval, series, start_time, end_time):
+        """Заполнить ряд свечами из БД; покрытым считается хвост без длинных разрывов"""
+        series.seeded = True
+        if self.loader is None:
+            return
+        try:
+            columns = self.loader(figi, interval, start_time, end_time)
+        except Exception as e:
+            logging.error(f"Error loading stored candles for figi={figi}, interval={interval}: {str(e)}")
+            return
+        times = columns['time']
+        if not len(times):
+            return
+        gaps = np.flatnonzero(np.diff(times) > np.timedelta64(int(CANDLE_SEED_MAX_GAP.total_seconds()), 's'))
+        first = gaps[-1] + 1 if len(gaps) else 0
+        series.upsert({field: values[first:] for field, values in columns.items()})
+        series.covered_from = column_time(times[first])
+        series.covered_to = series.last_time()
+        logging.info(f"CandleStore loaded {len(times) - first} stored candles for figi={figi}, interval={interval}")
+
+    def _persist(self, figi, interval, candles):
+        if self.persist is None or not len(candles['time']):
+            return
+        try:
+            self.persist(figi, candles, interval)
+        except Exception as e:
+            logging.error(f"Error persisting candles for figi={figi}, interval={interval}: {str(e)}")
+
+    def get_columns(self, figi, interval='HOUR', days=7):
+        """Свечи за последние days дней в колонках decode_candles (массивы не изменять)"""
+        interval = interval.upper()
+        if interval not in CANDLE_INTERVALS:
+            logging.error(f"Invalid interval: {interval}. Must be one of {list(CANDLE_INTERVALS)}")
+            return decode_candles([])
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=days)
+        series = self._get_series(figi, interval)
+
+        with series.lock:
+            if not series.seeded:
+                self._seed(figi, interval, series, start_time, end_time)
+            for range_start, range_end in self._missing_ranges(series, start_time, end_time):
+                try:
+                    candles = self.fetcher(figi, interval, range_start, range_end)
+                    series.upsert(candles)
+                except TinkoffAPIError as e:
+                    logging.error(f"HTTP Error in CandleStore.get_columns: {str(e)}, Response: {e.text}")
+                    continue
+                except Exception as e:
+                    logging.error(f"Error in CandleStore.get_columns: {str(e)}")
+                    continue
+                if series.covered_from is None or range_start < series.covered_from:
+                    series.covered_from = range_start
+                if series.covered_to is None or range_end > series.covered_to:
+                    series.covered_to = range_end
+                self._persist(figi, interval, candles)
+            series.window = max(series.window, timedelta(days=days))
+            series.trim(end_time - series.window)
+            candles = series.since(start_time)
+
+        logging.info(f"CandleStore returned {len(candles['time'])} candles for figi={figi}, interval={interval}")
+        return candles
+
+    def invalidate(self, figi=None, interval=None):
+        """Забыть сохранённые свечи (все или по figi/interval)"""
+        with self._lock:
+            for key in list(self._series):
+                if (figi is None or key[0] == figi) and (interval is None or key[1] == interval.upper()):
+                    del self._series[key]
+
+
+# Общее хранилище для бота и веб-интерфейса
+candle_store = CandleStore()
@@ -0,0 +1,195 @@
+import os
+import struct
+import asyncio
+import logging
+import numpy as np
+from archive import candle_columns
+from candle_store import candle_store
+
+CHART_UPDATE_INTERVAL = float(os.getenv('CHART_UPDATE_INTERVAL', 5))
+CHART_DAYS = int(os.getenv('CHART_DAYS', 7))
+CHART_FORMAT_VERSION = 1
+CHART_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+KIND_SNAPSHOT = 0
+KIND_UPDATE = 1
+# Заголовок: версия, число знаков цены, вид (снимок/обновление), резерв, число свечей
+HEADER = struct.Struct('<BBBBI')
+# Колонка: ширина дельты в байтах и первое значение
+COLUMN_HEADER = struct.Struct('<Bd')
+DELTA_TYPES = ((1, '<i1'), (2, '<i2'), (4, '<i4'), (8, '<i8'))
+MAX_PRICE_DECIMALS = 9
+
+
+def price_decimals(columns):
+    """Наименьшее число знаков, при котором все цены - целые числа шагов"""
+    prices = np.concatenate([np.asarray(columns[field], dtype=np.float64) for field in CHART_COLUMNS[1:5]])
+    for decimals in range(MAX_PRICE_DECIMALS + 1):
+        ticks = prices * 10 ** decimals
+        if np.all(np.abs(ticks - np.rint(ticks)) < 1e-4):
+            return decimals
+    return MAX_PRICE_DECIMALS
+
+
+def encode_candles(columns, kind=KIND_SNAPSHOT):
+    """Колонки свечей в бинарный пакет для графика веб-интерфейса.
+
+    Время (секунды epoch), цены (в шагах 10^-decimals) и объём - целые числа,
+    каждая колонка кодируется первым значением и разностями соседних строк
+    наименьшей подходящей ширины (1, 2, 4 или 8 байт, little-endian).
+    """
+    count = len(columns['time'])
+    decimals = price_decimals(columns) if count else 0
+    parts = [HEADER.pack(CHART_FORMAT_VERSION, decimals, kind, 0, count)]
+    for field in CHART_COLUMNS:
+        values = np.asarray(columns[field], dtype=np.float64)
+        if 1 <= CHART_COLUMNS.index(field) <= 4:
+            values = values * 10 ** decimals
+        values = np.rint(values).astype(np.int64)
+        deltas = np.diff(values)
+        largest = int(np.abs(deltas).max()) if len(deltas) else 0
+        width, dtype = next((width, dtype) for width, dtype in DELTA_TYPES
+                            if width == 8 or largest < 2 ** (8 * width - 1))
+        parts.append(COLUMN_HEADER.pack(width, float(values[0]) if count else 0.0))
+        parts.append(deltas.astype(dtype).tobytes())
+    return b''.join(parts)
+
+
+def decode_chart_payload(payload):
+    """Обратное к encode_candles: колонки и вид пакета (для проверки и тестов)"""
+    version, decimals, kind, _, count = HEADER.unpack_from(payload)
+    if version != CHART_FORMAT_VERSION:
+        raise ValueError(f"Unsupported chart payload version: {version}")
+    offset = HEADER.size
+    columns = {}
+    for field in CHART_COLUMNS:
+        width, first = COLUMN_HEADER.unpack_from(payload, offset)
+        offset += COLUMN_HEADER.size
+        dtype = dict(DELTA_TYPES)[width]
+        deltas = np.frombuffer(payload, dtype=dtype, count=max(count - 1, 0), offset=offset).astype(np.int64)
+        offset += width * max(count - 1, 0)
+        values = np.concatenate(([int(first)], int(first) + np.cumsum(deltas))) if count else np.empty(0, dtype=np.int64)
+        columns[field] = values / 10 ** decimals if 1 <= CHART_COLUMNS.index(field) <= 4 else values
+    return columns, kind
+
+
+def changed_rows(previous, current):
+    """Строки current, которых нет в previous или которые в нём отличаются"""
+    if previous is None or not len(previous['time']):
+        return np.arange(len(current['time']))
+    times = current['time']
+    # Свечи раньше последней отправленной уже закрыты и не меняются
+    start = np.searchsorted(times, previous['time'][-1])
+    index = np.arange(start, len(times))
+    if len(index) and times[start] == previous['time'][-1]:
+        if all(current[field][start] == previous[field][-1] for field in CHART_COLUMNS[1:]):
+            index = index[1:]
+    return index
+
+
+class ChartFeed:
+    """Данные графиков веб-интерфейса.
+
+    Клиент, открывший график, получает снимок свечей в комнате
+    chart:<figi>:<interval>; затем раз в update_interval комнате рассылаются
+    только новые и изменившиеся свечи. Опрашиваются лишь графики, у
+    которых есть зрители.
+    """
+
+    def __init__(self, store=candle_store, update_interval=CHART_UPDATE_INTERVAL, days=CHART_DAYS):
+        self.store = store
+        self.update_interval = update_interval
+        self.days = days
+        self.server = None
+        self.updates = 0
+        self._charts = {}
+        self._viewers = {}
+        self._task = None
+
+    @staticmethod
+    def room(figi, interval):
+        return f"chart:{figi}:{interval}"
+
+    def _load(self, figi, interval):
+        return candle_columns(self.store.get_columns(figi, interval, days=self.days))
+
+    async def open(self, sid, figi, interval):
+        """Подписать клиента на график; возвращает снимок (None, если свечей нет)"""
+        await self.close(sid)
+        columns = await asyncio.to_thread(self._load, figi, interval)
+        if not len(columns['time']):
+            return None
+        key = (figi, interval)
+        # У открытого графика базу для разностей не трогаем: иначе другие зрители
+        # пропустят свечи между прошлой рассылкой и этим снимком
+        chart = self._charts.setdefault(key, {'sids': set(), 'sent': columns})
+        chart['sids'].add(sid)
+        self._viewers[sid] = key
+        await self.server.enter_room(sid, self.room(figi, interval))
+        return encode_candles(columns)
+
+    async def close(self, sid):
+        """Отписать клиента от его графика (при смене графика и отключении)"""
+        key = self._viewers.pop(sid, None)
+        if key is None:
+            return
+        chart = self._charts.get(key)
+        if chart is not None:
+            chart['sids'].discard(sid)
+            if not chart['sids']:
+                del self._charts[key]
+        try:
+            await self.server.leave_room(sid, self.room(*key))
+        except Exception:
+            pass
+
+    async def refresh(self, figi, interval):
+        """Разослать зрителям графика новые и изменённые свечи"""
+        chart = self._charts.get((figi, interval))
+        if chart is None:
+            return 0
+        columns = await asyncio.to_thread(self._load, figi, interval)
+        if not len(columns['time']):
+            return 0
+        index = changed_rows(chart['sent'], columns)
+        chart['sent'] = columns
+        if not len(index):
+            return 0
+        update = {field: columns[field][index] for field in CHART_COLUMNS}
+        await self.server.emit('chart_update', {'figi': figi, 'interval': interval,
+                                                'data': encode_candles(update, KIND_UPDATE)},
+                               room=self.room(figi, interval))
+        self.updates += 1
+        return len(index)
+
+    def start(self, server):
+        """Запустить рассылку обновлений в текущем event loop (server - socketio.AsyncServer)"""
+        self.server = server
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            keys = list(self._charts)
+            results = await asyncio.gather(*(self.refresh(figi, interval) for figi, interval in keys),
+                                           return_exceptions=True)
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Chart update error for {key}: {str(result)}")
+
+    def stats(self):
+        return {'charts': len(self._charts), 'viewers': len(self._viewers), 'updates': self.updates}
+
+
+# Общая рассылка графиков для веб-интерфейса
+chart_feed = ChartFeed()
@@ -0,0 +1,181 @@
+import os
+import asyncio
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from api import candles_to_frame, candles_frame
+
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', 2))
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 64))
+
+
+def _init_worker():
+    """Инициализатор процесса: Agg, шрифты и стиль mplfinance загружаются до первого запроса"""
+    import matplotlib
+    matplotlib.use('Agg')
+    render_png([
+        {'date': '2024-01-01T10:00:00Z', 'open': 1, 'high': 2, 'low': 0.5, 'close': 1.5, 'volume': 1},
+        {'date': '2024-01-01T11:00:00Z', 'open': 1.5, 'high': 2, 'low': 1, 'close': 1.2, 'volume': 1}
+    ], 'warm-up')
+
+
+def _noop():
+    return None
+
+
+def render_png(candles, title="Price Chart", size=None):
+    """Отрисовать свечной график в PNG (выполняется в процессе пула).
+
+    candles - колонки decode_candles, список dict api.get_candles или DataFrame.
+    """
+    import mplfinance as mpf
+    df = candles_frame(candles) if isinstance(candles, dict) else candles_to_frame(candles)
+    buffer = BytesIO()
+    kwargs = {'figsize': size} if size else {}
+    mpf.plot(df, type='candle', style='charles',
+             title=title,
+             ylabel='Price',
+             savefig=dict(fname=buffer, dpi=100, bbox_inches='tight'),
+             **kwargs)
+    return buffer.getvalue()
+
+
+def chart_key(figi, interval, candles, title="Price Chart", size=None):
+    """Ключ кэша: инструмент, интервал, последняя свеча, заголовок и размер.
+
+    Незакрытая свеча меняется без смены времени, поэтому в ключ входит и её close.
+    """
+    if isinstance(candles, pd.DataFrame):
+        last_time, last_close = candles.index[-1].isoformat(), float(candles['close'].iloc[-1])
+    elif isinstance(candles, dict):
+        last_time, last_close = str(candles['time'][-1]), float(candles['close'][-1])
+    else:
+        last_time, last_close = candles[-1]['date'], candles[-1]['close']
+    return (figi, interval, last_time, last_close, title, tuple(size) if size else None)
+
+
+class ChartRenderer:
+    """Пул процессов для отрисовки графиков с LRU-кэшем готовых PNG.
+
+    Если процесс пула погиб (например, его убил OOM killer), пул
+    пересоздаётся и отрисовка повторяется один раз.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, cache_size=CHART_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.restarts = 0
+        self._pool = None
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запустить и прогреть процессы пула"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+                for _ in range(self.workers):
+                    self._pool.submit(_noop)
+        return self._pool
+
+    def _restart(self, broken):
+        """Заменить сломанный пул новым (если его ещё не заменил другой поток)"""
+        with self._lock:
+            if self._pool is not broken:
+                return
+            self._pool = None
+            self.restarts += 1
+        logging.warning("Chart process pool is broken, starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def _render(self, target, candles, title, size, retry=True):
+        """Отрисовать в пуле и передать результат в target; после BrokenProcessPool - один повтор"""
+        pool = self.start()
+        try:
+            future = pool.submit(render_png, candles, title, size)
+        except BrokenProcessPool as e:
+            future = Future()
+            future.set_exception(e)
+
+        def done(finished):
+            error = None if finished.cancelled() else finished.exception()
+            if isinstance(error, BrokenProcessPool) and retry:
+                self._restart(pool)
+                self._render(target, candles, title, size, retry=False)
+            elif finished.cancelled():
+                target.cancel()
+            elif error is not None:
+                target.set_exception(error)
+            else:
+                target.set_result(finished.result())
+        future.add_done_callback(done)
+
+    def submit(self, figi, interval, candles, title="Price Chart", size=None):
+        """Future с PNG: из кэша, уже идущей отрисовки или новой задачи пула"""
+        key = chart_key(figi, interval, candles, title, size)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            future = self._pending.get(key)
+            created = future is None
+            if created:
+                self.misses += 1
+                future = Future()
+                self._pending[key] = future
+        if created:
+            # Отрисовка и колбэк вне блокировки: у завершённого future колбэк вызывается сразу
+            future.add_done_callback(lambda f: self._store(key, f))
+            self._render(future, candles, title, size)
+        return future
+
+    def _store(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def render(self, figi, interval, candles, title="Price Chart", size=None):
+        """Получить PNG, блокируя текущий поток (для Socket.IO)"""
+        try:
+            return self.submit(figi, interval, candles, title, size).result()
+        except Exception as e:
+            logging.error(f"Error in ChartRenderer.render: {str(e)}")
+            return None
+
+    async def render_async(self, figi, interval, candles, title="Price Chart", size=None):
+        """Получить PNG, не блокируя event loop"""
+        try:
+            return await asyncio.wrap_future(self.submit(figi, interval, candles, title, size))
+        except Exception as e:
+            logging.error(f"Error in ChartRenderer.render_async: {str(e)}")
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'restarts': self.restarts, 'size': len(self._cache)}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий рендерер для бота и веб-интерфейса
+chart_renderer = ChartRenderer()
@@ -1,28 +1,273 @@
+import os
+import queue
 import sqlite3
+import logging
+import calendar
+import threading
 from datetime import datetime
+import numpy as np
+
+DB_FILE = os.getenv('DB_FILE', 'trades.db')
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 5000))
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', 0.5))
+
+INSERT_CANDLE = '''INSERT INTO candles (figi, interval, time, open, high, low, close, volume)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (figi, interval, time) DO UPDATE SET
+                   open = excluded.open, high = excluded.high, low = excluded.low,
+                   close = excluded.close, volume = excluded.volume'''
+INSERT_TRADE = 'INSERT INTO trades VALUES (?, ?, ?, ?, ?)'
+SELECT_CANDLES = '''SELECT time, open, high, low, close, volume FROM candles
+                    WHERE figi = ? AND interval = ? AND time >= ? AND time < ?
+                    ORDER BY time'''
+UPSERT_FILE_ID = '''INSERT INTO telegram_files (key, file_id, used_at) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET file_id = excluded.file_id, used_at = excluded.used_at'''
+DELETE_FILE_ID = 'DELETE FROM telegram_files WHERE key = ?'
+SELECT_FILE_IDS = 'SELECT key, file_id, used_at FROM telegram_files ORDER BY used_at DESC LIMIT ?'
+CANDLE_DTYPE = np.dtype([('time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                         ('close', 'f8'), ('volume', 'i8')])
+# Интервал строк, перенесённых из старой таблицы candles, где он не хранился
+LEGACY_INTERVAL = 'UNKNOWN'
+
+# Миграции схемы; номер последней применённой хранится в PRAGMA user_version
+MIGRATIONS = [
+    '''CREATE TABLE IF NOT EXISTS candles
+       (figi TEXT, time TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER);
+       CREATE TABLE IF NOT EXISTS trades
+       (figi TEXT, direction TEXT, price REAL, quantity INTEGER, time TEXT);''',
+    # Время в секундах epoch, интервал и первичный ключ вместо дублей и полного просмотра;
+    # таблица WITHOUT ROWID упорядочена по ключу и сама служит покрывающим индексом
+    f'''CREATE TABLE candles_v2
+       (figi TEXT NOT NULL, interval TEXT NOT NULL, time INTEGER NOT NULL,
+        open REAL, high REAL, low REAL, close REAL, volume INTEGER,
+        PRIMARY KEY (figi, interval, time)) WITHOUT ROWID;
+       INSERT OR REPLACE INTO candles_v2
+       SELECT figi, '{LEGACY_INTERVAL}', CAST(strftime('%s', time) AS INTEGER), open, high, low, close, volume
+       FROM candles WHERE figi IS NOT NULL AND strftime('%s', time) IS NOT NULL;
+       DROP TABLE candles;
+       ALTER TABLE candles_v2 RENAME TO candles;
+       CREATE INDEX IF NOT EXISTS trades_figi_time ON trades (figi, time);''',
+    # file_id загруженных в Telegram файлов; used_at - время последнего использования для LRU
+    '''CREATE TABLE telegram_files
+       (key TEXT PRIMARY KEY, file_id TEXT NOT NULL, used_at REAL NOT NULL) WITHOUT ROWID;
+       CREATE INDEX telegram_files_used_at ON telegram_files (used_at);'''
+]
+
+
+def connect(path):
+    """Соединение SQLite в режиме WAL"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def migrate(conn):
+    """Применить недостающие миграции схемы, каждую в своей транзакции"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        logging.info(f"Applying database migration {number}")
+        try:
+            conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS)
+
+
+def epoch_seconds(value):
+    """Время свечи (ISO-строка API, datetime или число) в секунды epoch UTC"""
+    if isinstance(value, str):
+        # 'YYYY-MM-DDTHH:MM:SS...' - срезы заметно быстрее strptime на больших пачках
+        return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return calendar.timegm(value.timetuple())
+        return int(value.timestamp())
+    return int(value)
+
+
+def candle_rows(figi, interval, candles):
+    """Строки для INSERT_CANDLE из свечей api.get_candles или колонок api.decode_candles"""
+    if isinstance(candles, dict):
+        times = np.asarray(candles['time']).astype('datetime64[s]').astype(np.int64)
+        return list(zip([figi] * len(times), [interval] * len(times), times.tolist(),
+                        *(np.asarray(candles[field]).tolist() for field in ('open', 'high', 'low', 'close', 'volume'))))
+    return [(figi, interval, epoch_seconds(candle.get('date', candle.get('time'))),
+             candle['open'], candle['high'], candle['low'], candle['close'], candle['volume'])
+            for candle in candles]
+
+
+class Storage:
+    """Запись в SQLite через очередь и фоновый поток.
+
+    Поток держит одно соединение и записывает накопившиеся строки пачками
+    через executemany в одной транзакции; flush() дожидается записи всего,
+    что было поставлено в очередь до вызова.
+    """
+
+    def __init__(self, path=DB_FILE, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.errors = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._writer, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def executemany(self, sql, rows):
+        """Поставить строки в очередь на запись"""
+        rows = list(rows)
+        if rows:
+            self.start()
+            self._queue.put((sql, rows))
+
+    def execute(self, sql, params=()):
+        self.executemany(sql, [params])
+
+    def flush(self, timeout=None):
+        """Дождаться записи всего, что уже в очереди"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Записать очередь и остановить поток"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _writer(self):
+        conn = connect(self.path)
+        try:
+            try:
+                migrate(conn)
+            except Exception as e:
+                logging.error(f"Error migrating {self.path}: {str(e)}")
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                batch = [item]
+                # Добираем накопившееся до batch_size строк, ожидая не дольше flush_interval;
+                # flush() и close() завершают пачку сразу
+                size = 0
+                while item is not None and not isinstance(item, threading.Event):
+                    size += len(item[1])
+                    if size >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                waiters = []
+                statements = []
+                for item in batch:
+                    if item is None:
+                        stopping = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif statements and statements[-1][0] == item[0]:
+                        statements[-1][1].extend(item[1])
+                    else:
+                        statements.append((item[0], list(item[1])))
+                self._write(conn, statements)
+                for done in waiters:
+                    done.set()
+        finally:
+            conn.close()
+
+    def _write(self, conn, statements):
+        if not statements:
+            return
+        try:
+            with conn:
+                for sql, rows in statements:
+                    conn.executemany(sql, rows)
+            self.written += sum(len(rows) for _, rows in statements)
+            return
+        except Exception as e:
+            if len(statements) == 1:
+                self.errors += 1
+                logging.error(f"Error writing to {self.path}: {str(e)}")
+                return
+        # Ошибочный запрос не должен откатывать остальные записи пачки
+        for statement in statements:
+            self._write(conn, [statement])
+
+    def reader(self):
+        """Соединение для чтения, своё у каждого потока (WAL не блокирует чтение записью)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def stats(self):
+        return {'written': self.written, 'errors': self.errors, 'queued': self._queue.qsize()}
+
+
+# Общее хранилище: все записи идут через один поток и одно соединение
+storage = Storage()
+
 
 def init_db():
-    conn = sqlite3.connect('trades.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS candles
-                 (figi TEXT, time TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS trades
-                 (figi TEXT, direction TEXT, price REAL, quantity INTEGER, time TEXT)''')
-    conn.commit()
-    conn.close()
-
-def save_candle(figi, candle):
-    conn = sqlite3.connect('trades.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO candles VALUES (?, ?, ?, ?, ?, ?, ?)',
-              (figi, candle['time'], candle['open'], candle['high'], candle['low'], candle['close'], candle['volume']))
-    conn.commit()
-    conn.close()
+    conn = connect(storage.path)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    storage.start()
+
+def save_candles(figi, candles, interval='HOUR'):
+    """Записать пачку свечей одной транзакцией (асинхронно, через очередь).
+
+    Повторная запись свечи с тем же временем обновляет её, а не создаёт дубль.
+    """
+    storage.executemany(INSERT_CANDLE, candle_rows(figi, interval.upper(), candles))
+
+def save_candle(figi, candle, interval='HOUR'):
+    save_candles(figi, [candle], interval)
+
+def load_candles(figi, interval, start_time, end_time):
+    """Свечи за [start_time, end_time) в колонках, как api.decode_candles"""
+    storage.flush()
+    cursor = storage.reader().execute(SELECT_CANDLES, (
+        figi, interval.upper(), epoch_seconds(start_time), epoch_seconds(end_time)))
+    rows = np.fromiter(cursor, dtype=CANDLE_DTYPE)
+    columns = {field: np.ascontiguousarray(rows[field]) for field in CANDLE_DTYPE.names}
+    columns['time'] = columns['time'].astype('datetime64[s]')
+    return columns
 
 def save_trade(figi, direction, price, quantity):
-    conn = sqlite3.connect('trades.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO trades VALUES (?, ?, ?, ?, ?)',
-              (figi, direction, price, quantity, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    storage.execute(INSERT_TRADE, (figi, direction, price, quantity, datetime.now().isoformat()))
+
+def save_file_id(key, file_id, used_at):
+    storage.execute(UPSERT_FILE_ID, (key, file_id, used_at))
+
+def delete_file_ids(keys):
+    storage.executemany(DELETE_FILE_ID, [(key,) for key in keys])
+
+def load_file_ids(limit):
+    """Последние использованные file_id: [(key, file_id, used_at)], свежие первыми"""
+    storage.flush()
+    return storage.reader().execute(SELECT_FILE_IDS, (limit,)).fetchall()
+
+def flush_db(timeout=None):
+    """Дождаться записи очереди на диск"""
+    return storage.flush(timeout)
+
+def close_db(timeout=None):
+    """Записать очередь и закрыть соединение (при остановке приложения)"""
+    storage.close(timeout)
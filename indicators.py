@@ -0,0 +1,329 @@
+import numpy as np
+import pandas as pd
+from db import epoch_seconds
+
+INDICATOR_HISTORY = 512
+
+
+def candle_epoch(value):
+    """Время свечи (ISO-строка, datetime, datetime64 или epoch) в секунды epoch"""
+    if isinstance(value, np.datetime64):
+        return int(value.astype('datetime64[s]').astype(np.int64))
+    return epoch_seconds(value)
+
+
+class RingBuffer:
+    """Последние capacity значений в массиве NumPy; последнее можно перезаписать"""
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.data = np.full(capacity, np.nan, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+        self.head = 0
+
+    def append(self, value):
+        """Добавить значение; возвращает вытесненное (nan, пока буфер не заполнен)"""
+        removed = self.data[self.head]
+        self.data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return removed
+
+    def replace_last(self, value):
+        self.data[(self.head - 1) % self.capacity] = value
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)[-self.capacity:]
+        for value in values:
+            self.append(value)
+
+    def last(self, k=1):
+        """Последние k значений по порядку (копия)"""
+        k = min(k, self.count)
+        index = (self.head - k + np.arange(k)) % self.capacity
+        return self.data[index]
+
+    def __len__(self):
+        return self.count
+
+
+class Indicator:
+    """Индикатор над потоком свечей.
+
+    Состояние хранится по закрытым свечам, значение текущей (незакрытой)
+    свечи считается поверх него, поэтому её перезапись стоит O(1). Свеча с
+    новым временем закрывает предыдущую. seed() считает историю одним
+    векторным проходом.
+    """
+
+    def __init__(self, history=INDICATOR_HISTORY):
+        self.values = RingBuffer(history)
+        self.time = None
+        self.current = None
+        self.value = np.nan
+
+    def update(self, time, candle):
+        """Учесть новую или изменённую текущую свечу; возвращает значение индикатора"""
+        time = candle_epoch(time)
+        if self.time is not None and time < self.time:
+            raise ValueError(f"Candle at {time} is older than the current candle at {self.time}")
+        if self.time is None or time > self.time:
+            if self.current is not None:
+                self._commit(self.current)
+            self.time = time
+            self.current = candle
+            self.value = self._value(candle)
+            self.values.append(self.value)
+        else:
+            self.current = candle
+            self.value = self._value(candle)
+            self.values.replace_last(self.value)
+        return self.value
+
+    def seed(self, columns):
+        """Посчитать историю (колонки decode_candles); возвращает массив значений"""
+        times = np.asarray(columns['time'])
+        if not len(times):
+            return np.empty(0)
+        series = self._series(columns)
+        self._reset()
+        if len(times) > 1:
+            self._seed_state(columns, len(times) - 1)
+        self.time = candle_epoch(times[-1])
+        self.current = {field: columns[field][-1] for field in ('open', 'high', 'low', 'close', 'volume')
+                        if field in columns}
+        self.value = series[-1]
+        self.values = RingBuffer(self.values.capacity)
+        self.values.extend(series)
+        return series
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _series(self, columns):
+        raise NotImplementedError
+
+    def _seed_state(self, columns, end):
+        """Состояние по закрытым свечам [0, end)"""
+        raise NotImplementedError
+
+    def _commit(self, candle):
+        raise NotImplementedError
+
+    def _value(self, candle):
+        raise NotImplementedError
+
+
+class SMA(Indicator):
+    """Простая скользящая средняя close за period свечей"""
+
+    def __init__(self, period, history=INDICATOR_HISTORY):
+        super().__init__(history)
+        self.period = period
+        self._reset()
+
+    def _reset(self):
+        # period - 1 закрытых close и их сумма; текущая свеча добавляется при расчёте
+        self.closes = RingBuffer(max(1, self.period - 1))
+        self.total = 0.0
+        self.commits = 0
+
+    def _commit(self, candle):
+        if self.period == 1:
+            return
+        removed = self.closes.append(candle['close'])
+        self.total += candle['close'] - (0.0 if np.isnan(removed) else removed)
+        self.commits += 1
+        # Пересчёт суммы раз в period шагов не даёт накапливаться ошибке округления
+        if self.commits % self.period == 0:
+            self.total = float(self.closes.last(self.closes.count).sum())
+
+    def _value(self, candle):
+        if self.period > 1 and self.closes.count < self.period - 1:
+            return np.nan
+        return (self.total + candle['close']) / self.period
+
+    def _series(self, columns):
+        return pd.Series(np.asarray(columns['close'], dtype=np.float64)).rolling(self.period).mean().to_numpy()
+
+    def _seed_state(self, columns, end):
+        if self.period > 1:
+            self.closes.extend(np.asarray(columns['close'][:end], dtype=np.float64))
+            self.total = float(self.closes.last(self.closes.count).sum())
+
+
+class EMA(Indicator):
+    """Экспоненциальная средняя close: alpha = 2 / (period + 1), начиная с первой свечи"""
+
+    def __init__(self, period, history=INDICATOR_HISTORY):
+        super().__init__(history)
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self._reset()
+
+    def _reset(self):
+        self.ema = None
+
+    def _commit(self, candle):
+        self.ema = self._value(candle)
+
+    def _value(self, candle):
+        if self.ema is None:
+            return float(candle['close'])
+        return self.alpha * candle['close'] + (1 - self.alpha) * self.ema
+
+    def _series(self, columns):
+        return pd.Series(np.asarray(columns['close'], dtype=np.float64)).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+
+    def _seed_state(self, columns, end):
+        self.ema = float(self._series({'close': columns['close'][:end]})[-1])
+
+
+class RSI(Indicator):
+    """RSI Уайлдера: сглаживание приростов и падений close с alpha = 1 / period"""
+
+    def __init__(self, period=14, history=INDICATOR_HISTORY):
+        super().__init__(history)
+        self.period = period
+        self.alpha = 1 / period
+        self._reset()
+
+    def _reset(self):
+        self.prev_close = None
+        self.gain = None
+        self.loss = None
+        self.deltas = 0
+
+    def _averages(self, candle):
+        change = candle['close'] - self.prev_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if self.gain is None:
+            return gain, loss
+        return (self.alpha * gain + (1 - self.alpha) * self.gain,
+                self.alpha * loss + (1 - self.alpha) * self.loss)
+
+    def _commit(self, candle):
+        if self.prev_close is not None:
+            self.gain, self.loss = self._averages(candle)
+            self.deltas += 1
+        self.prev_close = float(candle['close'])
+
+    def _value(self, candle):
+        if self.prev_close is None or self.deltas + 1 < self.period:
+            return np.nan
+        gain, loss = self._averages(candle)
+        return rsi_value(gain, loss)
+
+    def _series(self, columns):
+        close = pd.Series(np.asarray(columns['close'], dtype=np.float64))
+        change = close.diff().iloc[1:]
+        gain = change.clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        loss = (-change).clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        values = np.full(len(close), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[1:] = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        values[:self.period] = np.nan
+        return values
+
+    def _seed_state(self, columns, end):
+        close = np.asarray(columns['close'][:end], dtype=np.float64)
+        self.prev_close = float(close[-1])
+        self.deltas = len(close) - 1
+        if self.deltas:
+            change = pd.Series(np.diff(close))
+            self.gain = float(change.clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().iloc[-1])
+            self.loss = float((-change).clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().iloc[-1])
+
+
+def rsi_value(gain, loss):
+    if loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + gain / loss)
+
+
+class VWAP(Indicator):
+    """VWAP внутри торгового дня по типичной цене (high + low + close) / 3.
+
+    День считается по времени UTC + session_offset (по умолчанию московское).
+    """
+
+    def __init__(self, session_offset=3 * 3600, history=INDICATOR_HISTORY):
+        super().__init__(history)
+        self.session_offset = session_offset
+        self._reset()
+
+    def _reset(self):
+        self.session = None
+        self.price_volume = 0.0
+        self.volume = 0.0
+
+    def _session(self, time):
+        return (time + self.session_offset) // 86400
+
+    @staticmethod
+    def _typical(candle):
+        return (candle['high'] + candle['low'] + candle['close']) / 3
+
+    def _commit(self, candle):
+        session = self._session(self.time)
+        if session != self.session:
+            self.session, self.price_volume, self.volume = session, 0.0, 0.0
+        self.price_volume += self._typical(candle) * candle['volume']
+        self.volume += candle['volume']
+
+    def _value(self, candle):
+        price_volume, volume = candle['volume'] * self._typical(candle), float(candle['volume'])
+        if self.session == self._session(self.time):
+            price_volume += self.price_volume
+            volume += self.volume
+        return price_volume / volume if volume else np.nan
+
+    def _series(self, columns):
+        times = np.asarray(columns['time'])
+        if np.issubdtype(times.dtype, np.datetime64):
+            times = times.astype('datetime64[s]').astype(np.int64)
+        sessions = (times + self.session_offset) // 86400
+        volume = np.asarray(columns['volume'], dtype=np.float64)
+        typical = (np.asarray(columns['high'], dtype=np.float64) + np.asarray(columns['low'], dtype=np.float64)
+                   + np.asarray(columns['close'], dtype=np.float64)) / 3
+        frame = pd.DataFrame({'session': sessions, 'pv': typical * volume, 'volume': volume})
+        sums = frame.groupby('session')[['pv', 'volume']].cumsum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(sums['volume'] > 0, sums['pv'] / sums['volume'], np.nan)
+
+    def _seed_state(self, columns, end):
+        times = np.asarray(columns['time'])
+        last = candle_epoch(times[end])
+        session = self._session(last)
+        # Закрытые свечи того же дня, что и текущая
+        start = end
+        while start > 0 and self._session(candle_epoch(times[start - 1])) == session:
+            start -= 1
+        self.session = session
+        volume = np.asarray(columns['volume'][start:end], dtype=np.float64)
+        typical = (np.asarray(columns['high'][start:end], dtype=np.float64)
+                   + np.asarray(columns['low'][start:end], dtype=np.float64)
+                   + np.asarray(columns['close'][start:end], dtype=np.float64)) / 3
+        self.price_volume = float((typical * volume).sum())
+        self.volume = float(volume.sum())
+
+
+class IndicatorSet:
+    """Набор именованных индикаторов одного инструмента и интервала"""
+
+    def __init__(self, **indicators):
+        self.indicators = indicators
+
+    def seed(self, columns):
+        return {name: indicator.seed(columns) for name, indicator in self.indicators.items()}
+
+    def update(self, candle):
+        """Свеча в формате api.get_candles ('date', open, high, low, close, volume)"""
+        time = candle.get('date', candle.get('time'))
+        return {name: indicator.update(time, candle) for name, indicator in self.indicators.items()}
+
+    def values(self):
+        return {name: indicator.value for name, indicator in self.indicators.items()}
+
+    def __getitem__(self, name):
+        return self.indicators[name]
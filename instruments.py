@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import bisect
+import difflib
+import logging
+import threading
+from api import get_available_instruments
+
+INSTRUMENTS_FILE = os.getenv('INSTRUMENTS_FILE', 'instruments.json')
+INSTRUMENTS_REFRESH_INTERVAL = float(os.getenv('INSTRUMENTS_REFRESH_INTERVAL', 24 * 3600))
+INSTRUMENT_TYPES = ('Shares', 'Currencies')
+
+
+class InstrumentIndex:
+    """Неизменяемый индекс инструментов: figi/ticker за O(1), префиксы через bisect"""
+
+    def __init__(self, instruments):
+        self.instruments = instruments
+        self.by_figi = {item['figi']: item for item in instruments}
+        self.by_ticker = {}
+        for item in instruments:
+            self.by_ticker.setdefault(item['ticker'].upper(), item)
+        # Отсортированные ключи (тикер и каждое слово названия) для поиска по префиксу
+        keys = set()
+        for item in instruments:
+            keys.add((item['ticker'].lower(), item['figi']))
+            for word in item['name'].lower().split():
+                keys.add((word, item['figi']))
+        self.prefix_keys = sorted(keys)
+        self.names = {item['name'].lower(): item for item in instruments}
+
+    def prefix(self, query, limit):
+        query = query.lower()
+        start = bisect.bisect_left(self.prefix_keys, (query, ''))
+        found = []
+        for key, figi in self.prefix_keys[start:]:
+            if not key.startswith(query) or len(found) >= limit:
+                break
+            item = self.by_figi[figi]
+            if item not in found:
+                found.append(item)
+        return found
+
+
+EMPTY_INDEX = InstrumentIndex([])
+
+
+class InstrumentDirectory:
+    """Справочник инструментов с кэшем на диске.
+
+    Индекс загружается с диска при первом обращении и обновляется из API
+    в фоновом потоке, когда файл старше INSTRUMENTS_REFRESH_INTERVAL.
+    """
+
+    def __init__(self, path=INSTRUMENTS_FILE, refresh_interval=INSTRUMENTS_REFRESH_INTERVAL,
+                 instrument_types=INSTRUMENT_TYPES):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.instrument_types = instrument_types
+        self._index = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data['updated_at'], data['instruments']
+        except FileNotFoundError:
+            return 0, None
+        except Exception as e:
+            logging.error(f"Error loading instruments from {self.path}: {str(e)}")
+            return 0, None
+
+    def _index_or_load(self):
+        index = self._index
+        if index is not None:
+            return index
+        with self._lock:
+            if self._index is None:
+                self._loaded_at, instruments = self._load_from_disk()
+                if instruments is None:
+                    instruments = self._fetch()
+                if not instruments:
+                    # Не кэшируем пустой индекс после неудачной загрузки: повторим при следующем обращении
+                    return EMPTY_INDEX
+                self._index = InstrumentIndex(instruments)
+            return self._index
+
+    def _fetch(self):
+        instruments = []
+        for instrument_type in self.instrument_types:
+            items = get_available_instruments(instrument_type)
+            for item in items:
+                item['type'] = instrument_type
+            instruments.extend(items)
+        if not instruments:
+            return None
+        updated_at = time.time()
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'updated_at': updated_at, 'instruments': instruments}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error saving instruments to {self.path}: {str(e)}")
+        self._loaded_at = updated_at
+        logging.info(f"Instrument directory refreshed: {len(instruments)} instruments")
+        return instruments
+
+    def refresh(self):
+        """Загрузить справочник из API и заменить индекс"""
+        instruments = self._fetch()
+        if instruments:
+            self._index = InstrumentIndex(instruments)
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self._index_or_load()
+            age = time.time() - self._loaded_at
+            if age >= self.refresh_interval:
+                self.refresh()
+                age = time.time() - self._loaded_at
+            self._stop.wait(max(60, self.refresh_interval - age))
+
+    def start(self):
+        """Запустить фоновое обновление справочника"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name='instrument-directory', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, figi):
+        return self._index_or_load().by_figi.get(figi)
+
+    def by_ticker(self, ticker):
+        return self._index_or_load().by_ticker.get(ticker.upper())
+
+    def search(self, query, limit=10):
+        """Поиск: точный тикер, затем префикс тикера или слова названия, затем нечёткий по названию"""
+        query = query.strip()
+        if not query:
+            return []
+        index = self._index_or_load()
+        exact = index.by_ticker.get(query.upper())
+        results = [exact] if exact else []
+        for item in index.prefix(query, limit):
+            if item not in results:
+                results.append(item)
+        if len(results) < limit:
+            for name in difflib.get_close_matches(query.lower(), list(index.names), n=limit, cutoff=0.6):
+                item = index.names[name]
+                if item not in results:
+                    results.append(item)
+        return results[:limit]
+
+    def resolve(self, query):
+        """figi по figi, тикеру или названию; None, если ничего не найдено"""
+        index = self._index_or_load()
+        if query in index.by_figi:
+            return query
+        results = self.search(query, limit=1)
+        return results[0]['figi'] if results else None
+
+    def lot_size(self, figi, default=1):
+        """Размер лота (default, если инструмент неизвестен)"""
+        item = self.get(figi)
+        return int(item.get('lot') or 1) if item else default
+
+    def display_name(self, figi):
+        """'SBER (Сбербанк)' для известного figi, иначе сам figi"""
+        item = self.get(figi)
+        if item is None:
+            return figi
+        return f"{item['ticker']} ({item['name']})"
+
+
+# Общий справочник для бота и веб-интерфейса
+instrument_directory = InstrumentDirectory()
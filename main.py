@@ -1,15 +1,23 @@
 import asyncio
 import os
 import logging
+import threading
 import requests
-from flask import Flask, render_template
-from flask_socketio import SocketIO
-from api import open_sandbox_account, sandbox_pay_in, get_portfolio, get_current_prices, get_candles, generate_chart_image
-from trade import trade_loop
-from tg_bot import send_message, bot, dp
-from db import init_db
+import socketio
+from aiohttp import web
+from api import open_sandbox_account, sandbox_pay_in, cache_stats
+from chart_feed import chart_feed
+from chart_render import chart_renderer
+from market_stream import market_stream, price_board
+from instruments import instrument_directory
+from trade import make_strategies, STRATEGIES
+from scheduler import trading_scheduler
+from positions import position_book
+from tg_bot import send_message, bot, dp, outbox, handler_dispatch, CHART_INTERVALS, DEFAULT_CHART_FIGI
+from db import init_db, close_db
 from dotenv import load_dotenv
-from news import NewsReader, default_serializer
+from news import news_store, default_serializer
+from tinkoff_client import client as tinkoff_client
 import json
 from datetime import datetime
 
@@ -21,26 +29,32 @@ load_dotenv()
 SANDBOX_API_URL = "https://sandbox-invest-public-api.tinkoff.ru/openapi"
 TINKOFF_TOKEN = os.getenv('TINKOFF_SANDBOX_TOKEN')
 
-# Инициализация модуля новостей
-news_reader = NewsReader()
+# Веб-интерфейс: Socket.IO поверх aiohttp в основном event loop
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('WEB_PORT', 3000))
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+# Комнаты для общих данных; новый клиент подписан на все
+TOPICS = ('prices', 'trading')
+# Не чаще одной рассылки изменившихся цен за этот интервал (секунды)
+PRICE_BROADCAST_INTERVAL = float(os.getenv('PRICE_BROADCAST_INTERVAL', 0.5))
 
-# Инициализация Flask и SocketIO
-app = Flask(__name__)
-socketio = SocketIO(app, async_mode='threading')
+sio = socketio.AsyncServer(async_mode='aiohttp')
+app = web.Application()
+sio.attach(app)
+web_loop = None
 
 # Глобальные переменные
 account_id = None
-trading_active = False
 
 async def init_sandbox():
     """Инициализация счёта песочницы"""
     global account_id
     try:
         logging.info("Initializing sandbox account...")
-        account_id = open_sandbox_account()
+        account_id = await asyncio.to_thread(open_sandbox_account)
         if account_id:
             logging.info(f"Sandbox account created or retrieved: {account_id}")
-            sandbox_pay_in(account_id, 100000)
+            await asyncio.to_thread(sandbox_pay_in, account_id, 100000)
             await send_message(f"Sandbox account initialized: {account_id}")
         else:
             raise Exception("Failed to create or retrieve sandbox account")
@@ -49,102 +63,160 @@ async def init_sandbox():
         await send_message(f"Failed to initialize sandbox: {str(e)}")
         raise
 
-@app.route('/')
-def index():
+async def index(request):
     """Главная страница"""
-    return render_template('index.html')
+    return web.FileResponse(os.path.join(TEMPLATES_DIR, 'index.html'))
 
-@socketio.on('connect')
-def handle_connect():
+app.router.add_get('/', index)
+
+def publish(topic, event, data):
+    """Разослать событие комнате topic (можно вызывать из любого потока)"""
+    if web_loop is None:
+        return
+    coro = sio.emit(event, data, room=topic)
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is web_loop:
+        web_loop.create_task(coro)
+    else:
+        asyncio.run_coroutine_threadsafe(coro, web_loop)
+
+@sio.event
+async def connect(sid, environ):
     """Обработка подключения клиента"""
-    logging.info("Client connected")
-    socketio.emit('log', {'message': 'Client connected'})
+    logging.info(f"Client connected: {sid}")
+    for topic in TOPICS:
+        await sio.enter_room(sid, topic)
+    await sio.emit('log', {'message': 'Client connected'}, to=sid)
+    await sio.emit('prices', price_broadcaster.snapshot(), to=sid)
+
+@sio.event
+async def disconnect(sid, *args):
+    logging.info(f"Client disconnected: {sid}")
+    await chart_feed.close(sid)
 
-@socketio.on('command')
-def handle_command(data):
-    """Обработка команд от клиента"""
-    global trading_active
+@sio.on('subscribe')
+async def handle_subscribe(sid, data):
+    """Подписать клиента на комнаты {'topics': [...]}"""
+    topics = [topic for topic in data.get('topics', []) if topic in TOPICS]
+    for topic in topics:
+        await sio.enter_room(sid, topic)
+    await sio.emit('subscribed', {'topics': topics}, to=sid)
+    if 'prices' in topics:
+        await sio.emit('prices', price_broadcaster.snapshot(), to=sid)
+
+@sio.on('unsubscribe')
+async def handle_unsubscribe(sid, data):
+    topics = [topic for topic in data.get('topics', []) if topic in TOPICS]
+    for topic in topics:
+        await sio.leave_room(sid, topic)
+    await sio.emit('unsubscribed', {'topics': topics}, to=sid)
+
+@sio.on('command')
+async def handle_command(sid, data):
+    """Обработка команд от клиента; ответ получает только отправитель"""
     action = data.get('action')
     
     if action == 'start_trading':
-        if not trading_active:
-            trading_active = True
-            socketio.emit('command_response', {'message': 'Trading started'})
-            loop = asyncio.get_event_loop()
-            asyncio.run_coroutine_threadsafe(start_trading(), loop)
+        job_id = data.get('job_id', 'default')
+        if trading_scheduler.loop is None:
+            await sio.emit('command_response', {'message': 'Trading scheduler is not running'}, to=sid)
+        elif not trading_scheduler.is_running(job_id):
+            await start_trading(data, sid)
         else:
-            socketio.emit('command_response', {'message': 'Trading already active'})
+            await sio.emit('command_response', {'message': f'Trading already active: {job_id}'}, to=sid)
     
     elif action == 'stop_trading':
-        if trading_active:
-            trading_active = False
-            socketio.emit('command_response', {'message': 'Trading stopped'})
-        else:
-            socketio.emit('command_response', {'message': 'Trading already stopped'})
+        try:
+            # Без job_id останавливаются все задания
+            stopped = await trading_scheduler.stop_job(data.get('job_id'))
+            if stopped:
+                await sio.emit('command_response', {'message': f'Trading stopped: {", ".join(stopped)}'}, to=sid)
+                await sio.emit('trading_status', {'jobs': trading_scheduler.status()}, room='trading')
+            else:
+                await sio.emit('command_response', {'message': 'Trading already stopped'}, to=sid)
+        except Exception as e:
+            logging.error(f"Stop trading error: {str(e)}")
+            await sio.emit('command_response', {'message': f'Stop trading error: {str(e)}'}, to=sid)
+
+    elif action == 'trading_status':
+        await sio.emit('trading_status', {'jobs': trading_scheduler.status()}, to=sid)
     
     elif action == 'check_portfolio':
         try:
             if not account_id:
                 raise Exception("Sandbox account not initialized")
-            portfolio = get_portfolio(account_id)
-            socketio.emit('portfolio', portfolio)
+            # Первое обращение загружает книгу из API
+            portfolio = await asyncio.to_thread(position_book.portfolio, account_id)
+            await sio.emit('portfolio', {
+                'totalAmount': portfolio['totalAmount'],
+                'unrealisedPnl': portfolio['unrealised_pnl'],
+                'positions': [dict(pos, name=instrument_directory.display_name(pos['figi']))
+                              for pos in portfolio['positions']]
+            }, to=sid)
         except Exception as e:
             logging.error(f"Portfolio error: {str(e)}")
-            socketio.emit('command_response', {'message': f'Portfolio error: {str(e)}'})
+            await sio.emit('command_response', {'message': f'Portfolio error: {str(e)}'}, to=sid)
     
     elif action == 'refresh_prices':
-        try:
-            prices = get_current_prices()
-            socketio.emit('prices', {'prices': prices})
-        except Exception as e:
-            logging.error(f"Price update error: {str(e)}")
-            socketio.emit('log', {'message': f'Price update error: {str(e)}'})
+        # Полный снимок из памяти: кнопка и восстановление после пропуска seq
+        await sio.emit('prices', price_broadcaster.snapshot(), to=sid)
     
     elif action == 'show_chart':
         try:
-            interval = data.get('interval', '1h')
-            figi = "BBG004S68CV8"  # ВСМПО-АВИСМА
-            interval_map = {
-                '1m': 'MINUTE',
-                '5m': 'FIVE_MINUTE',
-                '15m': 'QUARTER_HOUR',
-                '1h': 'HOUR',
-                '1d': 'DAY'
-            }
-            candles = get_candles(figi, interval_map.get(interval, 'HOUR'))
-            if candles:
-                chart_image = generate_chart_image(candles, interval)
-                socketio.emit('chart', {'chartUrl': f'data:image/png;base64,{chart_image}'})
+            interval = CHART_INTERVALS.get(data.get('interval', '1h'), 'HOUR')
+            figi = await asyncio.to_thread(instrument_directory.resolve, data['instrument']) if data.get('instrument') else DEFAULT_CHART_FIGI
+            if not figi:
+                raise Exception(f"Instrument not found: {data['instrument']}")
+            # Свечи рисует браузер; дальше приходят только новые и изменённые (chart_update)
+            payload = await chart_feed.open(sid, figi, interval)
+            if payload:
+                name = await asyncio.to_thread(instrument_directory.display_name, figi)
+                await sio.emit('chart', {'figi': figi, 'interval': interval, 'name': name, 'data': payload}, to=sid)
             else:
-                socketio.emit('log', {'message': 'No candles data available'})
+                await sio.emit('log', {'message': 'No candles data available'}, to=sid)
         except Exception as e:
             logging.error(f"Chart error: {str(e)}")
-            socketio.emit('log', {'message': f'Chart error: {str(e)}'})
+            await sio.emit('log', {'message': f'Chart error: {str(e)}'}, to=sid)
     
     elif action == 'get_news':
         try:
             source = data.get('source', 'all')
-            news = news_reader.get_news(source)
-            serialized_news = json.dumps({'news': news}, default=default_serializer)
-            socketio.emit('news', serialized_news)
+            news = await news_store.get_news_async(source)
+            serialized_news = json.loads(json.dumps({'news': news}, default=default_serializer))
+            await sio.emit('news', serialized_news, to=sid)
         except Exception as e:
             logging.error(f"News error: {str(e)}")
-            socketio.emit('log', {'message': f'News error: {str(e)}'})
+            await sio.emit('log', {'message': f'News error: {str(e)}'}, to=sid)
+
+    elif action == 'cache_stats':
+        await sio.emit('log', {'message': f'Cache stats: {cache_stats()}, charts: {chart_feed.stats()}, '
+                                          f'prices: {price_broadcaster.stats()}'}, to=sid)
 
-async def start_trading():
-    """Запуск торгового цикла"""
-    global trading_active
+async def start_trading(data=None, sid=None):
+    """Запуск торгового задания: счёт, стратегия, инструменты и интервал из команды"""
+    data = data or {}
+    job_id = data.get('job_id', 'default')
     try:
-        if not account_id:
+        if not data.get('account_id') and not account_id:
             await init_sandbox()
-        
-        while trading_active:
-            await trade_loop(account_id)
-            await asyncio.sleep(60)
+        strategy = data.get('strategy', 'flip')
+        if strategy not in STRATEGIES:
+            raise Exception(f"Unknown strategy: {strategy}. Must be one of {list(STRATEGIES)}")
+        # Справочник при холодном кэше загружается из API - не в event loop
+        figis = [await asyncio.to_thread(instrument_directory.resolve, instrument) or instrument
+                 for instrument in data.get('instruments', [])]
+        strategies = make_strategies(strategy, figis, data.get('params'))
+        trading_scheduler.add_job(job_id, data.get('account_id') or account_id, strategies,
+                                  data.get('interval', strategies[0].interval))
+        await sio.emit('command_response', {'message': f'Trading started: {job_id}'}, to=sid)
+        await sio.emit('trading_status', {'jobs': trading_scheduler.status()}, room='trading')
     except Exception as e:
         logging.error(f"Trading error: {str(e)}")
-        trading_active = False
-        await send_message(f"Trading stopped due to error: {str(e)}")
+        await sio.emit('command_response', {'message': f'Trading error: {str(e)}'}, to=sid)
+        await send_message(f"Trading job {job_id} failed to start: {str(e)}")
 
 async def run_bot():
     """Запуск Telegram-бота"""
@@ -155,31 +227,152 @@ async def run_bot():
         logging.error(f"Bot polling error: {str(e)}")
         await send_message(f"Bot polling error: {str(e)}")
     finally:
+        await outbox.flush()
         await bot.session.close()
 
-def run_flask():
-    """Запуск Flask-сервера"""
-    try:
-        socketio.run(app, host='0.0.0.0', port=3000)
-    except Exception as e:
-        logging.error(f"Flask server error: {str(e)}")
+class PriceBroadcaster:
+    """Рассылка цен веб-клиентам.
+
+    Хранит снимок последних цен с порядковым номером seq. Обновления из
+    price_board копятся и не чаще раза в interval уходят комнате prices
+    одним пакетом prices_diff только по изменившимся figi. Полный снимок
+    клиент получает при подключении и по запросу, если заметил пропуск seq.
+    Вызовы API от числа клиентов не зависят: цены приходят из стрима.
+    """
+
+    def __init__(self, board=price_board, interval=PRICE_BROADCAST_INTERVAL, room='prices'):
+        self.board = board
+        self.interval = interval
+        self.room = room
+        self.server = None
+        self.seq = 0
+        self.broadcasts = 0
+        self.prices = {}
+        self._names = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = None
+        self._loop = None
+        self._task = None
+        self._unsubscribe = None
+
+    def on_price(self, figi, price, time):
+        """Подписчик price_board (вызывается из любого потока)"""
+        with self._lock:
+            self._pending[figi] = {'price': price, 'time': time}
+        if self._loop is not None and not self._wake.is_set():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _with_names(self, prices):
+        for figi in prices:
+            if figi not in self._names:
+                self._names[figi] = instrument_directory.display_name(figi)
+        return {figi: dict(info, name=self._names[figi]) for figi, info in prices.items()}
+
+    def snapshot(self):
+        return {'seq': self.seq, 'prices': self.prices}
+
+    async def _named(self, prices):
+        if all(figi in self._names for figi in prices):
+            return self._with_names(prices)
+        # Справочник может ещё загружаться
+        return await asyncio.to_thread(self._with_names, prices)
+
+    def start(self, server):
+        """Запустить рассылку в текущем event loop (server - socketio.AsyncServer)"""
+        self.server = server
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            # Цены, пришедшие до запуска, уйдут первым пакетом
+            for figi, info in self.board.snapshot().items():
+                self.on_price(figi, info['price'], info['time'])
+            self._unsubscribe = self.board.subscribe(self.on_price)
+            self._task = self._loop.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                changed, self._pending = self._pending, {}
+            if changed:
+                try:
+                    changed = await self._named(changed)
+                    self.prices = dict(self.prices, **changed)
+                    self.seq += 1
+                    self.broadcasts += 1
+                    await self.server.emit('prices_diff', {'seq': self.seq, 'prices': changed}, room=self.room)
+                except Exception as e:
+                    logging.error(f"Price broadcast error: {str(e)}")
+            # Обновления за это время попадут в следующий пакет
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {'seq': self.seq, 'figis': len(self.prices), 'broadcasts': self.broadcasts}
+
+
+price_broadcaster = PriceBroadcaster()
+
+async def start_web(host=WEB_HOST, port=WEB_PORT):
+    """Запустить веб-сервер в текущем event loop; возвращает AppRunner для остановки"""
+    global web_loop
+    web_loop = asyncio.get_running_loop()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    chart_feed.start(sio)
+    price_broadcaster.start(sio)
+    logging.info(f"Web server listening on {host}:{port}")
+    return runner
 
 async def main():
     """Основная функция"""
+    web_runner = None
     try:
+        chart_renderer.start()
+        instrument_directory.start()
         init_db()
         await init_sandbox()
+
+        trading_scheduler.start()
+        position_book.start()
+        market_stream.start()
+        news_store.start()
         
+        web_runner = await start_web()
         bot_task = asyncio.create_task(run_bot())
-        flask_task = asyncio.create_task(asyncio.to_thread(run_flask))
         
         await send_message("Trading bot started!")
         
-        await asyncio.gather(bot_task, flask_task)
+        await bot_task
     except Exception as e:
         logging.error(f"Main loop error: {str(e)}")
         await send_message(f"Bot stopped due to error: {str(e)}")
     finally:
+        await chart_feed.stop()
+        await price_broadcaster.stop()
+        if web_runner is not None:
+            await web_runner.cleanup()
+        await trading_scheduler.stop_job()
+        await position_book.stop()
+        await market_stream.stop()
+        await news_store.stop()
+        # Последние уведомления (в том числе об остановке) ещё в очереди
+        await outbox.flush()
         await bot.session.close()
 
 if __name__ == '__main__':
@@ -190,4 +383,9 @@ if __name__ == '__main__':
     except Exception as e:
         logging.error(f"Startup error: {str(e)}")
     finally:
-        asyncio.run(bot.session.close())
\ No newline at end of file
+        asyncio.run(bot.session.close())
+        trading_scheduler.shutdown()
+        handler_dispatch.shutdown()
+        close_db()
+        tinkoff_client.close()
+        chart_renderer.shutdown()
\ No newline at end of file
@@ -0,0 +1,226 @@
+import os
+import json
+import random
+import asyncio
+import logging
+import threading
+import aiohttp
+import numpy as np
+from api import get_current_prices, quotation_to_float
+from tinkoff_client import TINKOFF_TOKEN, BASE_URL, SERVICE_PREFIX
+
+# WebSocket-эндпоинт MarketDataStream; TINKOFF_STREAM_URL позволяет указать локальную заглушку
+STREAM_URL = os.getenv(
+    'TINKOFF_STREAM_URL',
+    BASE_URL.replace('https://', 'wss://').replace('/rest', '/ws') + f"/{SERVICE_PREFIX}MarketDataStreamService/MarketDataStream"
+)
+STREAM_FIGIS = [figi for figi in os.getenv('STREAM_FIGIS', 'BBG004S68CV8,BBG0013HGFT4').split(',') if figi]
+POLL_INTERVAL = float(os.getenv('PRICE_POLL_INTERVAL', 10))
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+def price_time(value):
+    """Время цены из API ('2024-01-09T07:00:00.123456789Z') в datetime64[ns] для сравнения"""
+    return np.datetime64(value[:-1] if value.endswith('Z') else value, 'ns')
+
+
+def newer(info, other):
+    """info свежее other (оба в формате api.get_current_prices)"""
+    return other is None or price_time(info['time']) > price_time(other['time'])
+
+
+class PriceBoard:
+    """Последние цены по figi с рассылкой обновлений подписчикам"""
+
+    def __init__(self):
+        self._prices = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def update(self, figi, price, time, source='stream'):
+        with self._lock:
+            current = self._prices.get(figi)
+            at = price_time(time)
+            # Опрос может вернуть цену старше уже пришедшей из стрима; строки ISO с дробными
+            # секундами и без них нельзя сравнивать как текст
+            if current is not None and current['at'] > at:
+                return
+            self._prices[figi] = {'price': price, 'time': time, 'at': at, 'source': source}
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(figi, price, time)
+            except Exception as e:
+                logging.error(f"Error in price subscriber {callback}: {str(e)}")
+
+    def get(self, figi):
+        with self._lock:
+            return self._prices.get(figi)
+
+    def snapshot(self):
+        """Все цены в формате api.get_current_prices"""
+        with self._lock:
+            return {figi: {'price': info['price'], 'time': info['time']} for figi, info in self._prices.items()}
+
+    def subscribe(self, callback):
+        """Подписать callback(figi, price, time); возвращает функцию отписки"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+
+class MarketDataStream:
+    """Подписка на последние цены через MarketDataStream.
+
+    При обрыве соединения переподключается с экспоненциальной задержкой и
+    заново подписывается на все figi; пока стрим недоступен, цены опрашиваются
+    через GetLastPrices.
+    """
+
+    def __init__(self, board, url=STREAM_URL, token=TINKOFF_TOKEN, figis=STREAM_FIGIS, poll_interval=POLL_INTERVAL):
+        self.board = board
+        self.url = url
+        self.token = token
+        self.poll_interval = poll_interval
+        self.figis = set(figis)
+        self.connected = False
+        self._ws = None
+        self._loop = None
+        self._task = None
+        self._poll_task = None
+
+    def start(self):
+        """Запустить стрим в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        for task in (self._task, self._poll_task):
+            if task is not None:
+                task.cancel()
+        for task in (self._task, self._poll_task):
+            if task is not None:
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = self._poll_task = None
+        self.connected = False
+
+    def subscribe(self, figis):
+        """Добавить figi в подписку (можно вызывать из любого потока)"""
+        new_figis = set(figis) - self.figis
+        self.figis |= new_figis
+        if new_figis:
+            self._send_threadsafe('SUBSCRIPTION_ACTION_SUBSCRIBE', new_figis)
+
+    def unsubscribe(self, figis):
+        removed = set(figis) & self.figis
+        self.figis -= removed
+        if removed:
+            self._send_threadsafe('SUBSCRIPTION_ACTION_UNSUBSCRIBE', removed)
+
+    def current_prices(self, figis=None):
+        """Цены figis (по умолчанию - подписки стрима) с доски, пока стрим подключён.
+
+        Если стрим недоступен или каких-то figi на доске нет, цены запрашиваются
+        через GetLastPrices (через кэш), а поверх кладутся более свежие с доски.
+        """
+        board = self.board.snapshot()
+        wanted = set(figis) if figis else self.figis
+        if self.connected and wanted and wanted <= board.keys():
+            return {figi: board[figi] for figi in sorted(wanted)}
+        prices = dict(get_current_prices(figis))
+        for figi, info in board.items():
+            if (not figis or figi in wanted) and newer(info, prices.get(figi)):
+                prices[figi] = info
+        return prices
+
+    def _send_threadsafe(self, action, figis):
+        if self._loop is None or not self.connected:
+            return
+        self._loop.call_soon_threadsafe(
+            lambda: self._loop.create_task(self._send_subscription(action, figis)))
+
+    async def _send_subscription(self, action, figis):
+        if self._ws is None or self._ws.closed or not figis:
+            return
+        await self._ws.send_json({
+            "subscribeLastPriceRequest": {
+                "subscriptionAction": action,
+                "instruments": [{"instrumentId": figi} for figi in sorted(figis)]
+            }
+        })
+
+    async def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        async with aiohttp.ClientSession(headers={"Authorization": f"Bearer {self.token}"}) as session:
+            while True:
+                self._start_polling()
+                try:
+                    async with session.ws_connect(self.url, protocols=('json',), heartbeat=30) as ws:
+                        self._ws = ws
+                        self.connected = True
+                        self._stop_polling()
+                        delay = RECONNECT_MIN_DELAY
+                        logging.info(f"Market data stream connected, subscribing to {len(self.figis)} figis")
+                        await self._send_subscription('SUBSCRIPTION_ACTION_SUBSCRIBE', set(self.figis))
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                self._handle(json.loads(message.data))
+                            elif message.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                                break
+                    logging.warning("Market data stream closed")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Market data stream error: {str(e)}")
+                finally:
+                    self._ws = None
+                    self.connected = False
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _handle(self, message):
+        last_price = message.get('lastPrice')
+        if last_price:
+            self.board.update(last_price['figi'], quotation_to_float(last_price['price']), last_price['time'])
+        elif 'subscribeLastPriceResponse' in message:
+            for subscription in message['subscribeLastPriceResponse'].get('lastPriceSubscriptions', []):
+                status = subscription.get('subscriptionStatus')
+                if status != 'SUBSCRIPTION_STATUS_SUCCESS':
+                    logging.warning(f"Last price subscription for {subscription.get('figi')}: {status}")
+
+    def _start_polling(self):
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.get_running_loop().create_task(self._poll())
+
+    def _stop_polling(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    async def _poll(self):
+        """Резервный режим: периодический GetLastPrices, пока стрим недоступен"""
+        while True:
+            try:
+                figis = sorted(self.figis)
+                prices = await asyncio.to_thread(get_current_prices, figis)
+                for figi, info in prices.items():
+                    self.board.update(figi, info['price'], info['time'], source='poll')
+            except Exception as e:
+                logging.error(f"Price polling error: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+
+# Общая доска цен и стрим для бота, веб-интерфейса и торговли
+price_board = PriceBoard()
+market_stream = MarketDataStream(price_board)
@@ -1,15 +1,130 @@
 import os
-import requests
+import time
+import hashlib
+import asyncio
+import threading
+import aiohttp
 import feedparser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import json
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
+# Предельное время ожидания одного источника; медленные источники пропускаются
+NEWS_SOURCE_TIMEOUT = float(os.getenv('NEWS_SOURCE_TIMEOUT', 5))
+# Время жизни новостей в памяти и период фонового опроса лент
+NEWS_CACHE_TTL = float(os.getenv('NEWS_CACHE_TTL', 300))
+NEWS_POLL_INTERVAL = float(os.getenv('NEWS_POLL_INTERVAL', 120))
+NEWS_MAX_ITEMS = 500
+
+def run_sync(coro):
+    """Выполнить корутину из синхронного кода, в том числе из потока с работающим loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def news_id(item):
+    """Стабильный короткий идентификатор новости для callback_data"""
+    return hashlib.sha1(item['url'].encode('utf-8')).hexdigest()[:16]
+
+class _ExtractionDone(Exception):
+    pass
+
+class RBCItemExtractor(HTMLParser):
+    """Потоковый разбор HTML элемента ленты RBC без построения дерева.
+
+    Возвращает то же, что поиск BeautifulSoup: текст первого span с классом
+    news-feed__item__title (get_text(strip=True)), href первой ссылки и
+    признак наличия span с классом news-feed__item__date-text.
+    """
+
+    TITLE_CLASS = 'news-feed__item__title'
+    DATE_CLASS = 'news-feed__item__date-text'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+
+    def extract(self, html):
+        """(title или None, href, есть ли дата) для HTML одного элемента ленты; None без ссылки"""
+        self.reset()
+        self.title_parts = None
+        self.title_text = []
+        self.title_depth = 0
+        self.title_closed = False
+        self.url = None
+        self.link_found = False
+        self.date_found = False
+        try:
+            self.feed(html)
+            self.close()
+        except _ExtractionDone:
+            pass
+        self._flush_text()
+        if self.url is None:
+            return None
+        title = ''.join(self.title_parts) if self.title_parts is not None else None
+        return title, self.url, self.date_found
+
+    @staticmethod
+    def _has_class(attrs, css_class):
+        for name, value in attrs:
+            if name == 'class' and value is not None and (value == css_class or css_class in value.split()):
+                return True
+        return False
+
+    def _flush_text(self):
+        # Соседние куски текста - один текстовый узел, strip применяется к нему целиком
+        if self.title_text:
+            text = ''.join(self.title_text).strip()
+            if text:
+                self.title_parts.append(text)
+            self.title_text = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag == 'a' and not self.link_found:
+            self.link_found = True
+            for name, value in attrs:
+                if name == 'href':
+                    self.url = value if value is not None else ''
+                    break
+        if tag != 'span':
+            return
+        if self.title_depth:
+            self.title_depth += 1
+        elif self.title_parts is None and self._has_class(attrs, self.TITLE_CLASS):
+            self.title_parts = []
+            self.title_depth = 1
+        if not self.date_found and self._has_class(attrs, self.DATE_CLASS):
+            self.date_found = True
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if tag != 'span':
+            return
+        if self.title_depth:
+            self.title_depth -= 1
+            self.title_closed = self.title_depth == 0
+        # Всё нужное найдено - остаток фрагмента не разбираем
+        if self.title_closed and self.link_found and self.date_found:
+            raise _ExtractionDone()
+
+    def handle_data(self, data):
+        if self.title_depth:
+            self.title_text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
 class NewsReader:
     def __init__(self):
         self.sources = {
@@ -29,53 +144,91 @@ class NewsReader:
 
     def get_news(self, source='all', limit=5):
         """Получить новости с ограничением по количеству"""
-        news_items = []
-        
+        return run_sync(self.get_news_async(source, limit))
+
+    def source_names(self, source='all'):
         if source == 'all':
-            for name, config in self.sources.items():
-                news_items.extend(self._parse_source(name, config))
-        else:
-            config = self.sources.get(source)
-            if config:
-                news_items = self._parse_source(source, config)
-        
+            return list(self.sources)
+        return [source] if source in self.sources else []
+
+    async def get_news_async(self, source='all', limit=5, deadline=NEWS_SOURCE_TIMEOUT):
+        """Загрузить источники параллельно; не уложившиеся в deadline пропускаются"""
+        results = await self.fetch_sources(self.source_names(source), deadline)
+        news_items = [item for items, _ in results.values() for item in items or []]
+
         sorted_news = sorted(news_items, key=lambda x: x['date'], reverse=True)
         return sorted_news[:limit]
 
-    def _parse_source(self, source_name, config):
+    async def fetch_sources(self, names, deadline=NEWS_SOURCE_TIMEOUT, validators=None):
+        """Загрузить источники параллельно.
+
+        Возвращает {источник: (новости, валидаторы ответа)}; новости равны None,
+        если лента не изменилась (304). Упавшие и медленные источники пропускаются.
+        """
+        validators = validators or {}
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(*(
+                self._fetch_source(session, name, self.sources[name], deadline, validators.get(name))
+                for name in names
+            ))
+        return {name: result for name, result in zip(names, results) if result is not None}
+
+    async def _fetch_source(self, session, source_name, config, deadline, validators=None):
         try:
-            if config['parser'] == 'rbc':
-                return self._parse_rbc(source_name, config)
-            elif config['parser'] in ['nyt', 'bbc']:
-                return self._parse_rss(source_name, config)
-            return []
+            return await asyncio.wait_for(self._parse_source(session, source_name, config, validators), deadline)
+        except asyncio.TimeoutError:
+            logging.warning(f"{source_name} news skipped: no response in {deadline}s")
+            return None
         except Exception as e:
             logging.error(f"Error parsing {source_name} news: {str(e)}")
-            return []
+            return None
+
+    async def _parse_source(self, session, source_name, config, validators=None):
+        url = config['url']
+        if config['parser'] == 'rbc':
+            url = url.format(last_date=int(datetime.now().timestamp()))
+        # Условный GET: неизменившаяся лента не скачивается повторно
+        headers = {}
+        if validators and validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators and validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return None, validators
+            response.raise_for_status()
+            content = await response.read()
+            new_validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+
+        if config['parser'] == 'rbc':
+            items = await asyncio.to_thread(self._parse_rbc, source_name, json.loads(content))
+        elif config['parser'] in ['nyt', 'bbc']:
+            items = await asyncio.to_thread(self._parse_rss, source_name, content)
+        else:
+            items = []
+        return items, new_validators
 
-    def _parse_rbc(self, source_name, config):
+    def _parse_rbc(self, source_name, data):
         """Парсинг новостей RBC"""
-        last_date = int(datetime.now().timestamp())
-        url = config['url'].format(last_date=last_date)
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
+        extractor = RBCItemExtractor()
         news_items = []
         for item in data.get('items', []):
             try:
-                html = item.get('html', '')
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                title = soup.find('span', class_='news-feed__item__title')
-                url = soup.find('a')['href']
-                date_text = soup.find('span', class_='news-feed__item__date-text')
-                
-                if not all([title, url, date_text]):
+                parsed = extractor.extract(item.get('html', ''))
+                if parsed is None:
+                    logging.warning("Skipping RBC item without a link")
                     continue
-                
+                title, url, date_found = parsed
+
+                if title is None or not url or not date_found:
+                    continue
+
                 news_items.append({
-                    'title': title.get_text(strip=True),
+                    'title': title,
                     'url': url,
                     'source': source_name,
                     'date': datetime.fromtimestamp(item['publish_date_t'])
@@ -83,12 +236,13 @@ class NewsReader:
             except Exception as e:
                 logging.error(f"Error parsing RBC item: {str(e)}")
                 continue
-                
+
         return news_items
 
-    def _parse_rss(self, source_name, config):
+    def _parse_rss(self, source_name, content):
         """Парсинг RSS-лент"""
-        feed = feedparser.parse(config['url'])
+        # Ссылки внутри HTML-содержимого не используются - не разрешаем их
+        feed = feedparser.parse(content, resolve_relative_uris=False)
         return [{
             'title': entry.title[:200],
             'url': entry.link,
@@ -115,6 +269,102 @@ class NewsReader:
             
         return messages
 
+class NewsStore:
+    """Новости в памяти с фоновым опросом лент.
+
+    Чтения обслуживаются из памяти, пока данные источника моложе ttl.
+    У каждой новости есть стабильный id, по которому её можно найти и после
+    обновления ленты.
+    """
+
+    def __init__(self, reader=None, ttl=NEWS_CACHE_TTL, poll_interval=NEWS_POLL_INTERVAL, max_items=NEWS_MAX_ITEMS):
+        self.reader = reader or NewsReader()
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.max_items = max_items
+        self._items = {}
+        self._validators = {}
+        self._fetched_at = {}
+        self._by_id = OrderedDict()
+        self._lock = threading.Lock()
+        self._task = None
+
+    def _stale(self, names):
+        now = time.monotonic()
+        return [name for name in names if now - self._fetched_at.get(name, float('-inf')) > self.ttl]
+
+    async def refresh(self, names=None):
+        """Обновить источники с условным GET"""
+        names = names or list(self.reader.sources)
+        with self._lock:
+            validators = {name: self._validators.get(name) for name in names}
+        results = await self.reader.fetch_sources(names, validators=validators)
+        now = time.monotonic()
+        with self._lock:
+            for name, (items, source_validators) in results.items():
+                self._fetched_at[name] = now
+                self._validators[name] = source_validators
+                if items is None:
+                    continue
+                for item in items:
+                    item['id'] = news_id(item)
+                    self._by_id[item['id']] = item
+                    self._by_id.move_to_end(item['id'])
+                self._items[name] = items
+            while len(self._by_id) > self.max_items:
+                self._by_id.popitem(last=False)
+
+    def _read(self, names, limit):
+        with self._lock:
+            news_items = [item for name in names for item in self._items.get(name, [])]
+        sorted_news = sorted(news_items, key=lambda x: x['date'], reverse=True)
+        return sorted_news[:limit]
+
+    async def get_news_async(self, source='all', limit=5):
+        names = self.reader.source_names(source)
+        stale = self._stale(names)
+        if stale:
+            await self.refresh(stale)
+        return self._read(names, limit)
+
+    def get_news(self, source='all', limit=5):
+        names = self.reader.source_names(source)
+        stale = self._stale(names)
+        if stale:
+            run_sync(self.refresh(stale))
+        return self._read(names, limit)
+
+    def get_item(self, item_id):
+        """Новость по id из callback_data"""
+        with self._lock:
+            return self._by_id.get(item_id)
+
+    def start(self):
+        """Запустить фоновый опрос лент в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"News polling error: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+# Общее хранилище новостей для бота и веб-интерфейса
+news_store = NewsStore()
+
 def default_serializer(obj):
     if isinstance(obj, datetime):
         return obj.isoformat()
@@ -0,0 +1,267 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from api import order_payload, quotation_to_float, portfolio_cache
+from instruments import instrument_directory
+from tinkoff_client import client, TinkoffAPIError
+
+ORDER_POLL_INTERVAL = float(os.getenv('ORDER_POLL_INTERVAL', 1))
+ORDER_HISTORY = int(os.getenv('ORDER_HISTORY', 1000))
+# Сколько секунд выяснять судьбу поручения без ответа PostOrder, прежде чем считать его отклонённым
+ORDER_UNKNOWN_TIMEOUT = float(os.getenv('ORDER_UNKNOWN_TIMEOUT', 60))
+
+STATUS_PENDING = 'PENDING'
+# Ответ PostOrder не получен: поручение могло быть принято, состояние узнаём по orderId запроса
+STATUS_UNKNOWN = 'UNKNOWN'
+STATUS_NEW = 'EXECUTION_REPORT_STATUS_NEW'
+STATUS_PARTIALLY_FILLED = 'EXECUTION_REPORT_STATUS_PARTIALLYFILL'
+STATUS_FILLED = 'EXECUTION_REPORT_STATUS_FILL'
+STATUS_REJECTED = 'EXECUTION_REPORT_STATUS_REJECTED'
+STATUS_CANCELLED = 'EXECUTION_REPORT_STATUS_CANCELLED'
+FINAL_STATUSES = (STATUS_FILLED, STATUS_REJECTED, STATUS_CANCELLED)
+
+
+def money_to_float(value):
+    return quotation_to_float(value) if value else None
+
+
+class Order:
+    """Торговое поручение и его состояние.
+
+    order_id - ключ идемпотентности (uuid4), он же orderId запроса PostOrder;
+    broker_order_id - номер поручения у брокера. future завершается самим
+    Order, когда поручение исполнено, отклонено или отменено; Order можно
+    ждать через await. lot - штук в лоте (None, если неизвестно).
+    """
+
+    def __init__(self, account_id, figi, operation, lots, order_id=None, lot=None):
+        self.order_id = order_id or str(uuid.uuid4())
+        self.account_id = account_id
+        self.figi = figi
+        self.operation = operation
+        self.lots = lots
+        self.lot = lot
+        self.broker_order_id = None
+        self.status = STATUS_PENDING
+        self.lots_executed = 0
+        self.executed_price = None
+        self.average_price = None
+        self.commission = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.future = Future()
+
+    @property
+    def done(self):
+        return self.status in FINAL_STATUSES
+
+    @property
+    def filled(self):
+        return self.status == STATUS_FILLED
+
+    def result(self, timeout=None):
+        """Дождаться завершения, блокируя поток"""
+        return self.future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+    def to_dict(self):
+        return {
+            'order_id': self.order_id,
+            'broker_order_id': self.broker_order_id,
+            'account_id': self.account_id,
+            'figi': self.figi,
+            'operation': self.operation,
+            'lots': self.lots,
+            'lots_executed': self.lots_executed,
+            'status': self.status,
+            'executed_price': self.executed_price,
+            'average_price': self.average_price,
+            'commission': self.commission,
+            'error': self.error
+        }
+
+
+class OrderManager:
+    """Отправка поручений и отслеживание их исполнения.
+
+    Поручения отправляются параллельно в event loop клиента API; активные
+    поручения опрашиваются через GetOrderState. Поручение в STATUS_UNKNOWN,
+    которого брокер не знает или которое не прояснилось за unknown_timeout,
+    считается отклонённым. Подписчики получают Order при каждом изменении
+    состояния.
+    """
+
+    def __init__(self, api_client=client, poll_interval=ORDER_POLL_INTERVAL, history=ORDER_HISTORY,
+                 unknown_timeout=ORDER_UNKNOWN_TIMEOUT):
+        self.client = api_client
+        self.poll_interval = poll_interval
+        self.history = history
+        self.unknown_timeout = unknown_timeout
+        self.submitted = 0
+        self.failed = 0
+        self._orders = OrderedDict()
+        self._subscribers = []
+        self._poller = None
+
+    def submit(self, account_id, figi, operation, lots, order_id=None):
+        """Отправить поручение, не дожидаясь ответа (из любого потока, кроме loop клиента)"""
+        # Размер лота нужен подписчикам в loop клиента, где справочник загружать нельзя
+        order = Order(account_id, figi, operation, lots, order_id, instrument_directory.lot_size(figi, None))
+        self.client.run_coroutine(self._submit(order))
+        return order
+
+    def submit_many(self, requests):
+        """Отправить независимые поручения [(account_id, figi, operation, lots)] одновременно"""
+        return [self.submit(*request) for request in requests]
+
+    def cancel(self, order):
+        """Отменить поручение; concurrent.futures.Future с ответом CancelOrder"""
+        return self.client.run_coroutine(self._cancel(order))
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def active(self):
+        return [order for order in list(self._orders.values()) if not order.done]
+
+    def subscribe(self, callback):
+        """Подписать callback(order) на изменения состояния; возвращает функцию отписки"""
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+        return unsubscribe
+
+    def stats(self):
+        return {'submitted': self.submitted, 'failed': self.failed, 'active': len(self.active()),
+                'tracked': len(self._orders)}
+
+    async def _submit(self, order):
+        self._remember(order)
+        self.submitted += 1
+        payload = order_payload(order.account_id, order.figi, order.operation, order.lots, order.order_id)
+        try:
+            # Повторы 429/5xx внутри клиента идут с тем же orderId и не создают дублей
+            state = await self.client.call("OrdersService/PostOrder", payload)
+        except TinkoffAPIError as e:
+            if e.status < 500 and e.status != 429:
+                self.failed += 1
+                order.error = e.text
+                logging.error(f"Order {order.order_id} rejected: {str(e)}, Response: {e.text}")
+                self._update(order, {'executionReportStatus': STATUS_REJECTED})
+                return order
+            order.error = e.text
+            self._update(order, {'executionReportStatus': STATUS_UNKNOWN})
+        except Exception as e:
+            order.error = str(e)
+            logging.warning(f"Order {order.order_id} state unknown after error: {str(e)}")
+            self._update(order, {'executionReportStatus': STATUS_UNKNOWN})
+        else:
+            self._update(order, state)
+        if order.status == STATUS_FILLED or order.status == STATUS_UNKNOWN:
+            portfolio_cache.invalidate(order.account_id)
+        self._ensure_poller()
+        return order
+
+    async def _cancel(self, order):
+        result = await self.client.call("OrdersService/CancelOrder", {
+            "accountId": order.account_id,
+            "orderId": order.broker_order_id or order.order_id
+        })
+        portfolio_cache.invalidate(order.account_id)
+        await self._refresh(order)
+        return result
+
+    def _remember(self, order):
+        self._orders[order.order_id] = order
+        excess = len(self._orders) - self.history
+        if excess > 0:
+            # Активные поручения остаются, вытесняются самые старые завершённые
+            finished = [order_id for order_id, item in self._orders.items() if item.done][:excess]
+            for order_id in finished:
+                del self._orders[order_id]
+
+    def _update(self, order, state):
+        """Применить ответ PostOrder/GetOrderState"""
+        previous = (order.status, order.lots_executed)
+        order.broker_order_id = state.get('orderId') or order.broker_order_id
+        order.status = state.get('executionReportStatus') or order.status
+        if 'lotsExecuted' in state:
+            order.lots_executed = int(state['lotsExecuted'])
+        order.executed_price = money_to_float(state.get('executedOrderPrice')) or order.executed_price
+        order.average_price = money_to_float(state.get('averagePositionPrice')) or order.average_price
+        order.commission = money_to_float(state.get('executedCommission')) or order.commission
+        order.updated_at = time.time()
+        if (order.status, order.lots_executed) == previous:
+            return
+        if order.lots_executed != previous[1]:
+            portfolio_cache.invalidate(order.account_id)
+        for callback in list(self._subscribers):
+            try:
+                callback(order)
+            except Exception as e:
+                logging.error(f"Error in order subscriber {callback}: {str(e)}")
+        if order.done and not order.future.done():
+            logging.info(f"Order {order.order_id} {order.figi} {order.operation} x{order.lots}: {order.status}")
+            order.future.set_result(order)
+
+    async def _refresh(self, order):
+        if order.broker_order_id:
+            payload = {"accountId": order.account_id, "orderId": order.broker_order_id}
+        else:
+            payload = {"accountId": order.account_id, "orderId": order.order_id, "orderIdType": "ORDER_ID_TYPE_REQUEST"}
+        try:
+            self._update(order, await self.client.call("OrdersService/GetOrderState", payload))
+        except TinkoffAPIError as e:
+            if order.status == STATUS_UNKNOWN and e.status < 500 and e.status != 429:
+                # Брокер не знает поручение с таким orderId: PostOrder до него не дошёл
+                self._reject_unknown(order, e.text)
+                return
+            logging.warning(f"GetOrderState failed for {order.order_id}: {str(e)}, Response: {e.text}")
+        except Exception as e:
+            logging.warning(f"GetOrderState failed for {order.order_id}: {str(e)}")
+        if order.status == STATUS_UNKNOWN and time.time() - order.created_at > self.unknown_timeout:
+            self._reject_unknown(order, f"Order state unknown after {self.unknown_timeout:.0f}s")
+
+    def _reject_unknown(self, order, error):
+        self.failed += 1
+        order.error = error
+        logging.error(f"Order {order.order_id} with unknown state considered rejected: {error}")
+        self._update(order, {'executionReportStatus': STATUS_REJECTED})
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+
+    async def _poll(self):
+        """Опрос активных поручений, пока они есть"""
+        while True:
+            active = [order for order in self.active() if order.status != STATUS_PENDING]
+            if not active:
+                return
+            await asyncio.sleep(self.poll_interval)
+            await asyncio.gather(*(self._refresh(order) for order in active if not order.done))
+
+
+def wait_orders(orders, timeout=None):
+    """Дождаться завершения поручений (блокирующе); незавершённые остаются как есть"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for order in orders:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            order.result(remaining)
+        except Exception:
+            pass
+    return orders
+
+
+# Общий менеджер поручений для торговли, бота и веб-интерфейса
+order_manager = OrderManager()
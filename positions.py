@@ -0,0 +1,246 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from api import fetch_portfolio_state
+from instruments import instrument_directory
+from market_stream import market_stream, price_board
+from orders import order_manager
+
+POSITION_RECONCILE_INTERVAL = float(os.getenv('POSITION_RECONCILE_INTERVAL', 300))
+# Расхождения меньше этого не считаются дрейфом (округление nano)
+DRIFT_TOLERANCE = 1e-6
+CASH_DRIFT_TOLERANCE = 0.01
+
+
+class Position:
+    """Позиция по инструменту: количество в штуках (отрицательное - шорт) и средняя цена"""
+
+    __slots__ = ('figi', 'quantity', 'average_price', 'lot', 'last_price')
+
+    def __init__(self, figi, quantity=0.0, average_price=0.0, lot=1, last_price=None):
+        self.figi = figi
+        self.quantity = quantity
+        self.average_price = average_price
+        self.lot = lot
+        self.last_price = last_price
+
+    def fill(self, quantity, price):
+        """Учесть сделку (quantity > 0 - покупка); возвращает реализованный PnL"""
+        realised = 0.0
+        if self.quantity == 0 or (self.quantity > 0) == (quantity > 0):
+            total = abs(self.quantity) + abs(quantity)
+            self.average_price = (abs(self.quantity) * self.average_price + abs(quantity) * price) / total
+            self.quantity += quantity
+            return realised
+        closed = min(abs(quantity), abs(self.quantity))
+        realised = closed * (price - self.average_price) * (1 if self.quantity > 0 else -1)
+        previous = self.quantity
+        self.quantity += quantity
+        if abs(self.quantity) < DRIFT_TOLERANCE:
+            self.quantity = 0.0
+            self.average_price = 0.0
+        elif (previous > 0) != (self.quantity > 0):
+            # Позиция перевернулась: остаток открыт по цене сделки
+            self.average_price = price
+        return realised
+
+
+class AccountBook:
+    def __init__(self, cash, positions):
+        self.cash = cash
+        self.positions = {position.figi: position for position in positions}
+        self.realised_pnl = 0.0
+        self.commission = 0.0
+        self.seeded_at = time.time()
+        self.version = 0
+        # order_id -> (lots_executed, сумма сделок, комиссия), уже учтённые в книге
+        self.fills = {}
+
+
+class PositionBook:
+    """Позиции и деньги счетов в памяти.
+
+    Книга счёта один раз загружается из GetPortfolio, затем обновляется по
+    исполнениям из OrderManager; чтение не обращается к API. Периодическая
+    сверка с GetPortfolio сообщает о расхождениях и принимает состояние брокера.
+    """
+
+    def __init__(self, fetcher=fetch_portfolio_state, prices=price_board, orders=order_manager,
+                 reconcile_interval=POSITION_RECONCILE_INTERVAL):
+        self.fetcher = fetcher
+        self.prices = prices
+        self.orders = orders
+        self.reconcile_interval = reconcile_interval
+        self.reconciles = 0
+        self.drifts = 0
+        self.last_drift = []
+        self._books = {}
+        self._lock = threading.Lock()
+        self._task = None
+        orders.subscribe(self.on_order)
+
+    def _load(self, account_id):
+        state = self.fetcher(account_id)
+        positions = [Position(item['figi'], item['quantity'], item['average_price'],
+                              item['lot'] or instrument_directory.lot_size(item['figi']), item['current_price'])
+                     for item in state['positions']]
+        return AccountBook(state['cash'], positions)
+
+    def seed(self, account_id):
+        """Загрузить книгу счёта из GetPortfolio"""
+        book = self._load(account_id)
+        with self._lock:
+            self._books[account_id] = book
+        market_stream.subscribe(book.positions)
+        logging.info(f"Position book seeded for {account_id}: {len(book.positions)} positions, cash {book.cash}")
+        return book
+
+    def _book(self, account_id):
+        book = self._books.get(account_id)
+        if book is None:
+            book = self.seed(account_id)
+        return book
+
+    def price(self, position):
+        quote = self.prices.get(position.figi)
+        if quote is not None:
+            return quote['price']
+        return position.last_price if position.last_price is not None else position.average_price
+
+    def position(self, account_id, figi):
+        """Позиция по figi со средней ценой и нереализованным PnL (None, если её нет)"""
+        position = self._book(account_id).positions.get(figi)
+        if position is None or position.quantity == 0:
+            return None
+        price = self.price(position)
+        return {
+            'figi': figi,
+            'quantity': position.quantity,
+            # Округление к нулю: у шорта не должно появляться лишнего лота
+            'lots': int(position.quantity / position.lot),
+            'average_price': round(position.average_price, 6),
+            'current_price': price,
+            'unrealised_pnl': round((price - position.average_price) * position.quantity, 2)
+        }
+
+    def portfolio(self, account_id):
+        """Портфель в формате api.get_portfolio, дополненный деньгами, средними ценами и PnL"""
+        book = self._book(account_id)
+        with self._lock:
+            figis = [figi for figi, position in book.positions.items() if position.quantity != 0]
+            cash, realised = book.cash, book.realised_pnl
+        positions = [position for position in (self.position(account_id, figi) for figi in figis) if position]
+        value = sum(position['quantity'] * position['current_price'] for position in positions)
+        return {
+            'totalAmount': round(cash + value, 2),
+            'cash': round(cash, 2),
+            'positions': positions,
+            'realised_pnl': round(realised, 2),
+            'unrealised_pnl': round(sum(position['unrealised_pnl'] for position in positions), 2)
+        }
+
+    def on_order(self, order):
+        """Подписчик OrderManager: учесть новую часть исполнения поручения"""
+        with self._lock:
+            # Под блокировкой: reconcile() может заменить книгу счёта
+            book = self._books.get(order.account_id)
+            if book is None:
+                return
+            lots, notional, commission = book.fills.get(order.order_id, (0, 0.0, 0.0))
+            position = book.positions.get(order.figi)
+            if position is None:
+                # Колбэк идёт в loop клиента API: справочник здесь не загружаем, лот - из поручения
+                if order.lot is None:
+                    logging.warning(f"Lot size of {order.figi} is unknown, assuming 1 until reconcile")
+                position = book.positions[order.figi] = Position(order.figi, lot=order.lot or 1)
+            new_lots = order.lots_executed - lots
+            new_commission = (order.commission or 0.0) - commission
+            if new_lots > 0:
+                price = order.executed_price
+                if price is None:
+                    quote = self.prices.get(order.figi)
+                    price = quote['price'] if quote else position.average_price
+                total = order.lots_executed * position.lot * price
+                quantity = new_lots * position.lot
+                # executedOrderPrice - средняя цена всех исполненных частей
+                fill_price = (total - notional) / quantity
+                sign = 1 if 'BUY' in order.operation.upper() else -1
+                book.realised_pnl += position.fill(sign * quantity, fill_price)
+                book.cash -= sign * quantity * fill_price
+                notional = total
+            if new_commission > 0:
+                book.cash -= new_commission
+                book.commission += new_commission
+            book.version += 1
+            if order.done:
+                book.fills.pop(order.order_id, None)
+            else:
+                book.fills[order.order_id] = (order.lots_executed, notional, order.commission or 0.0)
+        if new_lots > 0:
+            market_stream.subscribe([order.figi])
+
+    def reconcile(self, account_id):
+        """Сверить книгу с GetPortfolio; возвращает список расхождений и принимает данные брокера"""
+        book = self._books.get(account_id)
+        if book is None:
+            self.seed(account_id)
+            return []
+        version = book.version
+        fresh = self._load(account_id)
+        drift = []
+        with self._lock:
+            if book.version != version or book.fills:
+                # Во время сверки пришли исполнения - сверим в следующий раз
+                return []
+            for figi in set(book.positions) | set(fresh.positions):
+                ours = book.positions[figi].quantity if figi in book.positions else 0.0
+                theirs = fresh.positions[figi].quantity if figi in fresh.positions else 0.0
+                if abs(ours - theirs) > DRIFT_TOLERANCE:
+                    drift.append({'figi': figi, 'book': ours, 'broker': theirs})
+            if abs(book.cash - fresh.cash) > CASH_DRIFT_TOLERANCE:
+                drift.append({'figi': 'cash', 'book': round(book.cash, 2), 'broker': round(fresh.cash, 2)})
+            fresh.realised_pnl = book.realised_pnl
+            fresh.commission = book.commission
+            self._books[account_id] = fresh
+        self.reconciles += 1
+        if drift:
+            self.drifts += 1
+            self.last_drift = drift
+            logging.warning(f"Position book drift for {account_id}: {drift}")
+        return drift
+
+    def start(self):
+        """Запустить периодическую сверку в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._reconcile_loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            for account_id in list(self._books):
+                if any(order.account_id == account_id for order in self.orders.active()):
+                    continue
+                try:
+                    await asyncio.to_thread(self.reconcile, account_id)
+                except Exception as e:
+                    logging.error(f"Position reconcile error for {account_id}: {str(e)}")
+
+    def stats(self):
+        return {'accounts': len(self._books), 'reconciles': self.reconciles, 'drifts': self.drifts,
+                'last_drift': self.last_drift}
+
+
+# Общая книга позиций для торговли, бота и веб-интерфейса
+position_book = PositionBook()
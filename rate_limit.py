@@ -0,0 +1,185 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import logging
+
+# Лимиты unary-запросов Tinkoff Invest API в минуту по сервисам
+SERVICE_LIMITS = {
+    'UsersService': 100,
+    'MarketDataService': 600,
+    'OrdersService': 100,
+    'StopOrdersService': 50,
+    'OperationsService': 200,
+    'InstrumentsService': 200,
+    'SandboxService': 200
+}
+DEFAULT_SERVICE_LIMIT = 100
+GLOBAL_LIMIT = int(os.getenv('TINKOFF_GLOBAL_RATE_LIMIT', 1000))
+# Доля общего бюджета, которую не может израсходовать низкоприоритетный трафик
+LOW_PRIORITY_RESERVE = float(os.getenv('TINKOFF_LOW_PRIORITY_RESERVE', 0.2))
+
+PRIORITY_ORDERS = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_MARKET_DATA = 2
+METHOD_PRIORITIES = {
+    'OrdersService/PostOrder': PRIORITY_ORDERS,
+    'OrdersService/CancelOrder': PRIORITY_ORDERS,
+    'MarketDataService/GetCandles': PRIORITY_MARKET_DATA,
+    'MarketDataService/GetLastPrices': PRIORITY_MARKET_DATA
+}
+
+MAX_RETRIES = int(os.getenv('TINKOFF_MAX_RETRIES', 3))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+
+def service_group(method):
+    """'OrdersService/PostOrder' -> 'OrdersService'"""
+    return method.split('/', 1)[0]
+
+
+def method_priority(method):
+    return METHOD_PRIORITIES.get(method, PRIORITY_DEFAULT)
+
+
+def retry_delay(attempt, reset=None):
+    """Задержка перед повтором: full jitter, но не раньше сброса лимита"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if reset is not None:
+        delay = max(delay, reset + random.uniform(0, RETRY_BASE_DELAY))
+    return delay
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now=None, reserve=0):
+        """Сколько ждать до появления токена (0 - можно брать сейчас)"""
+        now = now or time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        needed = 1 + reserve
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def sync(self, remaining, reset):
+        """Поправить бюджет по заголовкам x-ratelimit-remaining/x-ratelimit-reset"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+        if remaining <= 0 and reset is not None:
+            self.blocked_until = max(self.blocked_until, now + reset)
+
+
+class RateLimiter:
+    """Общий ограничитель запросов к API: bucket на сервис и общий bucket.
+
+    Ожидающие запросы выдаются по приоритету: поручения раньше прочих,
+    рыночные данные и графики - последними, и им недоступен резерв общего бюджета.
+    Работает внутри event loop клиента.
+    """
+
+    def __init__(self, service_limits=SERVICE_LIMITS, global_limit=GLOBAL_LIMIT, reserve=LOW_PRIORITY_RESERVE):
+        self.service_limits = service_limits
+        self.buckets = {}
+        self.global_bucket = TokenBucket(global_limit / 60, global_limit)
+        self.reserve = reserve * global_limit
+        self.throttled = 0
+        self.retries = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    def bucket(self, group):
+        if group not in self.buckets:
+            limit = self.service_limits.get(group, DEFAULT_SERVICE_LIMIT)
+            self.buckets[group] = TokenBucket(limit / 60, limit)
+        return self.buckets[group]
+
+    def _try_take(self, group, priority, now):
+        bucket = self.bucket(group)
+        reserve = self.reserve if priority >= PRIORITY_MARKET_DATA else 0
+        wait = max(bucket.wait_time(now), self.global_bucket.wait_time(now, reserve))
+        if wait == 0:
+            bucket.take()
+            self.global_bucket.take()
+        return wait
+
+    async def acquire(self, method):
+        """Дождаться разрешения на вызов метода"""
+        group = service_group(method)
+        priority = method_priority(method)
+        if not self._waiters and self._try_take(group, priority, time.monotonic()) == 0:
+            return
+        self.throttled += 1
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), group, future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            next_wake = None
+            pending = []
+            while self._waiters:
+                item = heapq.heappop(self._waiters)
+                priority, _, group, future = item
+                if future.done():
+                    continue
+                wait = self._try_take(group, priority, now)
+                if wait == 0:
+                    future.set_result(None)
+                else:
+                    pending.append(item)
+                    next_wake = wait if next_wake is None else min(next_wake, wait)
+            for item in pending:
+                heapq.heappush(self._waiters, item)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_wake)
+            except asyncio.TimeoutError:
+                pass
+
+    def update(self, method, headers):
+        """Учесть заголовки лимитов из ответа API"""
+        remaining = headers.get('x-ratelimit-remaining')
+        if remaining is None:
+            return
+        try:
+            reset = headers.get('x-ratelimit-reset')
+            self.bucket(service_group(method)).sync(int(remaining), float(reset) if reset is not None else None)
+        except ValueError:
+            logging.warning(f"Unexpected rate limit headers for {method}: {remaining}, {headers.get('x-ratelimit-reset')}")
+
+    def stats(self):
+        return {
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'waiting': sum(1 for item in self._waiters if not item[3].done()),
+            'tokens': {group: round(bucket.tokens, 1) for group, bucket in self.buckets.items()}
+        }
@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from api import CANDLE_INTERVALS
+from trade import LiveBroker, run_step
+
+# Задержка тика после границы свечи, чтобы закрытая свеча успела появиться в API
+SCHEDULER_TICK_DELAY = float(os.getenv('SCHEDULER_TICK_DELAY', 2))
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 8))
+
+
+def next_tick(period, delay=SCHEDULER_TICK_DELAY, now=None):
+    """Ближайшая граница свечи (время epoch) плюс delay"""
+    now = time.time() if now is None else now
+    return (now - delay) // period * period + period + delay
+
+
+class TradingJob:
+    """Стратегии одного счёта, исполняемые на закрытии каждой свечи interval"""
+
+    def __init__(self, job_id, account_id, strategies, interval='MINUTE'):
+        self.job_id = job_id
+        self.account_id = account_id
+        self.strategies = list(strategies)
+        self.interval = interval.upper()
+        self.period = CANDLE_INTERVALS[self.interval].total_seconds()
+        self.broker = LiveBroker(account_id)
+        self.task = None
+        self.ticks = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_tick = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def status(self):
+        return {
+            'job_id': self.job_id,
+            'account_id': self.account_id,
+            'interval': self.interval,
+            'instruments': [strategy.figi for strategy in self.strategies],
+            'strategies': [type(strategy).__name__ for strategy in self.strategies],
+            'running': self.running,
+            'ticks': self.ticks,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'last_tick': self.last_tick
+        }
+
+
+class TradingScheduler:
+    """Планировщик торговых заданий в event loop приложения.
+
+    Тики выравниваются по границам свечей и вычисляются от часов, а не от
+    длительности предыдущего тика, поэтому не накапливают сдвиг; тик, на
+    который не хватило времени, пропускается. Вызовы API выполняются в
+    отдельном пуле потоков, ошибка стратегии не затрагивает другие задания.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, tick_delay=SCHEDULER_TICK_DELAY):
+        self.tick_delay = tick_delay
+        self.jobs = {}
+        self.loop = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='trading')
+
+    def start(self):
+        """Запомнить event loop, в котором будут работать задания"""
+        self.loop = asyncio.get_running_loop()
+
+    def add_job(self, job_id, account_id, strategies, interval='MINUTE'):
+        """Создать и запустить задание (вызывать из event loop)"""
+        if job_id in self.jobs and self.jobs[job_id].running:
+            raise ValueError(f"Trading job {job_id} is already running")
+        job = TradingJob(job_id, account_id, strategies, interval)
+        job.task = asyncio.get_running_loop().create_task(self._run_job(job))
+        self.jobs[job_id] = job
+        logging.info(f"Trading job {job_id} started: {job.status()['instruments']} every {job.interval}")
+        return job
+
+    def is_running(self, job_id):
+        job = self.jobs.get(job_id)
+        return job is not None and job.running
+
+    async def stop_job(self, job_id=None):
+        """Остановить задание (или все); возвращает список остановленных"""
+        stopped = []
+        for job in list(self.jobs.values()):
+            if (job_id is None or job.job_id == job_id) and job.running:
+                job.task.cancel()
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    pass
+                stopped.append(job.job_id)
+                logging.info(f"Trading job {job.job_id} stopped")
+        return stopped
+
+    def status(self):
+        return [job.status() for job in self.jobs.values()]
+
+    async def _run_job(self, job):
+        loop = asyncio.get_running_loop()
+        deadline = next_tick(job.period, self.tick_delay)
+        while True:
+            await asyncio.sleep(max(0, deadline - time.time()))
+            await self._tick(job, loop)
+            deadline += job.period
+            now = time.time()
+            if deadline <= now:
+                missed = int((now - deadline) // job.period) + 1
+                job.skipped += missed
+                logging.warning(f"Trading job {job.job_id} is late, skipping {missed} ticks")
+                deadline = next_tick(job.period, self.tick_delay, now)
+
+    async def _tick(self, job, loop):
+        job.ticks += 1
+        job.last_tick = time.time()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, run_step, strategy, job.broker)
+            for strategy in job.strategies
+        ), return_exceptions=True)
+        for strategy, result in zip(job.strategies, results):
+            if isinstance(result, Exception):
+                job.errors += 1
+                job.last_error = f"{strategy.figi}: {str(result)}"
+                logging.error(f"Trading job {job.job_id} error for {strategy.figi}: {str(result)}")
+            elif result:
+                logging.info(f"Trading job {job.job_id} orders for {strategy.figi}: {result}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий планировщик торговли
+trading_scheduler = TradingScheduler()
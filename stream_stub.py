@@ -0,0 +1,69 @@
+import os
+import json
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from aiohttp import web, WSMsgType
+from tinkoff_client import SERVICE_PREFIX
+
+# Локальная заглушка MarketDataStream для разработки без доступа к брокеру:
+# TINKOFF_STREAM_URL=ws://127.0.0.1:8766/ws/tinkoff.public.invest.api.contract.v1.MarketDataStreamService/MarketDataStream
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+HOST = os.getenv('STREAM_STUB_HOST', '127.0.0.1')
+PORT = int(os.getenv('STREAM_STUB_PORT', 8766))
+TICK_INTERVAL = float(os.getenv('STREAM_STUB_TICK', 0.5))
+
+
+def quotation(value):
+    units = int(value)
+    return {'units': str(units), 'nano': int(round((value - units) * 1e9))}
+
+
+async def handle_stream(request):
+    ws = web.WebSocketResponse(protocols=('json',), heartbeat=30)
+    await ws.prepare(request)
+    figis = set()
+    prices = {}
+
+    async def ticker():
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            for figi in list(figis):
+                prices[figi] = max(0.01, prices.get(figi, 100.0) * (1 + random.gauss(0, 0.001)))
+                await ws.send_json({'lastPrice': {
+                    'figi': figi,
+                    'price': quotation(prices[figi]),
+                    'time': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                }})
+
+    task = asyncio.create_task(ticker())
+    try:
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            request_data = json.loads(message.data).get('subscribeLastPriceRequest')
+            if not request_data:
+                continue
+            requested = {item['instrumentId'] for item in request_data.get('instruments', [])}
+            if request_data.get('subscriptionAction') == 'SUBSCRIPTION_ACTION_UNSUBSCRIBE':
+                figis -= requested
+            else:
+                figis |= requested
+            await ws.send_json({'subscribeLastPriceResponse': {'lastPriceSubscriptions': [
+                {'figi': figi, 'subscriptionStatus': 'SUBSCRIPTION_STATUS_SUCCESS'} for figi in sorted(requested)
+            ]}})
+    finally:
+        task.cancel()
+    return ws
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get(f'/ws/{SERVICE_PREFIX}MarketDataStreamService/MarketDataStream', handle_stream)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=HOST, port=PORT)
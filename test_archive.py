@@ -0,0 +1,81 @@
+import os
+import numpy as np
+from archive import CandleArchive, PENDING_DIR
+
+START = 1700000000
+
+
+def make_columns(times, close=None):
+    """Свечи в колонках decode_candles для заданных секунд epoch"""
+    times = np.asarray(times, dtype=np.int64)
+    close = np.asarray(close if close is not None else 100.0 + times - START, dtype=np.float64)
+    return {
+        'time': times.astype('datetime64[s]'),
+        'open': close, 'high': close + 1, 'low': close - 1, 'close': close,
+        'volume': np.arange(len(times), dtype=np.int64)
+    }
+
+
+def stored_times(archive, figi='FIGI', interval='hour'):
+    return list(archive.read(figi, interval)['time'].astype(np.int64))
+
+
+def test_append_newer_same_older(tmp_path):
+    archive = CandleArchive(str(tmp_path))
+    assert archive.append('FIGI', 'hour', make_columns([START, START + 60])) == 0
+    # Новее последней - дописываются
+    assert archive.append('FIGI', 'hour', make_columns([START + 120])) == 0
+    # С тем же временем - последняя свеча перезаписывается на месте
+    assert archive.append('FIGI', 'hour', make_columns([START + 120], [555.0])) == 0
+    assert stored_times(archive) == [START, START + 60, START + 120]
+    assert archive.read('FIGI', 'hour')['close'][-1] == 555.0
+    # Старше последней - в pending до compact()
+    assert archive.append('FIGI', 'hour', make_columns([START - 60, START + 30])) == 2
+    assert stored_times(archive) == [START, START + 60, START + 120]
+    assert os.path.isdir(tmp_path / 'FIGI' / 'HOUR' / PENDING_DIR)
+    assert archive.last_time('FIGI', 'hour') == START + 120
+
+
+def test_compact_sorts_and_deduplicates(tmp_path):
+    archive = CandleArchive(str(tmp_path))
+    archive.append('FIGI', 'hour', make_columns([START, START + 60, START + 120]))
+    archive.append('FIGI', 'hour', make_columns([START + 60, START - 60, START + 30, START - 60], [1.0, 2.0, 3.0, 4.0]))
+    assert archive.compact() == 1
+    columns = archive.read('FIGI', 'hour')
+    assert stored_times(archive) == [START - 60, START, START + 30, START + 60, START + 120]
+    # Из повторов остаётся последняя загруженная свеча
+    assert list(columns['close']) == [4.0, 100.0, 3.0, 1.0, 220.0]
+    assert not os.path.exists(tmp_path / 'FIGI' / 'HOUR' / PENDING_DIR)
+    assert archive.compact() == 0
+
+
+def test_compact_after_interrupted_compact(tmp_path):
+    archive = CandleArchive(str(tmp_path))
+    archive.append('FIGI', 'hour', make_columns([START, START + 60]))
+    archive.append('FIGI', 'hour', make_columns([START - 60]))
+    # Остатки прерванного compact(): старая копия и недописанная новая
+    for name in ('HOUR.old', 'HOUR.compact'):
+        os.makedirs(tmp_path / 'FIGI' / name)
+        (tmp_path / 'FIGI' / name / 'time').write_bytes(b'garbage')
+    assert archive.compact('FIGI', 'hour') == 1
+    assert stored_times(archive) == [START - 60, START, START + 60]
+    assert sorted(os.listdir(tmp_path / 'FIGI')) == ['HOUR']
+
+
+def test_series_ignores_temporary_dirs(tmp_path):
+    archive = CandleArchive(str(tmp_path))
+    archive.append('FIGI', 'hour', make_columns([START]))
+    archive.append('FIGI', 'day', make_columns([START]))
+    for name in ('HOUR.old', 'HOUR.compact'):
+        os.makedirs(tmp_path / 'FIGI' / name)
+    (tmp_path / 'FIGI' / 'notes').write_text('not a series')
+    assert archive.series() == [('FIGI', 'DAY'), ('FIGI', 'HOUR')]
+    assert len(archive) == 2
+
+
+def test_read_window(tmp_path):
+    archive = CandleArchive(str(tmp_path))
+    archive.append('FIGI', 'hour', make_columns(START + np.arange(10) * 60))
+    columns = archive.read('FIGI', 'hour', START + 120, START + 300)
+    assert list(columns['time'].astype(np.int64)) == [START + 120, START + 180, START + 240]
+    assert stored_times(CandleArchive(str(tmp_path / 'missing'))) == []
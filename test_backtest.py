@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from backtest import run_event, run_vectorized
+from trade import FlipStrategy, SmaCrossStrategy
+
+
+def make_candles(count, seed=1, step=3600, start=1700000000):
+    """Случайные свечи в формате колонок decode_candles"""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, count))
+    open_ = close + rng.normal(0, 0.5, count)
+    return {
+        'time': (start + np.arange(count) * step).astype('datetime64[s]'),
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.random(count),
+        'low': np.minimum(open_, close) - rng.random(count),
+        'close': close,
+        'volume': rng.integers(0, 1000, count)
+    }
+
+
+@pytest.mark.parametrize('strategy', [
+    SmaCrossStrategy('FIGI', fast=5, slow=20, lots=3),
+    SmaCrossStrategy('FIGI', fast=10, slow=30, lots=1),
+    FlipStrategy('FIGI', lots=2)
+], ids=['sma-5-20', 'sma-10-30', 'flip'])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_event_and_vectorized_agree(strategy, seed):
+    candles = make_candles(500, seed)
+    event = run_event(strategy, candles, lot=10)
+    vectorized = run_vectorized(strategy, candles, lot=10)
+    # Денег хватает на любую сделку: проверка денег в SimBroker ничего не отклоняет
+    assert event.rejected == 0
+    assert event.trades == vectorized.trades > 0
+    assert np.array_equal(event.times, vectorized.times)
+    np.testing.assert_allclose(event.equity, vectorized.equity, rtol=0, atol=1e-6)
+    assert event.fees == pytest.approx(vectorized.fees)
+    assert event.report() == vectorized.report()
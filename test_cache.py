@@ -0,0 +1,97 @@
+import threading
+import pytest
+from cache import SingleFlightCache
+
+
+class SlowLoader:
+    """loader, который ждёт release и возвращает номер вызова"""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        call = self.calls
+        self.started.set()
+        assert self.release.wait(5)
+        return call
+
+
+def start_get(cache, key, loader, results):
+    thread = threading.Thread(target=lambda: results.append(cache.get(key, loader)))
+    thread.start()
+    return thread
+
+
+def test_concurrent_gets_share_one_load():
+    cache, loader, results = SingleFlightCache(60), SlowLoader(), []
+    first = start_get(cache, 'key', loader, results)
+    assert loader.started.wait(5)
+    second = start_get(cache, 'key', loader, results)
+    loader.release.set()
+    first.join(5)
+    second.join(5)
+    assert results == [1, 1]
+    assert loader.calls == 1
+    assert cache.get('key', loader) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_invalidate_during_load_starts_new_load():
+    cache, loader, results = SingleFlightCache(60), SlowLoader(), []
+    stale = start_get(cache, 'key', loader, results)
+    assert loader.started.wait(5)
+    cache.invalidate('key')
+    # Запрос после invalidate() не присоединяется к начатой загрузке
+    loader.release.set()
+    assert cache.get('key', loader) == 2
+    stale.join(5)
+    assert results == [1]
+    assert loader.calls == 2
+    # Устаревший результат первой загрузки не попал в кэш
+    assert cache.get('key', loader) == 2
+
+
+def test_invalidate_all_during_load():
+    cache, loader, results = SingleFlightCache(60), SlowLoader(), []
+    stale = start_get(cache, 'key', loader, results)
+    assert loader.started.wait(5)
+    cache.invalidate()
+    loader.release.set()
+    stale.join(5)
+    assert cache.get('key', loader) == 2
+
+
+def test_stale_leader_does_not_drop_new_load():
+    cache = SingleFlightCache(60)
+    old, new = SlowLoader(), SlowLoader()
+    old_results, new_results, joined = [], [], []
+    stale = start_get(cache, 'key', old, old_results)
+    assert old.started.wait(5)
+    cache.invalidate('key')
+    leader = start_get(cache, 'key', new, new_results)
+    assert new.started.wait(5)
+    old.release.set()
+    stale.join(5)
+    # Завершение старой загрузки не убирает из _inflight новую
+    follower = start_get(cache, 'key', new, joined)
+    new.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert new.calls == 1
+    assert new_results == joined == [1]
+
+
+def test_errors_are_not_cached():
+    cache, calls = SingleFlightCache(60), []
+
+    def failing():
+        calls.append(1)
+        raise ValueError('boom')
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get('key', failing)
+    assert len(calls) == 2
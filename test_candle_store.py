@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datetime import datetime, timedelta, timezone
+from api import decode_candles, _parse_candle
+from candle_store import CandleStore, CandleSeries, CANDLE_SEED_MAX_GAP, column_time
+
+
+def quotation(value):
+    """Quotation API: units и nano одного знака, units строкой"""
+    units = int(value)
+    return {'units': str(units), 'nano': int(round((value - units) * 1e9))}
+
+
+def raw_candle(time, close, volume=10):
+    return {
+        'time': time,
+        'open': quotation(close - 0.5), 'high': quotation(close + 1.25),
+        'low': quotation(close - 1.75), 'close': quotation(close),
+        'volume': str(volume), 'isComplete': True
+    }
+
+
+def assert_same_as_parse_candle(raw_candles):
+    columns = decode_candles(raw_candles)
+    expected = [_parse_candle(candle) for candle in raw_candles]
+    for field in ('open', 'high', 'low', 'close', 'volume'):
+        assert list(columns[field]) == pytest.approx([candle[field] for candle in expected], abs=1e-12)
+    times = pd.to_datetime([candle['date'] for candle in expected], utc=True, format='ISO8601')
+    assert list(columns['time']) == list(times.tz_localize(None).values.astype('datetime64[s]'))
+    assert columns['time'].dtype == np.dtype('datetime64[s]') and columns['volume'].dtype == np.int64
+
+
+def test_decode_matches_parse_candle():
+    raw_candles = [raw_candle(f'2024-01-{day:02d}T{hour:02d}:00:00Z', 100 + day + hour / 100, day * hour)
+                   for day in (1, 9, 31) for hour in (0, 7, 23)]
+    assert_same_as_parse_candle(raw_candles)
+
+
+def test_decode_negative_nano():
+    raw_candles = [raw_candle('2024-01-09T07:00:00Z', -0.25), raw_candle('2024-01-09T08:00:00Z', -3.5)]
+    raw_candles[0]['open'] = {'units': '0', 'nano': -750000000}
+    raw_candles[1]['low'] = {'units': '-5', 'nano': -250000000}
+    assert_same_as_parse_candle(raw_candles)
+    columns = decode_candles(raw_candles)
+    assert columns['open'][0] == pytest.approx(-0.75)
+    assert columns['low'][1] == pytest.approx(-5.25)
+
+
+def test_decode_mixed_time_formats():
+    # Дробные секунды у части свечей: быстрый разбор по байтам невозможен, нужен общий
+    raw_candles = [raw_candle('2024-01-09T07:00:00Z', 100), raw_candle('2024-01-09T08:00:00.5Z', 101),
+                   raw_candle('2024-02-29T23:59:59.123456789Z', 102)]
+    assert_same_as_parse_candle(raw_candles)
+    assert list(decode_candles(raw_candles)['time'].astype(np.int64)) == [1704783600, 1704787200, 1709251199]
+
+
+def test_decode_empty():
+    columns = decode_candles([])
+    assert all(len(values) == 0 for values in columns.values())
+    assert columns['time'].dtype == np.dtype('datetime64[s]')
+
+
+HOUR = timedelta(hours=1)
+
+
+def hourly_columns(start_time, end_time):
+    """Часовые свечи за [start_time, end_time) в колонках decode_candles"""
+    first = int(np.ceil(start_time.timestamp() / 3600)) * 3600
+    times = np.arange(first, end_time.timestamp(), 3600).astype(np.int64)
+    close = 100.0 + (times - first) / 3600
+    return {'time': times.astype('datetime64[s]'), 'open': close, 'high': close + 1, 'low': close - 1,
+            'close': close, 'volume': np.ones(len(times), dtype=np.int64)}
+
+
+class RecordingFetcher:
+    """fetch_candle_columns: часовые свечи за любой период, запрошенные периоды запоминаются"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, figi, interval, start_time, end_time):
+        self.ranges.append((start_time, end_time))
+        return hourly_columns(start_time, end_time)
+
+
+def close_to(value, expected):
+    return abs(value - expected) < timedelta(seconds=5)
+
+
+def test_missing_ranges_partially_cached():
+    now = datetime.now(timezone.utc)
+    series = CandleSeries()
+    store = CandleStore(fetcher=RecordingFetcher(), persist=None, loader=None)
+    assert store._missing_ranges(series, now - timedelta(days=7), now) == [(now - timedelta(days=7), now)]
+    series.upsert(hourly_columns(now - timedelta(days=3), now - 2 * HOUR))
+    series.covered_from, series.covered_to = now - timedelta(days=3), now - 2 * HOUR
+    last = series.last_time()
+    # Недостающее начало и хвост с последней (возможно, незакрытой) свечи
+    assert store._missing_ranges(series, now - timedelta(days=7), now) == [
+        (now - timedelta(days=7), now - timedelta(days=3)), (last, now)]
+    # Окно внутри покрытого периода - только хвост
+    assert store._missing_ranges(series, now - timedelta(days=1), now) == [(last, now)]
+
+
+def test_get_columns_fetches_only_missing():
+    fetcher = RecordingFetcher()
+    store = CandleStore(fetcher=fetcher, persist=None, loader=None)
+    first = store.get_columns('FIGI', 'hour', days=2)
+    assert len(fetcher.ranges) == 1
+    covered_from = fetcher.ranges[0][0]
+    columns = store.get_columns('FIGI', 'hour', days=5)
+    (head_start, head_end), (tail_start, tail_end) = fetcher.ranges[1:]
+    assert close_to(tail_end - head_start, timedelta(days=5))
+    assert head_end == covered_from
+    assert tail_start == column_time(first['time'][-1])
+    times = columns['time'].astype(np.int64)
+    assert np.all(np.diff(times) == 3600) and len(times) in (5 * 24, 5 * 24 + 1)
+
+
+def test_seed_covers_only_tail_after_long_gap():
+    now = datetime.now(timezone.utc)
+    old_end = now - timedelta(days=6, hours=12)
+    parts = [hourly_columns(now - timedelta(days=7), old_end),
+             hourly_columns(old_end + CANDLE_SEED_MAX_GAP + HOUR, now - timedelta(days=2)),
+             # Разрыв короче предела (выходные) покрытие не прерывает
+             hourly_columns(now - timedelta(hours=12), now - 3 * HOUR)]
+    stored = {field: np.concatenate([part[field] for part in parts]) for field in parts[0]}
+    fetcher = RecordingFetcher()
+    store = CandleStore(fetcher=fetcher, persist=None, loader=lambda figi, interval, start, end: stored)
+    store.get_columns('FIGI', 'hour', days=7)
+    (head_start, head_end), (tail_start, tail_end) = fetcher.ranges
+    # Свечи до длинного разрыва не считаются покрытыми и загружаются заново
+    assert close_to(head_start, now - timedelta(days=7))
+    assert head_end == column_time(parts[1]['time'][0])
+    assert tail_start == column_time(stored['time'][-1])
+    assert close_to(tail_end, now)
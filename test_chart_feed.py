@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from archive import candle_columns
+from chart_feed import encode_candles, decode_chart_payload, changed_rows, KIND_SNAPSHOT, KIND_UPDATE
+
+
+def make_columns(count, seed=1, step=60, start=1700000000):
+    """Случайные свечи в колонках архива: цены с шагом 0.01, разности любого знака"""
+    rng = np.random.default_rng(seed)
+    close = np.round(100 + np.cumsum(rng.normal(0, 3, count)), 2)
+    open_ = np.round(close + rng.normal(0, 1, count), 2)
+    return candle_columns({
+        'time': (start + np.arange(count) * step).astype('datetime64[s]'),
+        'open': open_,
+        'high': np.maximum(open_, close) + np.round(rng.random(count), 2),
+        'low': np.minimum(open_, close) - np.round(rng.random(count), 2),
+        'close': close,
+        # Скачки объёма вниз и вверх требуют дельт шире 2 байт
+        'volume': rng.integers(0, 10 ** 6, count)
+    })
+
+
+def assert_round_trip(columns, kind=KIND_SNAPSHOT):
+    decoded, decoded_kind = decode_chart_payload(encode_candles(columns, kind))
+    assert decoded_kind == kind
+    for field in ('time', 'volume'):
+        assert np.array_equal(decoded[field], columns[field])
+    for field in ('open', 'high', 'low', 'close'):
+        assert decoded[field] == pytest.approx(columns[field], abs=1e-9)
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 500])
+def test_round_trip(count):
+    assert_round_trip(make_columns(count))
+
+
+def test_round_trip_negative_deltas():
+    columns = make_columns(50)
+    # Убывающие цены и объём, отрицательные цены (спреды) и неравномерное время
+    for field in ('open', 'high', 'low', 'close'):
+        columns[field] = columns[field][::-1] - 150
+    columns['volume'] = np.sort(columns['volume'])[::-1]
+    columns['time'] = columns['time'] + np.arange(50) ** 2
+    assert columns['close'].min() < 0 and np.diff(columns['close']).min() < 0
+    assert_round_trip(columns, KIND_UPDATE)
+
+
+def test_round_trip_keeps_fine_price_steps():
+    columns = make_columns(10)
+    columns['close'] = columns['close'] + 0.0005
+    assert_round_trip(columns)
+
+
+def test_changed_rows():
+    current = make_columns(12)
+    previous = {field: values[:10].copy() for field, values in current.items()}
+    assert list(changed_rows(None, current)) == list(range(12))
+    # Совпадающая последняя свеча не пересылается, новые - да
+    assert list(changed_rows(previous, current)) == [10, 11]
+    # Последняя отправленная свеча обновилась
+    current['close'][9] += 1
+    assert list(changed_rows(previous, current)) == [9, 10, 11]
+    assert list(changed_rows(previous, previous)) == []
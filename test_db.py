@@ -0,0 +1,76 @@
+import sqlite3
+import numpy as np
+from db import connect, migrate, MIGRATIONS, LEGACY_INTERVAL, INSERT_CANDLE, SELECT_CANDLES, Storage, candle_rows
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def user_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def test_migrate_fresh_database(tmp_path):
+    conn = connect(str(tmp_path / 'fresh.db'))
+    assert migrate(conn) == len(MIGRATIONS)
+    assert user_version(conn) == len(MIGRATIONS)
+    assert {'candles', 'trades', 'telegram_files'} <= tables(conn)
+    # Повторный запуск ничего не меняет
+    migrate(conn)
+    assert user_version(conn) == len(MIGRATIONS)
+    conn.close()
+
+
+def test_migrate_legacy_database(tmp_path):
+    # База прежней версии: таблицы без интервала, время строкой, user_version = 0
+    path = str(tmp_path / 'legacy.db')
+    legacy = sqlite3.connect(path)
+    legacy.executescript('''
+        CREATE TABLE candles (figi TEXT, time TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER);
+        CREATE TABLE trades (figi TEXT, direction TEXT, price REAL, quantity INTEGER, time TEXT);
+        INSERT INTO candles VALUES ('FIGI', '2024-01-09T07:00:00Z', 1, 2, 0.5, 1.5, 10);
+        INSERT INTO candles VALUES ('FIGI', '2024-01-09T07:00:00Z', 1, 2, 0.5, 1.6, 12);
+        INSERT INTO candles VALUES ('FIGI', '2024-01-09T08:00:00+00:00', 1.5, 2.5, 1, 2, 20);
+        INSERT INTO candles VALUES (NULL, '2024-01-09T09:00:00Z', 1, 1, 1, 1, 1);
+        INSERT INTO trades VALUES ('FIGI', 'Buy', 1.5, 1, '2024-01-09T07:30:00');
+    ''')
+    legacy.commit()
+    legacy.close()
+
+    conn = connect(path)
+    assert user_version(conn) == 0
+    migrate(conn)
+    assert user_version(conn) == len(MIGRATIONS)
+    rows = conn.execute(SELECT_CANDLES, ('FIGI', LEGACY_INTERVAL, 0, 2 ** 62)).fetchall()
+    # Дубли свёрнуты, время переведено в секунды epoch, строки без figi отброшены
+    assert rows == [(1704783600, 1.0, 2.0, 0.5, 1.6, 12), (1704787200, 1.5, 2.5, 1.0, 2.0, 20)]
+    assert conn.execute('SELECT COUNT(*) FROM trades').fetchone()[0] == 1
+    conn.close()
+
+
+def test_migrate_from_intermediate_version(tmp_path):
+    path = str(tmp_path / 'v2.db')
+    conn = connect(path)
+    for number, script in enumerate(MIGRATIONS[:2], start=1):
+        conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+    conn.execute(INSERT_CANDLE, ('FIGI', 'HOUR', 100, 1, 2, 0.5, 1.5, 10))
+    conn.commit()
+    assert 'telegram_files' not in tables(conn)
+    migrate(conn)
+    assert user_version(conn) == len(MIGRATIONS)
+    assert 'telegram_files' in tables(conn)
+    assert conn.execute('SELECT COUNT(*) FROM candles').fetchone()[0] == 1
+    conn.close()
+
+
+def test_storage_writes_through_queue(tmp_path):
+    storage = Storage(path=str(tmp_path / 'queue.db'), flush_interval=0.01)
+    columns = {'time': np.array([100, 200, 100]), 'open': np.ones(3), 'high': np.ones(3) * 2,
+               'low': np.zeros(3), 'close': np.array([1.0, 1.5, 1.2]), 'volume': np.array([1, 2, 3])}
+    storage.executemany(INSERT_CANDLE, candle_rows('FIGI', 'HOUR', columns))
+    assert storage.flush(5)
+    rows = storage.reader().execute(SELECT_CANDLES, ('FIGI', 'HOUR', 0, 1000)).fetchall()
+    # Повторная запись свечи с тем же временем обновляет её
+    assert rows == [(100, 1.0, 2.0, 0.0, 1.2, 3), (200, 1.0, 2.0, 0.0, 1.5, 2)]
+    storage.close(5)
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+from indicators import RingBuffer, SMA, EMA, RSI, VWAP, IndicatorSet
+
+
+def make_candles(count, seed=1, step=3600, start=1700000000):
+    """Случайные свечи в формате колонок decode_candles"""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, count))
+    open_ = close + rng.normal(0, 0.5, count)
+    return {
+        'time': (start + np.arange(count) * step).astype('datetime64[s]'),
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.random(count),
+        'low': np.minimum(open_, close) - rng.random(count),
+        'close': close,
+        'volume': rng.integers(0, 1000, count)
+    }
+
+
+def candle_at(columns, i):
+    return {field: columns[field][i] for field in ('open', 'high', 'low', 'close', 'volume')}
+
+
+# Эталонные реализации: полный пересчёт простыми циклами
+
+def reference_sma(close, period):
+    return [np.mean(close[i - period + 1:i + 1]) if i >= period - 1 else np.nan for i in range(len(close))]
+
+
+def reference_ema(close, period):
+    alpha, values = 2 / (period + 1), []
+    for i, price in enumerate(close):
+        values.append(price if i == 0 else alpha * price + (1 - alpha) * values[-1])
+    return values
+
+
+def reference_rsi(close, period):
+    values, gain, loss = [np.nan], None, None
+    for i in range(1, len(close)):
+        change = close[i] - close[i - 1]
+        up, down = max(change, 0), max(-change, 0)
+        if gain is None:
+            gain, loss = up, down
+        else:
+            gain = (up + (period - 1) * gain) / period
+            loss = (down + (period - 1) * loss) / period
+        if i < period:
+            values.append(np.nan)
+        else:
+            values.append(100.0 if loss == 0 else 100 - 100 / (1 + gain / loss))
+    return values
+
+
+def reference_vwap(columns, offset=3 * 3600):
+    times = columns['time'].astype(np.int64)
+    values, session, pv, volume = [], None, 0.0, 0.0
+    for i in range(len(times)):
+        day = (times[i] + offset) // 86400
+        if day != session:
+            session, pv, volume = day, 0.0, 0.0
+        pv += (columns['high'][i] + columns['low'][i] + columns['close'][i]) / 3 * columns['volume'][i]
+        volume += columns['volume'][i]
+        values.append(pv / volume if volume else np.nan)
+    return values
+
+
+CASES = [
+    (lambda: SMA(1), lambda c: reference_sma(c['close'], 1)),
+    (lambda: SMA(20), lambda c: reference_sma(c['close'], 20)),
+    (lambda: EMA(12), lambda c: reference_ema(c['close'], 12)),
+    (lambda: RSI(14), lambda c: reference_rsi(c['close'], 14)),
+    (lambda: VWAP(), reference_vwap)
+]
+
+
+def stream(indicator, columns, start=0, revisions=3, seed=2):
+    """Подать свечи по одной; каждая сначала приходит несколько раз незаконченной"""
+    rng = np.random.default_rng(seed)
+    values = []
+    for i in range(start, len(columns['close'])):
+        final = candle_at(columns, i)
+        for _ in range(revisions):
+            partial = dict(final)
+            partial['close'] = final['close'] + rng.normal(0, 2)
+            partial['volume'] = int(final['volume'] * rng.random())
+            indicator.update(columns['time'][i], partial)
+        values.append(indicator.update(columns['time'][i], final))
+    return np.array(values)
+
+
+@pytest.mark.parametrize('make, reference', CASES)
+def test_streaming_matches_full_recompute(make, reference):
+    columns = make_candles(300, step=1800)
+    expected = np.array(reference(columns))
+    assert np.allclose(stream(make(), columns), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('make, reference', CASES)
+def test_seed_matches_full_recompute(make, reference):
+    columns = make_candles(300, step=1800)
+    expected = np.array(reference(columns))
+    indicator = make()
+    assert np.allclose(indicator.seed(columns), expected, equal_nan=True)
+    assert np.allclose(indicator.values.last(len(expected)), expected[-indicator.values.capacity:], equal_nan=True)
+
+
+@pytest.mark.parametrize('make, reference', CASES)
+def test_seed_then_stream(make, reference):
+    columns = make_candles(300, step=1800)
+    expected = np.array(reference(columns))
+    indicator = make()
+    seed = {field: values[:200] for field, values in columns.items()}
+    indicator.seed(seed)
+    # Последняя засеянная свеча ещё не закрыта и приходит заново с изменениями
+    streamed = stream(indicator, columns, start=199)
+    assert np.allclose(streamed, expected[199:], equal_nan=True)
+
+
+def test_sma_running_sum_does_not_drift():
+    columns = make_candles(5000, step=60)
+    columns['close'] = columns['close'] * 1e6
+    sma = SMA(7)
+    assert np.allclose(stream(sma, columns, revisions=1), reference_sma(columns['close'], 7),
+                       rtol=1e-12, equal_nan=True)
+
+
+def test_rejects_older_candle():
+    sma = SMA(3)
+    sma.update('2024-01-01T10:00:00Z', {'close': 1.0})
+    with pytest.raises(ValueError):
+        sma.update('2024-01-01T09:00:00Z', {'close': 1.0})
+
+
+def test_indicator_set_accepts_api_candles():
+    indicators = IndicatorSet(fast=SMA(2), slow=EMA(3))
+    indicators.update({'date': '2024-01-01T10:00:00Z', 'close': 1.0})
+    values = indicators.update({'date': '2024-01-01T11:00:00Z', 'close': 3.0})
+    assert values['fast'] == 2.0
+    assert values['slow'] == indicators.values()['slow'] == 2.0
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(3)
+    for value in range(5):
+        ring.append(value)
+    ring.replace_last(9)
+    assert ring.last(3).tolist() == [2, 3, 9]
+    assert len(ring) == 3
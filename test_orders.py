@@ -0,0 +1,66 @@
+import asyncio
+from orders import OrderManager, Order, STATUS_UNKNOWN, STATUS_FILLED, STATUS_REJECTED
+from tinkoff_client import TinkoffAPIError
+
+
+class FakeClient:
+    """Клиент API: PostOrder теряет ответ, GetOrderState отвечает по очереди из states"""
+
+    def __init__(self, states):
+        self.states = list(states)
+        self.calls = []
+
+    async def call(self, method, payload=None):
+        self.calls.append(method)
+        if method == "OrdersService/PostOrder":
+            raise asyncio.TimeoutError()
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+
+def run_order(states, **options):
+    async def scenario():
+        manager = OrderManager(api_client=FakeClient(states), poll_interval=0.01, **options)
+        statuses = []
+        manager.subscribe(lambda order: statuses.append(order.status))
+        order = await manager._submit(Order('account', 'FIGI', 'Buy', 2))
+        await asyncio.wait_for(asyncio.wrap_future(order.future), 2)
+        return manager, order, statuses
+    return asyncio.run(scenario())
+
+
+def test_unknown_order_filled_after_poll():
+    fill = {'orderId': 'broker-1', 'executionReportStatus': STATUS_FILLED, 'lotsExecuted': '2'}
+    manager, order, statuses = run_order([TinkoffAPIError(503, 'unavailable'), fill])
+    assert statuses == [STATUS_UNKNOWN, STATUS_FILLED]
+    assert order.filled and order.lots_executed == 2 and order.broker_order_id == 'broker-1'
+    assert manager.active() == []
+
+
+def test_unknown_order_not_found_is_rejected():
+    manager, order, statuses = run_order([TinkoffAPIError(404, 'order not found')])
+    assert statuses == [STATUS_UNKNOWN, STATUS_REJECTED]
+    assert order.error == 'order not found'
+    assert manager.failed == 1
+
+
+def test_unknown_order_rejected_after_timeout():
+    manager, order, statuses = run_order([TinkoffAPIError(503, 'unavailable')], unknown_timeout=0.05)
+    assert order.status == STATUS_REJECTED
+    assert 'unknown' in order.error
+    assert manager.active() == []
+
+
+def test_history_keeps_active_orders():
+    manager = OrderManager(api_client=FakeClient([{}]), history=2)
+    active = Order('account', 'FIGI', 'Buy', 1)
+    active.status = STATUS_UNKNOWN
+    manager._remember(active)
+    for _ in range(3):
+        order = Order('account', 'FIGI', 'Buy', 1)
+        order.status = STATUS_FILLED
+        manager._remember(order)
+    assert manager.get(active.order_id) is active
+    assert len(manager._orders) == 2
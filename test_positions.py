@@ -0,0 +1,96 @@
+import pytest
+from positions import Position, PositionBook
+
+
+def test_open_long():
+    position = Position('FIGI')
+    assert position.fill(10, 100.0) == 0.0
+    assert position.quantity == 10
+    assert position.average_price == 100.0
+
+
+def test_add_averages_price():
+    position = Position('FIGI')
+    position.fill(10, 100.0)
+    assert position.fill(30, 120.0) == 0.0
+    assert position.quantity == 40
+    assert position.average_price == pytest.approx(115.0)
+
+
+def test_reduce_realises_pnl():
+    position = Position('FIGI', 40, 115.0)
+    assert position.fill(-10, 125.0) == pytest.approx(100.0)
+    assert position.quantity == 30
+    # Средняя цена остатка не меняется
+    assert position.average_price == pytest.approx(115.0)
+
+
+def test_close_resets_average():
+    position = Position('FIGI', 10, 100.0)
+    assert position.fill(-10, 90.0) == pytest.approx(-100.0)
+    assert position.quantity == 0
+    assert position.average_price == 0.0
+
+
+def test_cross_through_zero_to_short():
+    position = Position('FIGI', 10, 100.0)
+    # Закрываем 10 с прибылью 5 на штуку, оставшиеся 5 открывают шорт по цене сделки
+    assert position.fill(-15, 105.0) == pytest.approx(50.0)
+    assert position.quantity == -5
+    assert position.average_price == 105.0
+
+
+def test_short_add_and_cover():
+    position = Position('FIGI')
+    position.fill(-5, 105.0)
+    position.fill(-5, 95.0)
+    assert position.quantity == -10
+    assert position.average_price == pytest.approx(100.0)
+    # Шорт в прибыли при падении цены
+    assert position.fill(4, 90.0) == pytest.approx(40.0)
+    assert position.quantity == -6
+    assert position.fill(8, 110.0) == pytest.approx(-60.0)
+    assert position.quantity == 2
+    assert position.average_price == 110.0
+
+
+class StubOrders:
+    def subscribe(self, callback):
+        return lambda: None
+
+
+class StubPrices:
+    def get(self, figi):
+        return None
+
+
+def test_short_lots_round_toward_zero():
+    state = {'cash': 0.0, 'positions': [
+        {'figi': 'FIGI', 'quantity': -15.0, 'average_price': 100.0, 'lot': 10, 'current_price': 100.0}]}
+    book = PositionBook(fetcher=lambda account_id: state, prices=StubPrices(), orders=StubOrders())
+    assert book.position('account', 'FIGI')['lots'] == -1
+
+
+class UnseededDirectory:
+    """Справочник без индекса: загрузка в loop клиента недопустима"""
+
+    def lot_size(self, figi, default=1):
+        raise RuntimeError('call_sync() cannot be used inside the client loop')
+
+
+def test_fill_of_unseeded_figi_uses_order_lot(monkeypatch):
+    import positions
+    from orders import Order, STATUS_FILLED
+    monkeypatch.setattr(positions, 'instrument_directory', UnseededDirectory())
+    state = {'cash': 10000.0, 'positions': []}
+    book = PositionBook(fetcher=lambda account_id: state, prices=StubPrices(), orders=StubOrders())
+    book.seed('account')
+    order = Order('account', 'FIGI', 'ORDER_DIRECTION_BUY', 2, lot=10)
+    order.status = STATUS_FILLED
+    order.lots_executed = 2
+    order.executed_price = 100.0
+    book.on_order(order)
+    position = book.position('account', 'FIGI')
+    assert position['quantity'] == 20
+    assert position['lots'] == 2
+    assert book.portfolio('account')['cash'] == pytest.approx(8000.0)
@@ -0,0 +1,74 @@
+import time
+import asyncio
+import pytest
+from rate_limit import RateLimiter, TokenBucket, PRIORITY_DEFAULT, PRIORITY_MARKET_DATA
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = time.monotonic()
+    assert bucket.wait_time(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time(now) == pytest.approx(0.1)
+    assert bucket.wait_time(now + 0.1) == 0
+
+
+def test_orders_go_before_market_data():
+    async def scenario():
+        limiter = RateLimiter(global_limit=600, reserve=0)
+        # Общий бюджет исчерпан: оба запроса ждут, GetCandles встал в очередь первым
+        limiter.global_bucket.tokens = 0
+        granted = []
+
+        async def call(method):
+            await limiter.acquire(method)
+            granted.append(method)
+
+        candles = asyncio.create_task(call('MarketDataService/GetCandles'))
+        await asyncio.sleep(0)
+        order = asyncio.create_task(call('OrdersService/PostOrder'))
+        await asyncio.wait_for(asyncio.gather(candles, order), 2)
+        return limiter, granted
+
+    limiter, granted = asyncio.run(scenario())
+    assert granted == ['OrdersService/PostOrder', 'MarketDataService/GetCandles']
+    assert limiter.throttled == 2
+
+
+def test_market_data_stops_at_reserve():
+    async def scenario():
+        limiter = RateLimiter(global_limit=600, reserve=0.2)
+        # Осталось меньше резерва (120 запросов): рыночные данные ждут, остальные проходят
+        limiter.global_bucket.tokens = 100
+        now = time.monotonic()
+        assert limiter._try_take('MarketDataService', PRIORITY_MARKET_DATA, now) > 0
+        await asyncio.wait_for(limiter.acquire('UsersService/GetAccounts'), 0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire('MarketDataService/GetLastPrices'), 0.05)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.bucket('MarketDataService').tokens == pytest.approx(600, abs=1)
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_update_syncs_bucket_from_headers():
+    limiter = RateLimiter()
+    limiter.update('OrdersService/PostOrder', {'x-ratelimit-remaining': '5', 'x-ratelimit-reset': '30'})
+    bucket = limiter.bucket('OrdersService')
+    assert bucket.tokens == pytest.approx(5, abs=0.1)
+    assert bucket.wait_time() == 0
+    limiter.update('OrdersService/PostOrder', {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '2'})
+    assert bucket.wait_time() == pytest.approx(2, abs=0.1)
+    assert limiter._try_take('OrdersService', PRIORITY_DEFAULT, time.monotonic()) > 0
+
+
+def test_update_ignores_missing_and_bad_headers():
+    limiter = RateLimiter()
+    bucket = limiter.bucket('UsersService')
+    limiter.update('UsersService/GetAccounts', {})
+    limiter.update('UsersService/GetAccounts', {'x-ratelimit-remaining': 'many'})
+    limiter.update('UsersService/GetAccounts', {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': 'soon'})
+    assert bucket.tokens == pytest.approx(100, abs=0.1)
+    assert bucket.blocked_until == 0
@@ -0,0 +1,173 @@
+import re
+import time
+import random
+import asyncio
+import pytest
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+import tg_outbox
+from tg_outbox import split_html, TelegramOutbox, MERGE_SEPARATOR
+
+TAG = re.compile(r'<[^>]*>')
+
+
+def visible_words(*texts):
+    """Слова текстов (частей сообщения) без разметки"""
+    return [word for text in texts for word in TAG.sub(' ', text).split()]
+
+
+def balanced(chunk):
+    """Каждый открытый в части тег в ней же и закрыт, в правильном порядке"""
+    stack = []
+    for tag in TAG.findall(chunk):
+        name = re.match(r'</?\s*([a-zA-Z][\w-]*)', tag).group(1).lower()
+        if tag.startswith('</'):
+            if not stack or stack.pop() != name:
+                return False
+        elif not tag.endswith('/>'):
+            stack.append(name)
+    return not stack
+
+
+def test_short_text_is_not_split():
+    assert split_html('<b>hello</b>', 100) == ['<b>hello</b>']
+
+
+def test_split_reopens_tags():
+    text = '<b>' + 'word ' * 20 + '</b>'
+    chunks = split_html(text, 30)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 30 and balanced(chunk) and chunk.startswith('<b>') for chunk in chunks)
+    assert visible_words(*chunks) == visible_words(text)
+
+
+def test_entities_are_not_cut():
+    text = 'a' * 8 + ' &amp; ' * 10
+    chunks = split_html(text, 12)
+    assert all('&' not in chunk or re.search(r'&amp;', chunk) for chunk in chunks)
+    assert ''.join(chunks).count('&amp;') == 10
+
+
+def test_oversized_tag_keeps_text():
+    # Тег длиннее части нельзя ни разрезать, ни отправить: остаётся только текст ссылки
+    text = ('<a href="' + 'h' * 50 + '">link</a> ') * 3
+    chunks = split_html(text, 40)
+    assert all(len(chunk) <= 40 and balanced(chunk) for chunk in chunks)
+    assert visible_words(*chunks) == ['link', 'link', 'link']
+
+
+def test_unmatched_closing_tag_is_dropped():
+    text = '<a href="' + 'h' * 50 + '">link</a> ">link</a> '
+    chunks = split_html(text, 40)
+    assert all(balanced(chunk) for chunk in chunks)
+    assert visible_words(*chunks) == ['link', '">link']
+
+
+def test_plain_text_split():
+    text = 'x' * 25 + ' <b> ' + 'y' * 25
+    chunks = split_html(text, 20, html=False)
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert ''.join(chunks).replace(' ', '') == text.replace(' ', '')
+
+
+def test_random_markup_stays_balanced():
+    rng = random.Random(7)
+    tags = ['b', 'i', 'code']
+    for _ in range(100):
+        parts, open_tags = [], []
+        for _ in range(rng.randint(5, 40)):
+            if open_tags and rng.random() < 0.3:
+                parts.append(f'</{open_tags.pop()}>')
+            elif rng.random() < 0.3:
+                open_tags.append(rng.choice(tags))
+                parts.append(f'<{open_tags[-1]}>')
+            else:
+                parts.append(' '.join('w' * rng.randint(1, 8) for _ in range(rng.randint(1, 5))) + ' ')
+        parts.extend(f'</{name}>' for name in reversed(open_tags))
+        text = ''.join(parts)
+        limit = rng.randint(30, 80)
+        chunks = split_html(text, limit)
+        assert all(len(chunk) <= limit and balanced(chunk) for chunk in chunks), text
+        # При глубокой вложенности слово может разрезаться, но текст не теряется
+        assert ''.join(visible_words(*chunks)) == ''.join(visible_words(text))
+
+
+class FakeBot:
+    """Bot: записывает отправленное; errors - исключения для первых вызовов"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.calls = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        self.calls.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        message = ('message', chat_id, text)
+        self.sent.append(message)
+        return message
+
+    async def send_photo(self, chat_id, photo, caption=None, parse_mode=None):
+        self.calls.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        message = ('photo', chat_id, photo)
+        self.sent.append(message)
+        return message
+
+
+def make_outbox(bot):
+    return TelegramOutbox(bot, global_rate=1000, chat_rate=1000, chat_burst=100)
+
+
+def test_short_messages_are_merged():
+    async def scenario():
+        bot = FakeBot()
+        outbox = make_outbox(bot)
+        futures = [outbox.send(1, f'line {i}', parse_mode=None) for i in range(3)]
+        results = await asyncio.gather(*futures)
+        return bot, outbox, results
+
+    bot, outbox, results = asyncio.run(scenario())
+    assert bot.sent == [('message', 1, MERGE_SEPARATOR.join(f'line {i}' for i in range(3)))]
+    assert results == [bot.sent[0]] * 3
+    assert outbox.merged == 2
+
+
+def test_chats_are_not_merged_together():
+    async def scenario():
+        bot = FakeBot()
+        outbox = make_outbox(bot)
+        await asyncio.gather(outbox.send(1, 'a'), outbox.send(2, 'b'))
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert sorted(bot.sent) == [('message', 1, 'a'), ('message', 2, 'b')]
+
+
+def test_retry_after_waits_and_resends():
+    async def scenario():
+        bot = FakeBot([TelegramRetryAfter(None, 'Flood control exceeded', 1)])
+        outbox = make_outbox(bot)
+        result = await outbox.send(1, 'hello')
+        return bot, outbox, result
+
+    bot, outbox, result = asyncio.run(scenario())
+    assert result == ('message', 1, 'hello')
+    assert outbox.retry_after == 1
+    assert bot.calls[1] - bot.calls[0] >= 0.9
+
+
+def test_failed_send_raises_last_error(monkeypatch):
+    monkeypatch.setattr(tg_outbox, 'TG_SEND_RETRIES', 2)
+    monkeypatch.setattr(tg_outbox.random, 'uniform', lambda a, b: 0.001)
+
+    async def scenario():
+        bot = FakeBot([TelegramNetworkError(None, 'timeout')] * 2)
+        outbox = make_outbox(bot)
+        with pytest.raises(TelegramNetworkError):
+            await outbox.send_photo(1, 'file-id')
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    assert outbox.failed == 1
@@ -1,13 +1,26 @@
 import os
+import time
+import html
+import asyncio
+import inspect
 import logging
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from aiogram import Bot, Dispatcher, types
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.filters import Command
-from api import get_current_prices, get_candles, generate_chart_image, get_portfolio, post_order, get_sandbox_accounts
-from news import NewsReader
+from aiogram.filters import Command, CommandObject
+from api import get_sandbox_accounts
+from candle_store import candle_store
+from chart_render import chart_renderer
+from market_stream import market_stream
+from instruments import instrument_directory
+from news import news_store
+from orders import order_manager, STATUS_REJECTED
+from positions import position_book
+from tg_outbox import TelegramOutbox
+from tg_files import chart_files, chart_file_key, invalid_file_id
 from dotenv import load_dotenv
-from io import BytesIO
-import base64
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
@@ -18,20 +31,168 @@ TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN is not set in .env")
 
+DEFAULT_CHART_FIGI = "BBG004S68CV8"  # ВСМПО-АВИСМА
+# Сколько ждать исполнения поручения перед ответом пользователю
+ORDER_REPLY_TIMEOUT = 5
+# callback_data кнопок меню; по ним же считается статистика обработчиков
+MENU_BUTTONS = ('prices', 'news', 'chart_1h', 'chart_1d', 'portfolio', 'buy_usd_rub', 'sell_usd_rub')
+CHART_INTERVALS = {
+    '1m': 'MINUTE',
+    '5m': 'FIVE_MINUTE',
+    '15m': 'QUARTER_HOUR',
+    '1h': 'HOUR',
+    '1d': 'DAY'
+}
+
+# Потоки для блокирующих вызовов API из обработчиков
+TG_WORKERS = int(os.getenv('TG_WORKERS', 4))
+# Сколько обработчиков одного чата выполняются одновременно
+TG_CHAT_CONCURRENCY = int(os.getenv('TG_CHAT_CONCURRENCY', 2))
+TG_LATENCY_WINDOW = 500
+TG_SLOW_HANDLER = float(os.getenv('TG_SLOW_HANDLER', 3))
+
 bot = Bot(token=TELEGRAM_TOKEN)
 dp = Dispatcher(bot=bot, storage=MemoryStorage())
-news_reader = NewsReader()
+
+
+class HandlerDispatch:
+    """Выполнение обработчиков бота без блокировки event loop.
+
+    Блокирующие вызовы идут через run() в ограниченный пул потоков. На чат
+    одновременно выполняется не больше chat_limit обработчиков, повторное
+    нажатие той же кнопки, пока первое не обработано, отбрасывается. По
+    каждому обработчику собираются задержки (stats).
+    """
+
+    def __init__(self, workers=TG_WORKERS, chat_limit=TG_CHAT_CONCURRENCY, window=TG_LATENCY_WINDOW):
+        self.chat_limit = chat_limit
+        self.window = window
+        self.duplicates = 0
+        self.throttled = 0
+        self.errors = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tg-bot')
+        self._chat_load = {}
+        self._in_flight = set()
+        self._latency = {}
+
+    async def run(self, func, *args):
+        """Выполнить блокирующую функцию в пуле бота"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def handler(self, name):
+        """Декоратор обработчика aiogram; name - строка или функция от события"""
+        def decorator(handler):
+            params = set(inspect.signature(handler).parameters)
+
+            @functools.wraps(handler)
+            async def wrapper(event, **kwargs):
+                handler_name = name(event) if callable(name) else name
+                if isinstance(event, types.CallbackQuery):
+                    chat_id, press = event.message.chat.id if event.message else event.from_user.id, event.data
+                else:
+                    chat_id, press = event.chat.id, event.text
+                key = (chat_id, press)
+                if key in self._in_flight:
+                    self.duplicates += 1
+                    await self._reject(event, "Already in progress...")
+                    return
+                if self._chat_load.get(chat_id, 0) >= self.chat_limit:
+                    self.throttled += 1
+                    await self._reject(event, "Too many requests, please wait...")
+                    return
+                self._in_flight.add(key)
+                self._chat_load[chat_id] = self._chat_load.get(chat_id, 0) + 1
+                started = time.perf_counter()
+                try:
+                    return await handler(event, **{k: v for k, v in kwargs.items() if k in params})
+                except Exception as e:
+                    self.errors += 1
+                    logging.error(f"Handler {handler_name} error for chat {chat_id}: {str(e)}")
+                finally:
+                    elapsed = time.perf_counter() - started
+                    self._record(handler_name, elapsed)
+                    if elapsed > TG_SLOW_HANDLER:
+                        logging.warning(f"Slow handler {handler_name} for chat {chat_id}: {elapsed:.2f}s")
+                    self._in_flight.discard(key)
+                    self._chat_load[chat_id] -= 1
+                    if not self._chat_load[chat_id]:
+                        del self._chat_load[chat_id]
+            return wrapper
+        return decorator
+
+    @staticmethod
+    async def _reject(event, text):
+        # У CallbackQuery - всплывающее уведомление, на команду - сообщение через очередь
+        try:
+            if isinstance(event, types.CallbackQuery):
+                await event.answer(text)
+            else:
+                outbox.send(event.chat.id, text, parse_mode=None)
+        except Exception as e:
+            logging.error(f"Error answering dropped request: {str(e)}")
+
+    def _record(self, name, elapsed):
+        samples = self._latency.get(name)
+        if samples is None:
+            samples = self._latency[name] = deque(maxlen=self.window)
+        samples.append(elapsed)
+
+    def stats(self):
+        """Задержки по обработчикам (мс) и счётчики отброшенных запросов"""
+        handlers = {}
+        for name, samples in self._latency.items():
+            ordered = sorted(samples)
+            handlers[name] = {
+                'count': len(ordered),
+                'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+                'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1),
+                'max_ms': round(ordered[-1] * 1000, 1)
+            }
+        return {'handlers': handlers, 'in_flight': len(self._in_flight), 'duplicates': self.duplicates,
+                'throttled': self.throttled, 'errors': self.errors}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий диспетчер обработчиков бота
+handler_dispatch = HandlerDispatch()
+
+# Все сообщения бота идут через очередь с учётом лимитов Telegram
+outbox = TelegramOutbox(bot)
 
 async def send_message(text):
+    """Поставить уведомление в очередь; возвращает Future отправки"""
     if not TELEGRAM_CHAT_ID:
         logging.error("TELEGRAM_CHAT_ID is not set in .env")
         return
     logging.info(f"Sending message to chat {TELEGRAM_CHAT_ID}: {text[:50]}...")
-    max_length = 4096
-    for i in range(0, len(text), max_length):
-        await bot.send_message(TELEGRAM_CHAT_ID, text[i:i + max_length], parse_mode='HTML')
+    return outbox.send(TELEGRAM_CHAT_ID, text)
+
+def reply(message, text, parse_mode=None, reply_markup=None):
+    """Ответ в чат сообщения через очередь (длинный текст делится на части)"""
+    return outbox.send(message.chat.id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+def display_names(figis):
+    """Названия инструментов по figi (справочник может загружаться из API)"""
+    return {figi: instrument_directory.display_name(figi) for figi in figis}
+
+def sandbox_account_id():
+    """Счёт из TINKOFF_ACCOUNT_ID или первый счёт песочницы (запоминается в .env)"""
+    account_id = os.getenv('TINKOFF_ACCOUNT_ID')
+    if account_id:
+        return account_id
+    accounts = get_sandbox_accounts()
+    if not accounts:
+        return None
+    account_id = accounts[0]
+    with open('.env', 'a') as f:
+        f.write(f"\nTINKOFF_ACCOUNT_ID={account_id}")
+    os.environ['TINKOFF_ACCOUNT_ID'] = account_id
+    return account_id
 
 @dp.message(Command("start"))
+@handler_dispatch.handler('start')
 async def cmd_start(message: types.Message):
     logging.info(f"Received /start from chat {message.chat.id}")
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -51,57 +212,125 @@ async def cmd_start(message: types.Message):
             types.InlineKeyboardButton(text="💸 Sell USD/RUB", callback_data="sell_usd_rub")
         ]
     ])
-    await message.answer("📊 Trading Bot Menu:", reply_markup=keyboard, parse_mode='HTML')
+    reply(message, "📊 Trading Bot Menu:", parse_mode='HTML', reply_markup=keyboard)
 
-async def cmd_chart(message: types.Message, interval: str = 'HOUR'):
-    figi = "BBG004S68CV8"  # ВСМПО-АВИСМА
+async def cmd_chart(message: types.Message, interval: str = 'HOUR', figi: str = DEFAULT_CHART_FIGI):
     logging.info(f"Fetching chart for figi={figi}, interval={interval}")
-    candles = get_candles(figi, interval)
-    if not candles:
-        await message.answer("Failed to get chart data")
+    candles = await handler_dispatch.run(candle_store.get_columns, figi, interval)
+    if not len(candles['time']):
+        reply(message, "Failed to get chart data")
+        return
+    names = await handler_dispatch.run(display_names, [figi])
+    caption = f"Candlestick Chart {names[figi]} ({interval})"
+    # Тот же график уже загружен в Telegram - отправляем по file_id, без отрисовки и загрузки
+    key = chart_file_key(figi, interval, candles)
+    file_id = await handler_dispatch.run(chart_files.get, key)
+    if file_id:
+        try:
+            await outbox.send_photo(message.chat.id, file_id, caption=caption)
+            return
+        except Exception as e:
+            if not invalid_file_id(e):
+                # Таймауты и прочие ошибки не значат, что file_id устарел: повторная загрузка не поможет
+                logging.error(f"Failed to send cached chart to chat {message.chat.id}: {str(e)}")
+                return
+            logging.warning(f"Telegram rejected cached chart file_id, uploading again: {str(e)}")
+            chart_files.discard(key)
+    png = await chart_renderer.render_async(figi, interval, candles, interval)
+    if not png:
+        reply(message, "Failed to generate chart")
+        return
+    try:
+        sent = await outbox.send_photo(
+            message.chat.id,
+            types.BufferedInputFile(png, filename="chart.png"),
+            caption=caption
+        )
+    except Exception as e:
+        logging.error(f"Failed to send chart to chat {message.chat.id}: {str(e)}")
+        return
+    if sent.photo:
+        # Самый большой из размеров, созданных Telegram, - исходное изображение
+        chart_files.put(key, sent.photo[-1].file_id)
+
+@dp.message(Command("chart"))
+@handler_dispatch.handler('chart')
+async def cmd_chart_ticker(message: types.Message, command: CommandObject):
+    """/chart SBER [1h|1d|...] - график по тикеру или названию"""
+    args = (command.args or '').split()
+    if not args:
+        reply(message, "Usage: /chart TICKER [1m|5m|15m|1h|1d]")
         return
-    chart_image = generate_chart_image(candles, interval)
-    if not chart_image:
-        await message.answer("Failed to generate chart")
+    interval = CHART_INTERVALS.get(args[1].lower(), 'HOUR') if len(args) > 1 else 'HOUR'
+    figi = await handler_dispatch.run(instrument_directory.resolve, args[0])
+    if not figi:
+        reply(message, f"Instrument not found: {html.escape(args[0])}", parse_mode='HTML')
         return
-    img_data = base64.b64decode(chart_image)
-    await message.answer_photo(
-        types.InputFile(BytesIO(img_data), filename="chart.png"),
-        caption=f"Candlestick Chart ({interval})"
-    )
+    await cmd_chart(message, interval, figi)
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """/stats - задержки обработчиков бота"""
+    stats = handler_dispatch.stats()
+    lines = [f"In flight: {stats['in_flight']}, duplicates dropped: {stats['duplicates']}, "
+             f"throttled: {stats['throttled']}, errors: {stats['errors']}"]
+    for name, latency in sorted(stats['handlers'].items()):
+        lines.append(f"{html.escape(name)}: n={latency['count']} p50={latency['p50_ms']}ms "
+                     f"p99={latency['p99_ms']}ms max={latency['max_ms']}ms")
+    lines.append(f"Outbox: {outbox.stats()}")
+    lines.append(f"Chart file ids: {chart_files.stats()}")
+    reply(message, "\n".join(lines), parse_mode='HTML')
+
+# Регистрируется раньше общего обработчика, иначе тот перехватывает news_<id>
+@dp.callback_query(lambda c: c.data.startswith("news_"))
+@handler_dispatch.handler('news_item')
+async def process_news_selection(callback_query: types.CallbackQuery):
+    item = news_store.get_item(callback_query.data[len("news_"):])
+    if item:
+        # Все поля приходят из внешних лент: без экранирования Telegram отвергнет разметку
+        url = str(item['url'])
+        text = (f"<b>{html.escape(str(item['title']))}</b>\n"
+                f"Source: {html.escape(str(item['source']))}\n"
+                f"Date: {html.escape(str(item['date']))}\n"
+                f"Link: <a href=\"{html.escape(url, quote=True)}\">{html.escape(url)}</a>")
+        reply(callback_query.message, text, parse_mode='HTML')
+    else:
+        reply(callback_query.message, "News item not found.")
+    await callback_query.answer()
 
 @dp.callback_query()
+@handler_dispatch.handler(lambda callback_query: callback_query.data if callback_query.data in MENU_BUTTONS else 'unknown')
 async def process_button_click(callback_query: types.CallbackQuery):
     data = callback_query.data
     logging.info(f"Received callback query: {data}")
     await callback_query.answer()
 
     if data == "prices":
-        prices = get_current_prices()
+        # С доски стрима, пока он подключён; иначе GetLastPrices через кэш
+        prices = await handler_dispatch.run(market_stream.current_prices)
         if not prices:
-            await callback_query.message.answer("Failed to fetch prices")
+            reply(callback_query.message, "Failed to fetch prices")
             return
+        names = await handler_dispatch.run(display_names, list(prices))
         text = "📊 <b>Current Prices:</b>\n\n"
         for asset, price_info in prices.items():
-            text += f"• {asset}: {price_info['price']} RUB\n"
-        max_length = 4096
-        for i in range(0, len(text), max_length):
-            await callback_query.message.answer(text[i:i + max_length], parse_mode='HTML')
+            text += f"• {html.escape(names[asset])}: {price_info['price']} RUB\n"
+        reply(callback_query.message, text, parse_mode='HTML')
 
     elif data == "news":
-        news_items = news_reader.get_news()
+        news_items = await news_store.get_news_async()
         if not news_items:
-            await callback_query.message.answer("Failed to fetch news")
+            reply(callback_query.message, "Failed to fetch news")
             return
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[])
         for i, item in enumerate(news_items[:10], 1):
             keyboard.inline_keyboard.append([
                 types.InlineKeyboardButton(
                     text=f"{i}. {item['title'][:50]}...",
-                    callback_data=f"news_{i-1}"
+                    callback_data=f"news_{item['id']}"
                 )
             ])
-        await callback_query.message.answer("📰 <b>Latest News:</b>", parse_mode='HTML', reply_markup=keyboard)
+        reply(callback_query.message, "📰 <b>Latest News:</b>", parse_mode='HTML', reply_markup=keyboard)
 
     elif data == "chart_1h":
         await cmd_chart(callback_query.message, 'HOUR')
@@ -110,55 +339,41 @@ async def process_button_click(callback_query: types.CallbackQuery):
         await cmd_chart(callback_query.message, 'DAY')
 
     elif data == "portfolio":
-        account_id = os.getenv('TINKOFF_ACCOUNT_ID')
+        account_id = await handler_dispatch.run(sandbox_account_id)
         if not account_id:
-            accounts = get_sandbox_accounts()
-            if not accounts:
-                await callback_query.message.answer("No sandbox account found. Please create one.")
-                return
-            account_id = accounts[0]
-            with open('.env', 'a') as f:
-                f.write(f"\nTINKOFF_ACCOUNT_ID={account_id}")
-        portfolio = get_portfolio(account_id)
+            reply(callback_query.message, "No sandbox account found. Please create one.")
+            return
+        # Первое обращение загружает книгу из GetPortfolio, дальше чтение из памяти
+        try:
+            portfolio = await handler_dispatch.run(position_book.portfolio, account_id)
+        except Exception as e:
+            logging.error(f"Portfolio error: {str(e)}")
+            reply(callback_query.message, "Failed to load portfolio")
+            return
         if not portfolio['positions']:
-            await callback_query.message.answer("Portfolio is empty")
+            reply(callback_query.message, f"Portfolio is empty\nCash: {portfolio['cash']} RUB")
             return
-        text = f"💼 <b>Portfolio</b>\nTotal Amount: {portfolio['totalAmount']} RUB\n\n"
+        text = (f"💼 <b>Portfolio</b>\nTotal Amount: {portfolio['totalAmount']} RUB\n"
+                f"Cash: {portfolio['cash']} RUB\nUnrealised PnL: {portfolio['unrealised_pnl']} RUB\n\n")
+        names = await handler_dispatch.run(display_names, [pos['figi'] for pos in portfolio['positions']])
         for pos in portfolio['positions']:
-            text += f"• {pos['figi']}: {pos['quantity']} units\n"
-        max_length = 4096
-        for i in range(0, len(text), max_length):
-            await callback_query.message.answer(text[i:i + max_length], parse_mode='HTML')
+            text += (f"• {html.escape(names[pos['figi']])}: {pos['quantity']} units"
+                     f" @ {pos['average_price']}, PnL {pos['unrealised_pnl']}\n")
+        reply(callback_query.message, text, parse_mode='HTML')
 
     elif data in ["buy_usd_rub", "sell_usd_rub"]:
-        account_id = os.getenv('TINKOFF_ACCOUNT_ID')
+        account_id = await handler_dispatch.run(sandbox_account_id)
         if not account_id:
-            accounts = get_sandbox_accounts()
-            if not accounts:
-                await callback_query.message.answer("No sandbox account found. Please create one.")
-                return
-            account_id = accounts[0]
-            with open('.env', 'a') as f:
-                f.write(f"\nTINKOFF_ACCOUNT_ID={account_id}")
+            reply(callback_query.message, "No sandbox account found. Please create one.")
+            return
         figi = "BBG004S68CV8"  # ВСМПО-АВИСМА
         lots = 1
         operation = "ORDER_DIRECTION_BUY" if data == "buy_usd_rub" else "ORDER_DIRECTION_SELL"
-        result = post_order(account_id, figi, operation, lots)
-        if result:
-            await callback_query.message.answer(f"{operation} order placed: {result}")
+        # submit определяет размер лота по справочнику, который может загружаться с диска или из API
+        order = await handler_dispatch.run(order_manager.submit, account_id, figi, operation, lots)
+        # asyncio.wait не отменяет поручение по таймауту, в отличие от wait_for
+        await asyncio.wait({asyncio.wrap_future(order.future)}, timeout=ORDER_REPLY_TIMEOUT)
+        if order.status == STATUS_REJECTED:
+            reply(callback_query.message, f"Failed to place {operation} order: {order.error}")
         else:
-            await callback_query.message.answer(f"Failed to place {operation} order")
-
-@dp.callback_query(lambda c: c.data.startswith("news_"))
-async def process_news_selection(callback_query: types.CallbackQuery):
-    news_index = int(callback_query.data.split("_")[1])
-    news_items = news_reader.get_news()
-    if news_index < len(news_items):
-        item = news_items[news_index]
-        text = f"<b>{item['title']}</b>\nSource: {item['source']}\nDate: {item['date']}\nLink: {item['url']}"
-        max_length = 4096
-        for i in range(0, len(text), max_length):
-            await callback_query.message.answer(text[i:i + max_length], parse_mode='HTML')
-    else:
-        await callback_query.message.answer("News item not found.")
-    await callback_query.answer()
\ No newline at end of file
+            reply(callback_query.message, f"{operation} order {order.order_id}: {order.status}")
@@ -0,0 +1,98 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from aiogram.exceptions import TelegramBadRequest
+from db import save_file_id, delete_file_ids, load_file_ids
+
+TG_FILE_CACHE_SIZE = int(os.getenv('TG_FILE_CACHE_SIZE', 256))
+# Фрагменты текста ошибки Telegram о недействительном file_id
+INVALID_FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file_id', 'file reference')
+
+
+def chart_file_key(figi, interval, columns):
+    """Ключ графика по колонкам свечей: инструмент, интервал и последняя свеча.
+
+    Незакрытая свеча меняется без смены времени, поэтому в ключ входит и её close.
+    """
+    return f"chart:{figi}:{interval}:{columns['time'][-1]}:{float(columns['close'][-1])}"
+
+
+def invalid_file_id(error):
+    """Отклонил ли Telegram отправку из-за самого file_id (только тогда его стоит забыть)"""
+    if not isinstance(error, TelegramBadRequest):
+        return False
+    text = str(error.message).lower()
+    return any(fragment in text for fragment in INVALID_FILE_ID_ERRORS)
+
+
+class FileIdCache:
+    """file_id файлов, уже загруженных в Telegram, с вытеснением LRU.
+
+    Повторная отправка по file_id не загружает файл заново. Записи хранятся
+    в таблице telegram_files (через очередь db.storage) и переживают
+    перезапуск; при первом обращении загружаются capacity последних.
+    """
+
+    def __init__(self, capacity=TG_FILE_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            try:
+                rows = load_file_ids(self.capacity)
+            except Exception as e:
+                logging.error(f"Error loading Telegram file ids: {str(e)}")
+                rows = []
+            for key, file_id, _ in reversed(rows):
+                self._entries[key] = file_id
+        return self._entries
+
+    def get(self, key):
+        """file_id по ключу или None; обращение обновляет позицию в LRU"""
+        with self._lock:
+            entries = self._load()
+            file_id = entries.get(key)
+            if file_id is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+        save_file_id(key, file_id, time.time())
+        return file_id
+
+    def put(self, key, file_id):
+        """Запомнить file_id после загрузки файла"""
+        with self._lock:
+            entries = self._load()
+            entries[key] = file_id
+            entries.move_to_end(key)
+            self.uploads += 1
+            evicted = []
+            while len(entries) > self.capacity:
+                old_key, _ = entries.popitem(last=False)
+                evicted.append(old_key)
+        save_file_id(key, file_id, time.time())
+        if evicted:
+            delete_file_ids(evicted)
+
+    def discard(self, key):
+        """Забыть file_id, который Telegram больше не принимает"""
+        with self._lock:
+            self._load().pop(key, None)
+        delete_file_ids([key])
+
+    def stats(self):
+        return {'entries': len(self._entries or ()), 'hits': self.hits, 'misses': self.misses,
+                'uploads': self.uploads}
+
+
+# Общий кэш file_id графиков бота
+chart_files = FileIdCache()
@@ -0,0 +1,285 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from rate_limit import TokenBucket
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+# Общий лимит бота и лимиты чата (в группах - 20 сообщений в минуту)
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 30))
+TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', 1))
+TG_CHAT_BURST = int(os.getenv('TG_CHAT_BURST', 3))
+TG_GROUP_RATE = 20 / 60
+TG_SEND_RETRIES = 5
+# Сообщения короче этого склеиваются с соседними сообщениями того же чата
+MERGE_MAX_LENGTH = 1024
+MERGE_SEPARATOR = '\n'
+
+HTML_TOKEN = re.compile(r'<[^>]*>|&#?\w+;|[^<&]+|[<&]')
+TAG_NAME = re.compile(r'</?\s*([a-zA-Z][\w-]*)')
+
+
+def _close_tags(stack):
+    # У тега, не поместившегося в часть, пустой token: он не закрывается и не открывается заново
+    return ''.join(f'</{name}>' for name, tag in reversed(stack) if tag)
+
+
+def _cut(text, size):
+    """Позиция разреза text не дальше size: по переводу строки, иначе по пробелу"""
+    for separator in ('\n', ' '):
+        index = text.rfind(separator, 0, size + 1)
+        if index > 0:
+            return index
+    return 0
+
+
+def split_html(text, limit=TELEGRAM_MESSAGE_LIMIT, html=True):
+    """Разбить сообщение на части не длиннее limit.
+
+    Разрез идёт по переводу строки или пробелу и никогда не попадает внутрь
+    тега или сущности (&amp;); теги, открытые на границе, закрываются в конце
+    части и открываются заново в следующей. Тег, который не помещается даже
+    в пустую часть, отбрасывается вместе с парным закрывающим, его текст
+    сохраняется. html=False - обычный текст.
+    """
+    if len(text) <= limit:
+        return [text]
+    tokens = HTML_TOKEN.findall(text) if html else [text]
+    chunks = []
+    stack = []
+    current = ''
+
+    def flush():
+        nonlocal current
+        if current.strip() and current != ''.join(tag for _, tag in stack):
+            chunks.append(current + _close_tags(stack))
+        current = ''.join(tag for _, tag in stack)
+
+    for token in tokens:
+        if html and token.startswith('<') and len(token) > 1:
+            match = TAG_NAME.match(token)
+            name = match.group(1).lower() if match else None
+            if token.startswith('</'):
+                new_stack = stack[:]
+                for i in range(len(new_stack) - 1, -1, -1):
+                    if new_stack[i][0] == name:
+                        if not new_stack[i][1]:
+                            # Парный к отброшенному тегу
+                            token = ''
+                        del new_stack[i]
+                        break
+                else:
+                    # Закрывающий тег без открывающего Telegram не примет
+                    token = ''
+            elif name and not token.endswith('/>'):
+                new_stack = stack + [(name, token)]
+            else:
+                new_stack = stack
+            reopen = ''.join(tag for _, tag in stack)
+            if token and len(reopen) + len(token) + len(_close_tags(new_stack)) > limit:
+                # Не помещается ни в какую часть - отбрасываем разметку, текст остаётся
+                token = ''
+                if new_stack is not stack and len(new_stack) > len(stack):
+                    new_stack = stack + [(name, '')]
+            if len(current) + len(token) + len(_close_tags(new_stack)) > limit:
+                flush()
+            current += token
+            stack = new_stack
+            continue
+        if html and token.startswith('&') and len(token) > 1:
+            # Сущность не делится
+            if len(current) + len(token) + len(_close_tags(stack)) > limit:
+                flush()
+            current += token
+            continue
+        while token:
+            available = limit - len(current) - len(_close_tags(stack))
+            if len(token) <= available:
+                current += token
+                break
+            index = _cut(token, available)
+            if index == 0:
+                if current.strip() and current != ''.join(tag for _, tag in stack):
+                    # Сначала отправить накопленное, затем пробовать снова с пустой частью
+                    flush()
+                    continue
+                index = max(1, available)
+            current += token[:index]
+            token = token[index:]
+            if token[:1] in ('\n', ' '):
+                token = token[1:]
+            flush()
+    flush()
+    return chunks or [text[:limit]]
+
+
+class OutgoingMessage:
+    __slots__ = ('kind', 'chat_id', 'text', 'parse_mode', 'reply_markup', 'photo', 'futures', 'attempts')
+
+    def __init__(self, kind, chat_id, text, parse_mode=None, reply_markup=None, photo=None, future=None):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.photo = photo
+        self.futures = [future] if future is not None else []
+        self.attempts = 0
+
+    def mergeable(self):
+        return self.kind == 'text' and self.reply_markup is None and len(self.text) < MERGE_MAX_LENGTH
+
+
+class TelegramOutbox:
+    """Очередь исходящих сообщений бота с учётом лимитов Telegram.
+
+    Общий token bucket ограничивает бота целиком, bucket чата - отдельный
+    чат; чаты обслуживаются параллельно, каждый своей задачей. Подряд идущие
+    короткие сообщения одного чата склеиваются, длинные делятся по
+    границам HTML. При RetryAfter чат ждёт указанное время и сообщение
+    отправляется снова.
+    """
+
+    def __init__(self, bot, global_rate=TG_GLOBAL_RATE, chat_rate=TG_CHAT_RATE, chat_burst=TG_CHAT_BURST):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+        self.failed = 0
+        self._queues = {}
+        self._buckets = {}
+        self._workers = {}
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал
+            rate = TG_GROUP_RATE if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _enqueue(self, items, future):
+        chat_id = items[0].chat_id
+        items[-1].futures.append(future)
+        # Ответ обычно не ждут: ошибка не должна попадать в лог как "never retrieved"
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._queues.setdefault(chat_id, deque()).extend(items)
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._run(chat_id))
+        return future
+
+    def send(self, chat_id, text, parse_mode='HTML', reply_markup=None):
+        """Поставить текст в очередь; Future с последним отправленным Message.
+
+        Если отправить не удалось, Future завершается исключением последней попытки.
+        """
+        future = asyncio.get_running_loop().create_future()
+        chunks = split_html(text, html=parse_mode == 'HTML')
+        items = [OutgoingMessage('text', chat_id, chunk, parse_mode) for chunk in chunks]
+        # Клавиатура - у последней части
+        items[-1].reply_markup = reply_markup
+        return self._enqueue(items, future)
+
+    def send_photo(self, chat_id, photo, caption=None, parse_mode=None):
+        future = asyncio.get_running_loop().create_future()
+        caption = caption[:TELEGRAM_CAPTION_LIMIT] if caption else caption
+        return self._enqueue([OutgoingMessage('photo', chat_id, caption, parse_mode, photo=photo)], future)
+
+    async def broadcast(self, chat_ids, text, parse_mode='HTML'):
+        """Отправить текст в несколько чатов параллельно; Message или исключение по каждому чату"""
+        return await asyncio.gather(*(self.send(chat_id, text, parse_mode) for chat_id in chat_ids),
+                                    return_exceptions=True)
+
+    def _next(self, queue):
+        item = queue.popleft()
+        if not item.mergeable():
+            return item
+        text, futures = item.text, list(item.futures)
+        while queue and queue[0].mergeable() and queue[0].parse_mode == item.parse_mode \
+                and len(text) + len(MERGE_SEPARATOR) + len(queue[0].text) <= TELEGRAM_MESSAGE_LIMIT:
+            following = queue.popleft()
+            text += MERGE_SEPARATOR + following.text
+            futures.extend(following.futures)
+            self.merged += 1
+        merged = OutgoingMessage('text', item.chat_id, text, item.parse_mode)
+        merged.futures = futures
+        return merged
+
+    async def _acquire(self, chat_id):
+        bucket = self._bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now), self.global_bucket.wait_time(now))
+            if wait == 0:
+                bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(wait)
+
+    async def _deliver(self, item):
+        if item.kind == 'photo':
+            return await self.bot.send_photo(item.chat_id, item.photo, caption=item.text, parse_mode=item.parse_mode)
+        return await self.bot.send_message(item.chat_id, item.text, parse_mode=item.parse_mode,
+                                           reply_markup=item.reply_markup)
+
+    async def _run(self, chat_id):
+        queue = self._queues[chat_id]
+        while queue:
+            # Склейка после ожидания лимита захватывает и то, что пришло за это время
+            await self._acquire(chat_id)
+            item = self._next(queue)
+            result = error = None
+            while True:
+                try:
+                    result, error = await self._deliver(item), None
+                    self.sent += 1
+                    break
+                except TelegramRetryAfter as e:
+                    error = e
+                    self.retry_after += 1
+                    item.attempts += 1
+                    logging.warning(f"Telegram flood limit for chat {chat_id}, retry after {e.retry_after}s")
+                    self._bucket(chat_id).blocked_until = time.monotonic() + e.retry_after
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    error = e
+                    item.attempts += 1
+                    logging.warning(f"Telegram send error for chat {chat_id}: {str(e)}")
+                    await asyncio.sleep(min(30, 2 ** item.attempts) * random.uniform(0.5, 1))
+                except Exception as e:
+                    error = e
+                    logging.error(f"Failed to send message to chat {chat_id}: {str(e)}")
+                    self.failed += 1
+                    break
+                if item.attempts >= TG_SEND_RETRIES:
+                    logging.error(f"Giving up sending message to chat {chat_id} after {item.attempts} attempts")
+                    self.failed += 1
+                    break
+                await self._acquire(chat_id)
+            for future in item.futures:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        del self._queues[chat_id]
+        self._workers.pop(chat_id, None)
+
+    async def flush(self, timeout=10):
+        """Дождаться отправки всего, что стоит в очереди"""
+        workers = [worker for worker in self._workers.values() if not worker.done()]
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    def stats(self):
+        return {'sent': self.sent, 'merged': self.merged, 'retry_after': self.retry_after, 'failed': self.failed,
+                'queued': sum(len(queue) for queue in self._queues.values())}
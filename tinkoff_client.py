@@ -0,0 +1,185 @@
+import os
+import json
+import atexit
+import asyncio
+import threading
+import logging
+import aiohttp
+from dotenv import load_dotenv
+from rate_limit import RateLimiter, MAX_RETRIES, retry_delay
+
+load_dotenv()
+
+# Конфигурация
+TINKOFF_TOKEN = os.getenv('TINKOFF_SANDBOX_TOKEN')
+BASE_URL = os.getenv('TINKOFF_BASE_URL', 'https://sandbox-invest-public-api.tinkoff.ru/rest')
+SERVICE_PREFIX = 'tinkoff.public.invest.api.contract.v1.'
+REQUEST_TIMEOUT = float(os.getenv('TINKOFF_TIMEOUT', 10))
+CONNECT_TIMEOUT = float(os.getenv('TINKOFF_CONNECT_TIMEOUT', 5))
+POOL_SIZE = int(os.getenv('TINKOFF_POOL_SIZE', 20))
+# Изменяющие методы, которые можно повторить: PostOrder идемпотентен по orderId
+IDEMPOTENT_METHODS = {'OrdersService/PostOrder'}
+
+
+def is_idempotent(method):
+    """Повтор метода после потерянного ответа не меняет результат (чтение или PostOrder)"""
+    name = method.split('/')[-1]
+    return name.startswith('Get') or method.startswith('InstrumentsService/') or method in IDEMPOTENT_METHODS
+
+
+class TinkoffAPIError(Exception):
+    """Ошибка HTTP-ответа Tinkoff Invest API"""
+
+    def __init__(self, status, text, method=None, headers=None):
+        super().__init__(f"{status} Error for method {method}")
+        self.status = status
+        self.text = text
+        self.method = method
+        self.headers = {key.lower(): value for key, value in (headers or {}).items()}
+
+
+def rate_limit_reset(error):
+    """Секунды до сброса лимита из x-ratelimit-reset (None, если заголовка нет или он испорчен)"""
+    if not isinstance(error, TinkoffAPIError):
+        return None
+    reset = error.headers.get('x-ratelimit-reset')
+    try:
+        return float(reset) if reset else None
+    except ValueError:
+        logging.warning(f"Malformed x-ratelimit-reset header: {reset!r}")
+        return None
+
+
+class TinkoffClient:
+    """Асинхронный REST-клиент Tinkoff Invest API с общим пулом keep-alive соединений.
+
+    Клиент живёт в собственном event loop в фоновом потоке, поэтому одной
+    сессией пользуются и корутины aiogram (call), и потоки Socket.IO (call_sync).
+    """
+
+    def __init__(self, token=TINKOFF_TOKEN, base_url=BASE_URL, timeout=REQUEST_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, pool_size=POOL_SIZE, limiter=None, max_retries=MAX_RETRIES):
+        self.token = token
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        """Запустить фоновый event loop клиента при первом обращении"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='tinkoff-client', daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60,
+                                             ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                json_serialize=json.dumps
+            )
+        return self._session
+
+    async def _request(self, method, payload):
+        session = self._get_session()
+        url = f"{self.base_url}/{SERVICE_PREFIX}{method}"
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire(method)
+            try:
+                async with session.post(url, json=payload) as response:
+                    text = await response.text()
+                    if self.limiter is not None:
+                        self.limiter.update(method, response.headers)
+                    if response.status < 400:
+                        return json.loads(text) if text else {}
+                    error = TinkoffAPIError(response.status, text, method, dict(response.headers))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            # 429 и 503 отдаются до выполнения запроса - их повторяем для всех методов; после
+            # остальных 5xx, обрыва соединения или таймаута запрос мог быть выполнен, поэтому
+            # повторяем только идемпотентные методы (не SandboxPayIn)
+            if isinstance(error, TinkoffAPIError) and error.status in (429, 503):
+                retryable = True
+            elif isinstance(error, TinkoffAPIError):
+                retryable = error.status >= 500 and is_idempotent(method)
+            else:
+                retryable = is_idempotent(method)
+            if not retryable or attempt >= self.max_retries:
+                raise error
+            delay = retry_delay(attempt, rate_limit_reset(error))
+            logging.warning(f"Retrying {method} in {delay:.2f}s after error: {str(error)}")
+            if self.limiter is not None:
+                self.limiter.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _running_loop(self):
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    async def call(self, method, payload=None):
+        """Вызвать метод API, например 'MarketDataService/GetLastPrices', из любого event loop"""
+        loop = self._ensure_loop()
+        coro = self._request(method, payload or {})
+        if self._running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def run_coroutine(self, coro):
+        """Выполнить корутину в loop клиента; возвращает concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def call_sync(self, method, payload=None):
+        """Синхронный фасад для кода без event loop (Flask/Socket.IO, trade_loop)"""
+        loop = self._ensure_loop()
+        if self._running_loop() is loop:
+            raise RuntimeError("call_sync() cannot be used inside the client event loop, use call()")
+        future = asyncio.run_coroutine_threadsafe(self._request(method, payload or {}), loop)
+        return future.result()
+
+    async def _close_session(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def close(self):
+        """Закрыть пул соединений и остановить фоновый loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None or loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(timeout=5)
+        except Exception as e:
+            logging.error(f"Error closing Tinkoff client session: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        loop.close()
+
+
+# Общий клиент и ограничитель запросов для всех вызовов api.py
+client = TinkoffClient(limiter=RateLimiter())
+atexit.register(client.close)
@@ -1,47 +1,164 @@
+import math
 import logging
-from api import get_portfolio, post_order, get_orders
+import numpy as np
+from api import get_orders, CANDLE_INTERVALS
+from archive import candle_columns
+from candle_store import candle_store
+from orders import order_manager
+from positions import position_book
 
-def trade_loop(account_id):
+
+class Strategy:
+    """Торговая логика: по портфелю и последним свечам решает, какие поручения отправить.
+
+    decide() выполняется одинаково в торговле (trade_loop) и в пошаговом бэктесте;
+    target_lots() нужен для векторного бэктеста.
+    """
+
+    figi = None
+    interval = 'HOUR'
+    # Сколько последних свечей нужно decide(); 0 - свечи не нужны
+    lookback = 0
+
+    def decide(self, portfolio, candles):
+        """Список поручений (figi, 'Buy'/'Sell', lots).
+
+        portfolio - как PositionBook.portfolio (у позиций есть lots);
+        candles - колонки decode_candles, последняя свеча - текущая.
+        """
+        return []
+
+    def target_lots(self, candles):
+        """Желаемая позиция в лотах после закрытия каждой свечи (массив)"""
+        raise NotImplementedError(f"{type(self).__name__} does not support vectorized backtests")
+
+    def position_lots(self, portfolio):
+        for position in portfolio['positions']:
+            if position['figi'] == self.figi:
+                return position['lots']
+        return 0
+
+    def orders_to(self, portfolio, target):
+        """Поручение, приводящее позицию по figi к target лотам"""
+        current = self.position_lots(portfolio)
+        if target > current:
+            return [(self.figi, 'Buy', int(target - current))]
+        if target < current:
+            return [(self.figi, 'Sell', int(current - target))]
+        return []
+
+
+class FlipStrategy(Strategy):
+    """Прежняя логика trade_loop для своего figi: без позиции и с деньгами - покупаем, с позицией - закрываем её"""
+
+    interval = 'MINUTE'
+
+    def __init__(self, figi="BBG0013HGFT4", lots=1, min_amount=1000):
+        self.figi = figi  # FIGI для USD/RUB
+        self.lots = lots
+        self.min_amount = min_amount
+
+    def decide(self, portfolio, candles):
+        # Позиции других инструментов принадлежат другим стратегиям того же задания
+        if self.position_lots(portfolio) == 0 and portfolio['totalAmount'] > self.min_amount:
+            return [(self.figi, 'Buy', self.lots)]
+        return self.orders_to(portfolio, 0)
+
+    def target_lots(self, candles):
+        # Покупка и продажа чередуются на каждом шаге
+        return np.where(np.arange(len(candles['close'])) % 2 == 0, self.lots, 0)
+
+
+class SmaCrossStrategy(Strategy):
+    """В позиции, пока быстрая скользящая средняя выше медленной"""
+
+    def __init__(self, figi, fast=10, slow=30, lots=1, interval='HOUR'):
+        self.figi = figi
+        self.fast = fast
+        self.slow = slow
+        self.lots = lots
+        self.interval = interval
+        self.lookback = slow
+
+    def decide(self, portfolio, candles):
+        close = candles['close']
+        if len(close) < self.slow:
+            return []
+        target = self.lots if close[-self.fast:].mean() > close[-self.slow:].mean() else 0
+        return self.orders_to(portfolio, target)
+
+    def target_lots(self, candles):
+        close = np.asarray(candles['close'], dtype=np.float64)
+        target = np.zeros(len(close), dtype=np.int64)
+        if len(close) < self.slow:
+            return target
+        windows = np.lib.stride_tricks.sliding_window_view
+        fast = windows(close, self.fast).mean(axis=1)[self.slow - self.fast:]
+        slow = windows(close, self.slow).mean(axis=1)
+        target[self.slow - 1:] = np.where(fast > slow, self.lots, 0)
+        return target
+
+
+# Стратегии, доступные для запуска из веб-интерфейса
+STRATEGIES = {
+    'flip': FlipStrategy,
+    'sma': SmaCrossStrategy
+}
+
+
+def make_strategies(name, figis=None, params=None):
+    """Экземпляры стратегии name для каждого figi (или один с figi по умолчанию)"""
+    strategy_class = STRATEGIES[name]
+    params = params or {}
+    if not figis:
+        return [strategy_class(**params)]
+    return [strategy_class(figi=figi, **params) for figi in figis]
+
+
+class LiveBroker:
+    """Исполнение решений стратегии в песочнице через API"""
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+
+    def portfolio(self):
+        return position_book.portfolio(self.account_id)
+
+    def candles(self, strategy):
+        if not strategy.lookback:
+            return None
+        # С запасом на ночи и выходные, когда свечей нет
+        period = CANDLE_INTERVALS[strategy.interval.upper()] * strategy.lookback * 3
+        candles = candle_store.get_columns(strategy.figi, strategy.interval, days=max(1, math.ceil(period.total_seconds() / 86400)))
+        return candle_columns(candles)
+
+    def post_order(self, figi, operation, lots):
+        """Отправить поручение без ожидания ответа; возвращает orders.Order"""
+        order = order_manager.submit(self.account_id, figi, operation, lots)
+        logging.info(f"{operation} order submitted: {figi} x{lots}, orderId={order.order_id}")
+        return order
+
+
+def run_step(strategy, broker):
+    """Один шаг стратегии: портфель и свечи от брокера, решение, поручения"""
+    portfolio = broker.portfolio()
+    orders = strategy.decide(portfolio, broker.candles(strategy))
+    for figi, operation, lots in orders:
+        broker.post_order(figi, operation, lots)
+    return orders
+
+
+def trade_loop(account_id, strategy=None):
     """Основной цикл торговли"""
     try:
-        # 1. Проверяем текущий портфель
-        portfolio = get_portfolio(account_id)
-        logging.info(f"Current portfolio: {portfolio}")
-        
-        # 2. Получаем список активных ордеров
+        broker = LiveBroker(account_id)
+        logging.info(f"Current portfolio: {broker.portfolio()}")
+
         active_orders = get_orders(account_id)
         logging.info(f"Active orders: {len(active_orders)}")
-        
-        # 3. Пример простой торговой логики:
-        # Если у нас есть RUB и нет активов - покупаем
-        # Если есть активы - продаем
-        
-        total_rub = float(portfolio['totalAmount'])
-        positions = portfolio['positions']
-        
-        if total_rub > 1000 and not positions:
-            # Пример: покупаем USD/RUB
-            figi = "BBG0013HGFT4"  # FIGI для USD/RUB
-            order_response = post_order(
-                account_id=account_id,
-                figi=figi,
-                operation="Buy",
-                lots=1  # 1 лот = 1 доллар
-            )
-            logging.info(f"Buy order placed: {order_response}")
-            
-        elif positions:
-            # Продаем все позиции
-            for position in positions:
-                order_response = post_order(
-                    account_id=account_id,
-                    figi=position['figi'],
-                    operation="Sell",
-                    lots=position['quantity']
-                )
-                logging.info(f"Sell order placed: {order_response}")
-        
+
+        run_step(strategy or FlipStrategy(), broker)
         return True
     except Exception as e:
         logging.error(f"Trade error: {str(e)}")
-        return False
\ No newline at end of file
+        return False